@@ -1,18 +1,32 @@
 from flask import Flask
 from .config import Config
 from .logger import setup_logging
-from .db import db, init_db
+from .db import init_db, setup_engines
 from .routes import api_bp
+from . import jobs, schedule, emailer, reminders, cache, metrics, changes, analytics, shards, admission
+from . import archive  # noqa: F401 - registers the archive-appointments job
 
-def create_app(testing: bool = False):
+def create_app(testing: bool = False, config: dict = None):
     app = Flask(__name__)
     app.config.from_object(Config())
     if testing:
         app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI="sqlite:///:memory:")
+    if config:
+        app.config.update(config)
     setup_logging(app)
-    db.init_app(app)
+    setup_engines(app)
     with app.app_context():
         init_db()
+    shards.init_app(app)
+    metrics.init_app(app)
+    cache.init_app(app)
+    jobs.init_app(app)
+    schedule.init_app(app)
+    emailer.init_app(app)
+    reminders.init_app(app)
+    changes.init_app(app)
+    analytics.init_app(app)
+    admission.init_app(app)
     app.register_blueprint(api_bp, url_prefix="/api")
     @app.get("/health")
     def health():
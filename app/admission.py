@@ -0,0 +1,259 @@
+"""
+Admission Control
+
+Load shedding for the API blueprint, per worker process. Every request is
+put in a priority class by ``"<METHODS> <path pattern>=<class>"`` rules
+(ADMISSION_CLASSES, then the built-in ``DEFAULT_RULES``; first match
+wins):
+
+- ``high``: bookings and the writes around them;
+- ``normal``: single-entity reads and other writes;
+- ``low``: full-table lists, analytics, bulk imports and jobs;
+- ``exempt``: long polls and stats endpoints, never limited.
+
+Each class may fill only its share of ADMISSION_MAX_CONCURRENT slots
+(ADMISSION_CLASS_SHARES), so the remaining slots stay free for higher
+classes, and a waiting request is never admitted ahead of a waiting
+request of a higher class. Routes matching an ADMISSION_ROUTE_LIMITS
+pattern additionally share a fixed number of slots.
+
+A request that finds no free slot waits up to ADMISSION_QUEUE_TIMEOUT
+seconds. It is refused at once, with 503 and ``Retry-After``, when its
+class's queue is full or the queue ahead of it would take longer than
+that to drain at the average request time, and with 429 when its client
+(remote address, or the ADMISSION_CLIENT_HEADER value) has used up its
+token bucket. Refusals are counted by reason and class, see ``stats()``,
+``/api/admission/stats`` and ``/metrics``.
+
+A streamed response keeps its slot until its body is sent.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from fnmatch import translate
+from flask import current_app, g, has_app_context, jsonify, request
+
+CLASSES = ("high", "normal", "low")  # in priority order
+EXEMPT = "exempt"
+
+DEFAULT_RULES = (
+    ("GET /api/changes", EXEMPT),  # long polls would hold a slot while idle
+    ("GET /api/*/stats", EXEMPT),
+    ("* /api/metrics/*", EXEMPT),
+    ("POST /api/appointments", "high"),
+    ("PUT|PATCH|DELETE /api/appointments/*", "high"),
+    ("GET /api/doctors/*/free-slots", "high"),
+    ("POST /api/patients", "high"),
+    ("GET /api/patients|/api/doctors|/api/appointments", "low"),
+    ("GET /api/archive/appointments", "low"),
+    ("GET /api/analytics/*", "low"),
+    ("GET /api/info/*", "low"),
+    ("POST /api/*/bulk", "low"),
+    ("* /api/jobs*", "low"),
+    ("*", "normal"),
+)
+
+class Rejected(Exception):
+    """A request refused by admission control."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__({429: "Too many requests from this client",
+                          503: "Server busy, retry later"}[status])
+        self.status, self.reason = status, reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def parse_pairs(value: str, convert=str) -> list:
+    """Parses ``pattern=value,pattern=value`` into ``[(pattern, value), ...]``.
+
+    Raises:
+        ValueError: If a pair is malformed.
+    """
+    pairs = []
+    for pair in filter(None, (p.strip() for p in (value or "").split(","))):
+        pattern, sep, item = pair.rpartition("=")
+        if not sep or not pattern.strip():
+            raise ValueError(f"Invalid admission rule '{pair}': expected <pattern>=<value>")
+        pairs.append((pattern.strip(), convert(item.strip())))
+    return pairs
+
+def _compile(pattern: str):
+    """``"GET|POST /api/x/*"`` (methods optional) to a regex over ``"<METHOD> <path>"``."""
+    methods, _, paths = pattern.rpartition(" ")
+    methods = "|".join(re.escape(m) for m in methods.split("|")) if methods and methods != "*" else r"\S+"
+    paths = "|".join(translate(p)[4:-3] for p in paths.split("|"))  # strip (?s:...)\Z
+    return re.compile(rf"(?:{methods}) (?:{paths})\Z", re.S)
+
+class AdmissionController:
+    """Priority classes, concurrency slots, wait queue and client buckets."""
+
+    def __init__(self, max_concurrent=32, shares=None, rules=(), route_limits=(), queue_depth=64,
+                 queue_timeout=2.0, client_rate=0, client_burst=0, max_clients=10000):
+        for cls in (*(c for _, c in rules), *(shares or {})):
+            if cls not in CLASSES and cls != EXEMPT:
+                raise ValueError(f"Unknown admission class '{cls}': expected one of {', '.join(CLASSES)}")
+        shares = {"high": 1.0, "normal": 0.75, "low": 0.25, **(shares or {})}
+        self.max_concurrent = max_concurrent
+        self.caps = {cls: max(1, round(max_concurrent * shares[cls])) for cls in CLASSES}
+        self.queue_caps = {cls: max(1, round(queue_depth * shares[cls])) for cls in CLASSES}
+        self.queue_timeout = queue_timeout
+        self.client_rate, self.client_burst = client_rate, max(client_burst, 1)
+        self.max_clients = max_clients
+        self._rules = [(_compile(p), cls) for p, cls in (*rules, *DEFAULT_RULES)]
+        self._route_limits = [(_compile(p), p, int(n)) for p, n in route_limits]
+        self._cond = threading.Condition()
+        self._buckets = OrderedDict()  # client -> (tokens, last refill)
+        self._service = 0.05  # moving average of the time a request holds its slot
+        self.running = Counter()  # class -> requests holding a slot
+        self.by_route = Counter()  # route limit pattern -> requests holding one of its slots
+        self.waiting = Counter()
+        self.admitted = Counter()
+        self.shed = Counter()  # (reason, class) -> n
+
+    def classify(self, method: str, path: str):
+        """Returns the class of a request and the route limit pattern it counts against."""
+        key = f"{method} {path}"
+        cls = next(cls for regex, cls in self._rules if regex.match(key))
+        route = next((p for regex, p, _ in self._route_limits if regex.match(key)), None)
+        return cls, route
+
+    def acquire(self, cls: str, route=None, client=None):
+        """Waits for a slot for a request of class ``cls``.
+
+        Returns:
+            tuple: The ticket to give back to release().
+
+        Raises:
+            Rejected: If the request is shed.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if client is not None and self.client_rate > 0:
+                wait = self._take_token(client, now)
+                if wait:
+                    self._shed(429, "rate_limited", cls, wait)
+            if not self._fits(cls, route):
+                ahead = sum(self.waiting[c] for c in CLASSES[:CLASSES.index(cls) + 1])
+                if self.waiting[cls] >= self.queue_caps[cls]:
+                    self._shed(503, "queue_full", cls, self._drain_time(ahead))
+                if self._drain_time(ahead + 1) > self.queue_timeout:
+                    self._shed(503, "overloaded", cls, self._drain_time(ahead + 1))
+                deadline = now + self.queue_timeout
+                self.waiting[cls] += 1
+                try:
+                    while not self._fits(cls, route):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed(503, "timeout", cls, self._drain_time(ahead))
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting[cls] -= 1
+            self.running[cls] += 1
+            if route is not None:
+                self.by_route[route] += 1
+            self.admitted[cls] += 1
+            return cls, route, time.perf_counter()
+
+    def release(self, ticket):
+        cls, route, started = ticket
+        with self._cond:
+            self.running[cls] -= 1
+            if route is not None:
+                self.by_route[route] -= 1
+            self._service += (time.perf_counter() - started - self._service) * 0.1
+            if any(self.waiting.values()):
+                self._cond.notify_all()
+
+    def _fits(self, cls, route) -> bool:
+        if sum(self.running.values()) >= self.caps[cls]:
+            return False
+        if route is not None and self.by_route[route] >= self._limit(route):
+            return False
+        return not any(self.waiting[c] for c in CLASSES[:CLASSES.index(cls)])
+
+    def _limit(self, route) -> int:
+        return next(n for _, p, n in self._route_limits if p == route)
+
+    def _drain_time(self, ahead: int) -> float:
+        """Seconds until ``ahead`` queued requests have been admitted, at the average request time."""
+        return ahead * self._service / self.max_concurrent
+
+    def _take_token(self, client, now) -> float:
+        """Takes one token from ``client``'s bucket; returns 0, or the seconds until one is available."""
+        tokens, stamp = self._buckets.pop(client, (self.client_burst, now))
+        tokens = min(self.client_burst, tokens + (now - stamp) * self.client_rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.client_rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def _shed(self, status, reason, cls, retry_after):
+        self.shed[reason, cls] += 1
+        raise Rejected(status, reason, retry_after)
+
+    def stats(self) -> dict:
+        with self._cond:
+            shed = {}
+            for (reason, cls), n in sorted(self.shed.items()):
+                shed.setdefault(reason, {})[cls] = n
+            return {
+                "enabled": True,
+                "max_concurrent": self.max_concurrent,
+                "slots": dict(self.caps),
+                "running": {cls: self.running[cls] for cls in CLASSES},
+                "waiting": {cls: self.waiting[cls] for cls in CLASSES},
+                "admitted": {cls: self.admitted[cls] for cls in CLASSES},
+                "shed": shed,
+                "avg_request_ms": round(self._service * 1000, 2),
+                "clients": len(self._buckets),
+            }
+
+# ------------------ Hooks ------------------
+
+def _client():
+    header = current_app.config["ADMISSION_CLIENT_HEADER"]
+    value = request.headers.get(header) if header else None
+    return value.split(",")[0].strip() if value else request.remote_addr
+
+def admit():
+    controller = get_controller()
+    if controller is None:
+        return None
+    cls, route = controller.classify(request.method, request.path)
+    if cls == EXEMPT:
+        return None
+    try:
+        g.hms_admission = controller.acquire(cls, route, _client())
+    except Rejected as err:
+        resp = jsonify({"error": str(err), "reason": err.reason})
+        resp.status_code = err.status
+        resp.headers["Retry-After"] = str(err.retry_after)
+        return resp
+    return None
+
+def release(exc=None):
+    ticket = g.pop("hms_admission", None)
+    if ticket is not None:
+        get_controller().release(ticket)
+
+def init_app(app):
+    cfg = app.config
+    if not cfg["ADMISSION_ENABLED"]:
+        app.extensions["hms_admission"] = None
+        return
+    app.extensions["hms_admission"] = AdmissionController(
+        max_concurrent=cfg["ADMISSION_MAX_CONCURRENT"],
+        shares=dict(parse_pairs(cfg["ADMISSION_CLASS_SHARES"], float)),
+        rules=parse_pairs(cfg["ADMISSION_CLASSES"]),
+        route_limits=parse_pairs(cfg["ADMISSION_ROUTE_LIMITS"], int),
+        queue_depth=cfg["ADMISSION_QUEUE_DEPTH"], queue_timeout=cfg["ADMISSION_QUEUE_TIMEOUT"],
+        client_rate=cfg["ADMISSION_CLIENT_RATE"], client_burst=cfg["ADMISSION_CLIENT_BURST"])
+
+def get_controller():
+    return current_app.extensions.get("hms_admission") if has_app_context() else None
@@ -0,0 +1,390 @@
+"""
+Cohort Analytics (Columnar Snapshot)
+
+Ad-hoc group-by questions (age distribution by gender, visits per
+specialty per month, no-show rates) are answered from an in-memory copy
+of the handful of fields they need, kept column by column in typed arrays
+(``array``: 2-8 bytes per value, no per-row objects):
+
+* patients: ``dob`` as a ``yyyymmdd`` integer (so an age is one
+  subtraction and a division, with the same birthday rule as
+  ``Patient.age``) and ``gender`` as a small code;
+* doctors: ``specialty`` as a code;
+* appointments, hot and archived alike: ``doctor_id``, ``visit_time`` as a
+  ``yyyymmddHHMM`` integer (the month is a division) and ``status`` as a
+  code.
+
+Rows are kept in ID order and found by binary search. The snapshot is
+loaded with keyset-paginated reads on the first query (shard by shard,
+in ID order, see shards.py) and then follows
+``change_log``: every query first re-reads the rows logged since the last
+one (a row that is gone is dropped), so it never falls behind committed
+writes, including deletes, which ``updated_at`` alone would miss.
+
+A query copies the columns it reads while holding the snapshot's lock
+(a ``memcpy`` per column) and counts outside it, so queries and refreshes
+do not wait for each other's counting. With NumPy installed, filters and
+group keys are computed over whole columns and counted with
+``numpy.unique``; without it the same functions are mapped over each
+column and the key tuples counted by ``Counter``, with no per-row objects.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import date, datetime
+from itertools import compress, repeat
+from operator import and_
+from flask import current_app
+from .db import db, read_execute, SHARDED_TABLES
+from .models import Patient, Doctor, Appointment, ArchivedAppointment, ChangeLog
+from .exceptions import BadRequestError
+from . import shards
+
+try:
+    import numpy as np  # optional dependency
+except ImportError:
+    np = None
+
+PATIENT_DIMENSIONS = ("gender", "age")
+APPOINTMENT_DIMENSIONS = ("status", "doctor", "specialty", "month")
+ABSENT = -2  # matches no code; -1 is a specialty lookup that found no doctor
+
+def _day(d: date) -> int:
+    return (d.year * 100 + d.month) * 100 + d.day
+
+def _minute(dt: datetime) -> int:
+    return _day(dt) * 10000 + dt.hour * 100 + dt.minute
+
+class Codes:
+    """Interns the distinct values of a text column as small integers."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def find(self, value) -> int:
+        """The code of ``value``, or ``ABSENT`` if no row has it."""
+        return self._codes.get(value, ABSENT)
+
+class Columns:
+    """One typed array per field plus ``id``, with rows in ID order."""
+
+    def __init__(self, **typecodes):
+        self.data = {"id": array("q"), **{name: array(code) for name, code in typecodes.items()}}
+
+    def __len__(self):
+        return len(self.data["id"])
+
+    def nbytes(self) -> int:
+        return sum(col.itemsize * len(col) for col in self.data.values())
+
+    def put(self, rows):
+        """Inserts or overwrites ``(id, *values)`` rows."""
+        ids, cols = self.data["id"], list(self.data.values())
+        for row in rows:
+            if not ids or row[0] > ids[-1]:
+                for col, value in zip(cols, row):
+                    col.append(value)
+                continue
+            i = bisect_left(ids, row[0])
+            if ids[i] == row[0]:
+                for col, value in zip(cols, row):
+                    col[i] = value
+            else:
+                for col, value in zip(cols, row):
+                    col.insert(i, value)
+
+    def remove(self, ids):
+        """Drops the rows with these IDs; unknown IDs are ignored."""
+        found = []
+        for rid in ids:
+            i = bisect_left(self.data["id"], rid)
+            if i < len(self) and self.data["id"][i] == rid:
+                found.append(i)
+        if not found:
+            return
+        # One compaction pass per column: the runs of rows between the
+        # dropped ones are copied slice by slice
+        found.sort()
+        runs = list(zip([0] + [i + 1 for i in found], found + [len(self)]))
+        for name, col in self.data.items():
+            kept = array(col.typecode)
+            for start, end in runs:
+                kept += col[start:end]
+            self.data[name] = kept
+
+    def copy(self, names) -> dict:
+        """Copies of the ``id`` column and the columns ``names``."""
+        return {name: self.data[name][:] for name in ("id", *names)}
+
+def _select_patients(where):
+    return db.select(Patient.id, Patient.dob, Patient.gender).where(where(Patient))
+
+def _select_doctors(where):
+    return db.select(Doctor.id, Doctor.specialty).where(where(Doctor))
+
+def _select_appointments(where):
+    return db.union_all(*(db.select(m.id, m.doctor_id, m.visit_time, m.status).where(where(m))
+                          for m in (Appointment, ArchivedAppointment)))
+
+class Snapshot:
+    """Columnar copy of the fields the analytics queries group and filter by."""
+
+    def __init__(self, chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.cursor = None  # the last change_log entry applied; None until loaded
+        self._lock = threading.Lock()
+        self.genders, self.statuses, self.specialties = Codes(), Codes(), Codes()
+        self.patients = Columns(dob="i", gender="h")
+        self.doctors = Columns(specialty="i")
+        self.appointments = Columns(doctor_id="i", visit="q", status="h")
+        self._tables = {
+            "patients": (self.patients, _select_patients,
+                         lambda r: (r.id, _day(r.dob), self.genders.code(r.gender))),
+            "doctors": (self.doctors, _select_doctors,
+                        lambda r: (r.id, self.specialties.code(r.specialty))),
+            "appointments": (self.appointments, _select_appointments,
+                             lambda r: (r.id, r.doctor_id, _minute(r.visit_time), self.statuses.code(r.status))),
+        }
+
+    # --- loading ---
+
+    def _refresh(self):
+        if self.cursor is None:
+            # Changes logged while the tables are read are applied again by the
+            # next refresh; applying a change twice is harmless.
+            self.cursor = read_execute(db.select(db.func.max(ChangeLog.id))).scalar() or 0
+            for name in self._tables:
+                self._load(name)
+            return
+        while True:
+            rows = read_execute(db.select(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id)
+                                .where(ChangeLog.id > self.cursor).order_by(ChangeLog.id)
+                                .limit(self.chunk_size)).all()
+            touched = {}
+            for r in rows:
+                touched.setdefault(r.entity, set()).add(r.entity_id)
+            for name, ids in touched.items():
+                if name in self._tables:
+                    self._reload(name, sorted(ids))
+            if rows:
+                self.cursor = rows[-1].id
+            if len(rows) < self.chunk_size:
+                return
+
+    def _load(self, name):
+        target, select, convert = self._tables[name]
+        for shard in range(shards.count() if name in SHARDED_TABLES else 1):
+            last = shards.floor(shard)
+            while True:
+                page = select(lambda m: m.id > last).subquery()
+                rows = shards.read_shard(shard, db.select(page).order_by(page.c.id).limit(self.chunk_size)).all()
+                target.put(map(convert, rows))
+                if len(rows) < self.chunk_size:
+                    break
+                last = rows[-1].id
+
+    def _reload(self, name, ids):
+        # Upserts, deletes and archive moves alike: whatever the tables hold now
+        target, select, convert = self._tables[name]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = sorted(shards.read(select(lambda m: m.id.in_(chunk)), only=shards.group(chunk)), key=lambda r: r.id)
+            target.put(map(convert, rows))
+            target.remove(set(chunk) - {r.id for r in rows})
+
+    # --- queries ---
+
+    def patients_by(self, group_by, bucket=10, gender=None, min_age=None, max_age=None) -> dict:
+        today = _day(date.today())
+        age = lambda dob: (today - dob) // 10000
+        keys = {"gender": ("gender", None), "age": ("dob", lambda dob: age(dob) // bucket * bucket)}
+        labels = {"gender": lambda code: self.genders.values[code], "age": int}
+        keys = [keys[d] for d in group_by]
+        with self._lock:
+            self._refresh()
+            conditions = []
+            if gender is not None:
+                conditions.append(("gender", lambda g, code=self.genders.find(gender): g == code))
+            if min_age is not None:
+                conditions.append(("dob", lambda dob: age(dob) >= min_age))
+            if max_age is not None:
+                conditions.append(("dob", lambda dob: age(dob) <= max_age))
+            columns = self.patients.copy({name for name, _ in keys + conditions})
+        return _result(group_by, _count(columns, keys, conditions), labels)
+
+    def appointments_by(self, group_by, frm=None, to=None, status=None, doctor_id=None, specialty=None) -> dict:
+        keys = {"status": ("status", None), "doctor": ("doctor_id", None), "specialty": ("specialty", None),
+                "month": ("visit", lambda v: v // 1000000)}
+        keys = [keys[d] for d in group_by]
+        labels = {"status": lambda code: self.statuses.values[code], "doctor": int,
+                  "specialty": lambda code: self.specialties.values[code] if code >= 0 else None,
+                  "month": lambda m: f"{m // 100:04d}-{m % 100:02d}"}
+        with self._lock:
+            self._refresh()
+            conditions = []
+            if frm is not None:
+                conditions.append(("visit", lambda v, start=_minute(frm): v >= start))
+            if to is not None:
+                conditions.append(("visit", lambda v, end=_minute(to): v < end))
+            if status is not None:
+                conditions.append(("status", lambda s, code=self.statuses.find(status): s == code))
+            if doctor_id is not None:
+                conditions.append(("doctor_id", lambda d: d == doctor_id))
+            if specialty is not None:
+                conditions.append(("specialty", lambda s, code=self.specialties.find(specialty): s == code))
+            names = {name for name, _ in keys + conditions}
+            lookup = None
+            if "specialty" in names:
+                doctors = self.doctors.copy(["specialty"])
+                lookup = ("specialty", "doctor_id", doctors["id"], doctors["specialty"])
+                names = names - {"specialty"} | {"doctor_id"}
+            columns = self.appointments.copy(names)
+        return _result(group_by, _count(columns, keys, conditions, lookup), labels)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"loaded": self.cursor is not None, "cursor": self.cursor,
+                    "vectorised": np is not None,
+                    "rows": {name: len(t) for name, (t, _, _) in self._tables.items()},
+                    "bytes": sum(t.nbytes() for t, _, _ in self._tables.values())}
+
+def _count(columns, keys, conditions, lookup=None) -> Counter:
+    """Counts the rows of ``columns`` that meet every condition, per tuple of
+    ``keys``. Conditions are ``(column, fn)`` pairs, keys ``(column, fn or
+    None)``; each ``fn`` takes one value and is written with operators that
+    also work elementwise on NumPy arrays. ``lookup`` is ``(name, key
+    column, ids, values)``: a column joined in from another table by ID (-1
+    where there is none)."""
+    if not len(columns["id"]):
+        return Counter()
+    if np is not None:
+        c = {name: np.frombuffer(col, col.typecode) for name, col in columns.items()}
+        if lookup is not None:
+            name, key, ids, values = lookup
+            ids, values = np.frombuffer(ids, ids.typecode), np.frombuffer(values, values.typecode)
+            table = np.full(max(int(c[key].max()), int(ids.max(initial=0))) + 1, -1, dtype=values.dtype)
+            table[ids] = values
+            c[name] = table[c[key]]
+        selected = np.ones(len(c["id"]), dtype=bool)
+        for name, fn in conditions:
+            selected &= fn(c[name])
+        if not keys or not selected.any():
+            return Counter({(): int(selected.sum())} if selected.any() else {})
+        groups, counts = np.unique(np.stack([(c[name] if fn is None else fn(c[name]))[selected]
+                                             for name, fn in keys]), axis=1, return_counts=True)
+        return Counter({tuple(int(v) for v in groups[:, j]): int(n) for j, n in enumerate(counts)})
+    if lookup is not None:
+        name, key, ids, values = lookup
+        table = dict(zip(ids, values))
+        columns = {**columns, name: array(values.typecode, map(table.get, columns[key], repeat(-1)))}
+    selected = None
+    for name, fn in conditions:
+        hits = map(fn, columns[name])
+        selected = hits if selected is None else map(and_, selected, hits)
+    if not keys:
+        n = len(columns["id"]) if selected is None else sum(selected)
+        return Counter({(): n} if n else {})
+    groups = zip(*(columns[name] if fn is None else map(fn, columns[name]) for name, fn in keys))
+    return Counter(groups if selected is None else compress(groups, selected))
+
+def _result(group_by, counts, labels) -> dict:
+    groups = [dict(zip(group_by, (labels[d](v) for d, v in zip(group_by, key))), count=n)
+              for key, n in counts.items()]
+    groups.sort(key=lambda g: [(g[d] is not None, g[d]) for d in group_by])
+    if "status" in group_by:
+        # Each status's share of its group, e.g. the no-show rate per doctor
+        others = [d for d in group_by if d != "status"]
+        totals = Counter()
+        for g in groups:
+            totals[tuple(g[d] for d in others)] += g["count"]
+        for g in groups:
+            g["share"] = round(g["count"] / totals[tuple(g[d] for d in others)], 4)
+    return {"group_by": list(group_by), "total": sum(counts.values()), "groups": groups}
+
+# ------------------ API ------------------
+
+def _dimensions(value, allowed):
+    names = [d.strip() for d in (value or "").split(",") if d.strip()]
+    unknown = [d for d in names if d not in allowed]
+    if unknown or len(set(names)) != len(names):
+        raise BadRequestError(f"group_by must be a comma-separated list of distinct {', '.join(allowed)}")
+    return names
+
+def _int(value, field, minimum=0):
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or number < minimum:
+        raise BadRequestError(f"{field} must be an integer of at least {minimum}")
+    return number
+
+def _datetime(value, field):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise BadRequestError(f"{field} must be ISO datetime string")
+
+def patient_cohorts(group_by=None, bucket=None, gender=None, min_age=None, max_age=None) -> dict:
+    """Counts patients per combination of the ``group_by`` dimensions.
+
+    Args:
+        group_by (str, optional): Comma-separated ``gender`` and/or ``age``.
+        bucket (int, optional): Width of the age groups in years. Defaults to 10.
+        gender (str, optional): Only patients with this gender.
+        min_age (int, optional): Only patients at least this old.
+        max_age (int, optional): Only patients at most this old.
+
+    Returns:
+        dict: ``group_by``, ``total`` and ``groups``, one ``{<dimension>:
+        <value>, ..., "count": n}`` per combination present, in order.
+        An age group is named by its lowest age.
+
+    Raises:
+        BadRequestError: If a dimension or number is invalid.
+    """
+    return get_snapshot().patients_by(_dimensions(group_by, PATIENT_DIMENSIONS), _int(bucket, "bucket", 1) or 10,
+                                      gender, _int(min_age, "min_age"), _int(max_age, "max_age"))
+
+def appointment_cohorts(group_by=None, frm=None, to=None, status=None, doctor_id=None, specialty=None) -> dict:
+    """Counts appointments, archived ones included, per combination of the
+    ``group_by`` dimensions.
+
+    Args:
+        group_by (str, optional): Comma-separated ``status``, ``doctor``,
+                                  ``specialty`` and/or ``month``.
+        frm (str, optional): Only visits starting at or after this.
+        to (str, optional): Only visits starting before this.
+        status (str, optional): Only appointments with this status.
+        doctor_id (int, optional): Only this doctor's appointments.
+        specialty (str, optional): Only appointments with doctors of this specialty.
+
+    Returns:
+        dict: As for ``patient_cohorts``. Months are ``YYYY-MM``; grouped by
+        ``status``, each group also has its ``share`` of the appointments
+        with the same other dimensions.
+
+    Raises:
+        BadRequestError: If a dimension, number or datetime is invalid.
+    """
+    return get_snapshot().appointments_by(_dimensions(group_by, APPOINTMENT_DIMENSIONS), _datetime(frm, "from"),
+                                          _datetime(to, "to"), status, _int(doctor_id, "doctor_id", 1), specialty)
+
+def init_app(app):
+    app.extensions["hms_analytics"] = Snapshot(app.config["ANALYTICS_CHUNK_SIZE"])
+
+def get_snapshot() -> Snapshot:
+    return current_app.extensions["hms_analytics"]
@@ -0,0 +1,100 @@
+"""
+Appointment Archive
+
+Appointments whose visit is more than ``ARCHIVE_AFTER_DAYS`` in the past,
+and whose outcome is recorded (any status but ``scheduled``: completed,
+cancelled, no-show and so on), are moved from ``appointments`` to
+``appointments_archive`` so the hot
+table, its indexes and the per-doctor schedules only hold recent and
+upcoming visits. Archival runs as a background job (``archive-appointments``
+in ``batch_calc.REPORTS``) and moves ``batch_size`` appointments per
+transaction, oldest first: one ``INSERT ... SELECT ... RETURNING`` over a
+partial index on the visit_time of such rows copies a chunk and one ``DELETE`` by ID removes it, so a
+job can be cancelled or resumed between chunks and never holds the write
+lock for long. Moved rows keep their IDs (appointment IDs are
+AUTOINCREMENT, so a freed one is never handed out again) and timestamps
+and are logged in the change feed with the ``archive`` op. With several shards (shards.py)
+each keeps its own archive and the job works through them in turn.
+
+Archived appointments are read through ``/api/archive/appointments`` and
+are deleted together with their patient or doctor (``crud``).
+"""
+from datetime import datetime, timedelta
+from flask import current_app
+from .db import db, after_commit
+from .models import Appointment, ArchivedAppointment
+from .exceptions import BadRequestError
+from . import batch_calc, changes, schedule, shards
+
+COLUMNS = ("id", "patient_id", "doctor_id", "visit_time", "notes", "status", "duration_minutes",
+           "reminded_at", "created_at", "updated_at")
+
+def _archivable(cutoff):
+    # Visits still "scheduled" have no outcome yet and stay hot. The status
+    # is inlined, not bound, so SQLite can use ix_appointments_archivable.
+    return Appointment.visit_time < cutoff, Appointment.status != db.literal_column("'scheduled'")
+
+def archive_chunk(cutoff: datetime, limit: int) -> int:
+    """Moves up to ``limit`` of the oldest appointments that started before
+    ``cutoff`` and are no longer scheduled to the archive and commits.
+    Returns how many were moved."""
+    oldest = (db.select(Appointment.id).where(*_archivable(cutoff))
+              .order_by(Appointment.visit_time).limit(limit))
+    source = db.select(*(getattr(Appointment, c) for c in COLUMNS), db.literal(datetime.utcnow())) \
+        .where(Appointment.id.in_(oldest.scalar_subquery()))
+    moved = db.session.execute(
+        db.insert(ArchivedAppointment).from_select(COLUMNS + ("archived_at",), source)
+        .returning(ArchivedAppointment.id, ArchivedAppointment.doctor_id, ArchivedAppointment.visit_time)
+    ).all()
+    if not moved:
+        db.session.rollback()
+        return 0
+    ids = [aid for aid, _, _ in moved]
+    db.session.execute(db.delete(Appointment).where(Appointment.id.in_(ids)),
+                       execution_options={"synchronize_session": False})
+    changes.log("appointments", ids, "archive")
+    index = schedule.get_index()
+
+    def release():
+        for aid, did, start in moved:
+            index.release(did, aid, start)
+    after_commit(release)
+    db.session.commit()
+    return len(moved)
+
+
+class ArchiveReport(batch_calc.Report):
+    """Archival as a resumable job: the state holds the cutoff, fixed when
+    the job is submitted, the shard being archived and the number of
+    appointments moved so far."""
+    name = "archive-appointments"
+    cacheable = False
+
+    def start(self, params):
+        days = params.get("older_than_days", current_app.config["ARCHIVE_AFTER_DAYS"])
+        if not isinstance(days, int) or isinstance(days, bool) or days < 0:
+            raise BadRequestError("older_than_days must be a non-negative integer")
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        return {"cutoff": cutoff.isoformat(), "shard": 0, "archived": 0}
+
+    def total(self, state):
+        # A range count over the partial index, taken when the job starts
+        return sum(r.scalar_one() for r in shards.each(
+            db.select(db.func.count()).select_from(Appointment)
+            .where(*_archivable(datetime.fromisoformat(state["cutoff"])))
+        )) + state["archived"]
+
+    def step(self, state, batch_size):
+        shard = state.get("shard", 0)
+        with shards.route(shard):
+            count = archive_chunk(datetime.fromisoformat(state["cutoff"]), batch_size)
+        state = dict(state, archived=state["archived"] + count)
+        if count < batch_size and shard + 1 < shards.count():
+            return dict(state, shard=shard + 1), count, False
+        return state, count, count < batch_size
+
+    def finish(self, state):
+        return {"cutoff": state["cutoff"], "archived": state["archived"]}
+
+
+ARCHIVE = batch_calc.REPORTS[ArchiveReport.name] = ArchiveReport()
@@ -0,0 +1,121 @@
+"""
+Batch API
+
+Runs an ordered list of create/update/delete operations on patients,
+doctors and appointments (``POST /api/batch``) through ``crud`` in a
+single transaction with one commit, so a front-desk flow such as "create
+patient, book appointment, add notes" costs one round trip and one fsync
+instead of three. The batch succeeds or fails as a whole.
+
+Operations look like::
+
+    {"op": "create", "entity": "patients", "ref": "p", "data": {"name": "A", "dob": "1990-01-01"}}
+    {"op": "create", "entity": "appointments", "ref": "a",
+     "data": {"patient_id": "$p", "doctor_id": 3, "visit_time": "2031-01-01T09:00"}}
+    {"op": "update", "entity": "appointments", "id": "$a", "data": {"notes": "Bring X-rays"}}
+    {"op": "delete", "entity": "patients", "id": 12}
+
+A create may name its result with ``ref``; later operations use the new
+ID as ``"$<ref>"`` in ``id`` or in a ``*_id`` field of ``data``.
+"""
+import inspect
+from sqlalchemy.exc import IntegrityError
+from .exceptions import NotFoundError, BadRequestError, ConflictError
+from . import crud
+
+OPERATIONS = {
+    "patients": {"create": crud.create_patient, "update": crud.update_patient, "delete": crud.delete_patient},
+    "doctors": {"create": crud.create_doctor, "update": crud.update_doctor, "delete": crud.delete_doctor},
+    "appointments": {"create": crud.create_appointment, "update": crud.update_appointment,
+                     "delete": crud.delete_appointment},
+}
+
+def _ref(value):
+    return value[1:] if isinstance(value, str) and value.startswith("$") else None
+
+def _resolve(value, refs):
+    name = _ref(value)
+    return refs[name] if name is not None else value
+
+def parse(operations, max_operations: int) -> list:
+    """Validates the shape of a batch before anything runs.
+
+    Returns:
+        list: ``(op, entity, id, data, ref)`` tuples; ``id`` and ``data``
+              may still contain ``$ref`` references.
+
+    Raises:
+        BadRequestError: If an operation is malformed.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BadRequestError("operations must be a non-empty list")
+    if len(operations) > max_operations:
+        raise BadRequestError(f"A batch may have at most {max_operations} operations")
+    parsed, refs = [], set()
+    for i, item in enumerate(operations):
+        where = f"Operation {i}"
+        if not isinstance(item, dict):
+            raise BadRequestError(f"{where} must be an object")
+        op, entity, ref = item.get("op"), item.get("entity"), item.get("ref")
+        if entity not in OPERATIONS:
+            raise BadRequestError(f"{where}: entity must be one of {', '.join(OPERATIONS)}")
+        if op not in OPERATIONS[entity]:
+            raise BadRequestError(f"{where}: op must be one of create, update, delete")
+        data = item.get("data", {})
+        if not isinstance(data, dict) or (op == "create" and not data):
+            raise BadRequestError(f"{where}: data must be an object")
+        pk = item.get("id")
+        if op != "create" and (_ref(pk) is None and (not isinstance(pk, int) or isinstance(pk, bool))):
+            raise BadRequestError(f"{where}: {op} needs an integer id or a $ref")
+        for value in [pk, *(v for k, v in data.items() if k.endswith("_id"))]:
+            if _ref(value) is not None and _ref(value) not in refs:
+                raise BadRequestError(f"{where}: '{value}' does not name an earlier create")
+        if ref is not None:
+            if op != "create" or not isinstance(ref, str) or not ref or ref in refs:
+                raise BadRequestError(f"{where}: ref must be a new, non-empty name on a create")
+            refs.add(ref)
+        fn = OPERATIONS[entity][op]
+        try:
+            inspect.signature(fn).bind(*(() if op == "create" else (0,)), **data)
+        except TypeError as err:
+            raise BadRequestError(f"{where}: {err}")
+        parsed.append((op, entity, pk, data, ref))
+    return parsed
+
+def run(operations, encode) -> list:
+    """Runs parsed operations in one transaction.
+
+    Args:
+        operations (list): From parse().
+        encode (callable): ``encode(entity, obj)`` serializes a created or
+                           updated object as it is right after its operation.
+
+    Returns:
+        list: ``(op, entity, id, encoded object or None)`` per operation.
+
+    Raises:
+        NotFoundError, BadRequestError, ConflictError: From the first
+            operation that fails (its index is in the message); nothing is
+            committed then. Constraint violations are ConflictErrors.
+    """
+    refs, results = {}, []
+    with crud.transaction():
+        for i, (op, entity, pk, data, ref) in enumerate(operations):
+            fn = OPERATIONS[entity][op]
+            data = {k: _resolve(v, refs) if k.endswith("_id") else v for k, v in data.items()}
+            try:
+                if op == "delete":
+                    pk = _resolve(pk, refs)
+                    fn(pk)
+                    results.append((op, entity, pk, None))
+                    continue
+                obj = fn(**data) if op == "create" else fn(_resolve(pk, refs), **data)
+            except (NotFoundError, BadRequestError, ConflictError) as err:
+                raise type(err)(f"Operation {i} ({op} {entity}): {err}") from err
+            except IntegrityError as err:  # e.g. a second patient with the same email
+                raise ConflictError(f"Operation {i} ({op} {entity}): conflicts with an existing row "
+                                    f"({err.orig})") from err
+            if ref is not None:
+                refs[ref] = obj.id
+            results.append((op, entity, obj.id, encode(entity, obj)))
+    return results
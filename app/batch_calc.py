@@ -1,66 +1,239 @@
 """
 Batch Calculation for Patient Data
+
+Reports are computed chunk by chunk with keyset pagination on ``Patient.id``
+and the per-chunk aggregation runs inside the database (age is derived from
+``dob`` by the ``Patient.age`` SQL expression). Every report keeps its
+progress in a small JSON-serialisable state dict, which is what lets
+``app.jobs`` checkpoint, cancel and resume long-running reports.
+
+With several shards (shards.py) the cursor walks the IDs of shard 0, then
+those of shard 1 and so on: each chunk runs on the shard that holds the
+cursor, and a short chunk moves it to the start of the next shard.
 """
 import logging
+from abc import ABC, abstractmethod
+from datetime import date
+from flask import current_app
 from .db import db
 from .models import Patient
-from .config import Config
+from .exceptions import BadRequestError
+from . import crud, shards
 
 log = logging.getLogger(__name__)
 
-def calculate_average_age() -> float:
+# ------------------ Reports ------------------
+
+class Report(ABC):
+    """A chunked, resumable report over the patients table.
+
+    Subclasses implement step() and finish(); one that does not cannot be
+    instantiated, so it fails when it is registered in ``REPORTS``. State dicts must be JSON
+    serialisable and step() must return a new dict rather than mutate the
+    one it was given.
+    """
+    name = None
+    cacheable = True  # whether a finished run's result may be reused (see jobs)
+
+    def start(self, params: dict) -> dict:
+        """Returns the initial state for a fresh run."""
+        return {"last_id": 0}
+
+    def total(self, state: dict) -> int:
+        """Returns the number of rows the report will visit."""
+        return sum(r[0] for r in shards.read(db.select(db.func.count(Patient.id))))
+
+    @abstractmethod
+    def step(self, state: dict, batch_size: int):
+        """Processes the next chunk.
+
+        Returns:
+            tuple: ``(new_state, rows_processed, done)``.
+        """
+
+    @abstractmethod
+    def finish(self, state: dict):
+        """Turns the final state into the report result."""
+
+    def _chunk(self, state, batch_size, *columns):
+        # The next ``batch_size`` patients after the cursor, as a subquery.
+        return (db.select(Patient.id, *columns)
+                .where(Patient.id > state["last_id"])
+                .order_by(Patient.id)
+                .limit(batch_size)
+                .subquery())
+
+    def _read(self, state, stmt):
+        # Runs a query over a chunk on the shard holding the cursor
+        return shards.read_shard(shards.shard_of(state["last_id"]), stmt)
+
+    def _advance(self, state, count, last_id, batch_size):
+        """The cursor after a chunk of ``count`` rows ending at ``last_id``,
+        and whether the report is done: a short chunk ends a shard, and
+        the last shard's ends the report."""
+        if count == batch_size:
+            return last_id, False
+        shard = shards.shard_of(state["last_id"])
+        if shard + 1 < shards.count():
+            return shards.floor(shard + 1), False
+        return last_id or state["last_id"], True
+
+
+class AverageAgeReport(Report):
+    name = "average-age"
+
+    def start(self, params):
+        return {"last_id": 0, "total_age": 0, "count": 0}
+
+    def step(self, state, batch_size):
+        chunk = self._chunk(state, batch_size, Patient.age.label("age"))
+        count, total_age, last_id = self._read(state, db.select(
+            db.func.count(),
+            db.func.coalesce(db.func.sum(chunk.c.age), 0),
+            db.func.max(chunk.c.id),
+        )).one()
+        log.debug("average-age chunk after id %s: %s rows", state["last_id"], count)
+        last_id, done = self._advance(state, count, last_id, batch_size)
+        new_state = {
+            "last_id": last_id,
+            "total_age": state["total_age"] + int(total_age),
+            "count": state["count"] + count,
+        }
+        return new_state, count, done
+
+    def finish(self, state):
+        if not state["count"]:
+            return 0.0
+        return state["total_age"] / state["count"]
+
+
+class AgeByGenderReport(Report):
+    name = "age-by-gender"
+
+    def start(self, params):
+        return {"last_id": 0, "groups": {}}
+
+    def step(self, state, batch_size):
+        chunk = self._chunk(state, batch_size, Patient.gender, Patient.age.label("age"))
+        rows = self._read(state,
+            db.select(chunk.c.gender, db.func.count(), db.func.sum(chunk.c.age), db.func.max(chunk.c.id))
+            .group_by(chunk.c.gender)
+        ).all()
+        count = sum(r[1] for r in rows)
+        groups = {k: list(v) for k, v in state["groups"].items()}
+        for gender, n, total_age, _ in rows:
+            g = groups.setdefault(gender or "unknown", [0, 0])
+            g[0] += n
+            g[1] += int(total_age)
+        last_id, done = self._advance(state, count, max((r[3] for r in rows), default=None), batch_size)
+        return {"last_id": last_id, "groups": groups}, count, done
+
+    def finish(self, state):
+        return {g: {"count": n, "average_age": total / n} for g, (n, total) in state["groups"].items()}
+
+
+REPORTS = {r.name: r for r in (AverageAgeReport(), AgeByGenderReport())}
+
+def get_report(name: str) -> Report:
+    """Looks up a registered report by name.
+
+    Raises:
+        BadRequestError: If no report with that name exists.
+    """
+    try:
+        return REPORTS[name]
+    except KeyError:
+        raise BadRequestError(f"Unknown report '{name}'")
+
+# ------------------ Result cache ------------------
+
+def table_fingerprint(model):
+    """Returns a cheap value that changes whenever ``model``'s table does,
+    or the day does (ages change on birthdays).
+
+    Uses crud.collection_version(): index lookups only, no ``count(*)``.
+    """
+    return (date.today(), *crud.collection_version(model))
+
+def _cache():
+    return current_app.extensions.setdefault("hms_report_cache", {})
+
+def cached_result(name: str, fingerprint=None):
+    """Returns the cached result of report ``name``, or None if the patients
+    table changed since it was computed."""
+    entry = _cache().get(name)
+    if entry is None:
+        return None
+    if fingerprint is None:
+        fingerprint = table_fingerprint(Patient)
+    return entry[1] if entry[0] == fingerprint else None
+
+def store_result(name: str, fingerprint, result):
+    """Caches ``result`` for report ``name`` until the fingerprint changes."""
+    _cache()[name] = (fingerprint, result)
+
+def run_report(name: str, batch_size: int = None, use_cache: bool = True):
+    """Runs a report to completion in the calling thread.
+
+    Args:
+        name (str): The registered report name.
+        batch_size (int, optional): Rows per chunk. Defaults to BATCH_SIZE.
+        use_cache (bool): Serve and store results in the report cache.
+
+    Returns:
+        The report result.
+
+    Raises:
+        BadRequestError: If the report is unknown or batch_size is not positive.
+    """
+    report = get_report(name)
+    batch_size = batch_size or current_app.config["BATCH_SIZE"]
+    if batch_size < 1:
+        raise BadRequestError("batch_size must be positive")
+
+    fingerprint = table_fingerprint(Patient) if use_cache else None
+    if use_cache:
+        result = cached_result(name, fingerprint)
+        if result is not None:
+            log.debug("Report %s served from cache", name)
+            return result
+
+    state, done = report.start({}), False
+    while not done:
+        state, _, done = report.step(state, batch_size)
+    result = report.finish(state)
+    if use_cache:
+        store_result(name, fingerprint, result)
+    return result
+
+# ------------------ Average age ------------------
+
+def calculate_average_age(batch_size: int = None) -> float:
     """
     Calculates the average age of all patients by processing them in batches.
-    
-    This method is memory-efficient as it does not load all patients
-    into memory at once.
-    
+
+    Each batch is a keyset range of patient IDs whose ages are summed by
+    the database, so only one aggregate row per batch is transferred.
+
+    Args:
+        batch_size (int, optional): Patients per batch. Defaults to BATCH_SIZE.
+
     Returns:
         float: The average age, or 0.0 if no patients exist.
     """
-    
-    # Get the batch size from our config file
-    batch_size = Config.DEFAULT_BATCH_SIZE
-    offset = 0
-    
-    total_age = 0
-    total_count = 0
-    
-    log.info(f"Starting average age calculation with batch size {batch_size}...")
-    
-    # We will use modern SQLAlchemy 2.0 select syntax
-    # We only select the 'age' column, which is more efficient
-    base_query = db.select(Patient.age)
-
-    while True:
-        # 1. Create a query for the next batch
-        batch_query = base_query.offset(offset).limit(batch_size)
-        
-        # 2. Execute the query and get the ages
-        # .scalars() gets just the age values (e.g., [25, 42, 61])
-        ages_in_batch = db.session.execute(batch_query).scalars().all()
-
-        # 3. Check if the batch is empty
-        if not ages_in_batch:
-            log.info("No more patients found. Finishing calculation.")
-            break # Exit the loop if we've processed all patients
-
-        # 4. Process the batch
-        total_age += sum(ages_in_batch)
-        total_count += len(ages_in_batch)
-        
-        log.debug(f"Processed batch. Offset: {offset}, Count: {len(ages_in_batch)}")
-
-        # 5. Move to the next batch
-        offset += batch_size
-
-    # --- Calculation Complete ---
-    
-    if total_count == 0:
-        log.warning("calculate_average_age: No patients found in database.")
-        return 0.0
-
-    average = total_age / total_count
-    log.info(f"Calculation complete. Total Patients: {total_count}, Average Age: {average:.2f}")
-    
+    batch_size = batch_size or current_app.config["BATCH_SIZE"]
+    log.info("Starting average age calculation with batch size %s...", batch_size)
+    average = run_report(AverageAgeReport.name, batch_size, use_cache=False)
+    log.info("Calculation complete. Average Age: %.2f", average)
     return average
+
+def average_age(batch_size: int = None) -> float:
+    """Returns the average patient age, cached until the patients table changes.
+
+    Args:
+        batch_size (int, optional): Patients per batch. Defaults to BATCH_SIZE.
+
+    Returns:
+        float: The average age, or 0.0 if no patients exist.
+    """
+    return run_report(AverageAgeReport.name, batch_size)
@@ -0,0 +1,197 @@
+"""
+Entity Cache
+
+Read-through cache for single-entity lookups (``crud.get_patient`` /
+``crud.get_doctor``). Entries are column snapshots, not ORM objects: on a
+hit the snapshot is merged into the current session with ``load=False``,
+which gives the caller a normal persistent object (relationships still
+lazy-load) without a SELECT.
+
+Two tiers:
+
+- a bounded in-process LRU with a TTL, always on when ENTITY_CACHE_SIZE > 0;
+- an optional shared backend (ENTITY_CACHE_URL, e.g. ``redis://...``) so
+  several workers see each other's fills and invalidations.
+
+The local tier of one process never sees another process's invalidations,
+so its TTL (ENTITY_CACHE_LOCAL_TTL) bounds how stale a read can be when
+several workers serve the same database.
+
+``crud`` invalidates an entity after any committed update or delete.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from .db import db
+
+log = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe LRU map whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        # Deletion stamps of the last ``maxsize`` deleted keys, oldest first;
+        # a key without one reads as the newest stamp dropped from the map,
+        # so a fill that started before that delete still counts as stale
+        self._versions = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def version(self, key) -> int:
+        """Returns a stamp that changes with every delete() of ``key``."""
+        with self._lock:
+            return self._versions.get(key, self._floor)
+
+    def set(self, key, value, version=None):
+        """Stores ``value``; skipped if ``key`` was deleted since ``version``
+        was read, so a slow reader cannot re-cache a just-invalidated row."""
+        with self._lock:
+            if version is not None and self._versions.get(key, self._floor) != version:
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._clock += 1
+            self._versions.pop(key, None)
+            self._versions[key] = self._clock
+            while len(self._versions) > self.maxsize:
+                _, self._floor = self._versions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """Shared cache tier on Redis (requires the optional ``redis`` package).
+
+    Values are pickled, so the Redis instance must be trusted.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "hms:"):
+        import redis  # optional dependency
+        self.client = redis.Redis.from_url(url)
+        self.ttl, self.prefix = int(ttl), prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class EntityCache:
+    """Per-application read-through cache of entity snapshots."""
+
+    def __init__(self, maxsize: int, ttl: float, shared=None):
+        self.local = LRUCache(maxsize, ttl)
+        self.shared = shared
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "shared_hits": 0, "invalidations": 0, "shared_errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def key(model, pk) -> str:
+        return f"{model.__tablename__}:{pk}"
+
+    def _shared_call(self, method, *args):
+        if self.shared is None:
+            return None
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception as exc:  # the shared tier is best-effort
+            self._count("shared_errors")
+            log.warning("Shared cache %s failed: %s", method, exc)
+            return None
+
+    def get(self, model, pk):
+        """Returns a session-attached instance, or None if the row does not exist."""
+        session = db.session
+        existing = session.identity_map.get(identity_key(model, pk))
+        if existing is not None:
+            return existing
+
+        key = self.key(model, pk)
+        snapshot = self.local.get(key)
+        if snapshot is None:
+            snapshot = self._shared_call("get", key)
+            if snapshot is not None:
+                self._count("shared_hits")
+                self.local.set(key, snapshot)
+        if snapshot is not None:
+            self._count("hits")
+            obj = model(**snapshot)
+            make_transient_to_detached(obj)
+            return session.merge(obj, load=False)
+
+        self._count("misses")
+        version = self.local.version(key)
+        obj = session.get(model, pk)
+        if obj is not None:
+            snapshot = {attr.key: getattr(obj, attr.key) for attr in inspect(model).column_attrs}
+            self.local.set(key, snapshot, version)
+            self._shared_call("set", key, snapshot)
+        return obj
+
+    def invalidate(self, model, pk):
+        key = self.key(model, pk)
+        self.local.delete(key)
+        self._shared_call("delete", key)
+        self._count("invalidations")
+
+    def info(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(size=len(self.local), hit_ratio=(stats["hits"] / lookups) if lookups else None)
+        return stats
+
+def init_app(app):
+    cfg = app.config
+    shared = None
+    if cfg["ENTITY_CACHE_URL"]:
+        shared = RedisBackend(cfg["ENTITY_CACHE_URL"], cfg["ENTITY_CACHE_TTL"])
+    local_ttl = cfg.get("ENTITY_CACHE_LOCAL_TTL") or cfg["ENTITY_CACHE_TTL"]
+    app.extensions["hms_cache"] = EntityCache(cfg["ENTITY_CACHE_SIZE"], local_ttl, shared)
+
+def get_cache():
+    """Returns the application's EntityCache, or None if caching is disabled."""
+    if current_app.config["ENTITY_CACHE_SIZE"] <= 0:
+        return None
+    return current_app.extensions["hms_cache"]
@@ -0,0 +1,152 @@
+"""
+Change Feed
+
+Every create, update and delete of a patient, doctor or appointment
+appends a row to ``change_log`` in the same transaction as the change:
+``crud`` logs ORM writes (including the appointments removed by a patient
+or doctor delete cascade), ``bulk`` logs imported rows with one
+``INSERT ... SELECT`` and ``reminders`` logs the appointments it marks.
+Deleted rows leave a ``delete`` tombstone; appointments moved to the
+archive (archive.py) leave an ``archive`` one.
+
+``/api/changes?since=<seq>`` returns the log after ``seq`` in order,
+collapsed to the last change per row, with the current representation of
+each upserted row loaded in one query per table (and shard); ``next`` is the cursor
+for the following call. The log's ID is assigned under SQLite's single
+write lock, so a change never becomes visible after one with a higher
+ID and a consumer that resumes from ``next`` misses nothing.
+
+With ``wait=<seconds>`` an empty poll blocks until something is logged:
+commits in this process wake it at once, commits by other processes are
+noticed within ``CHANGES_POLL_SECONDS``.
+"""
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from .db import db, after_commit
+from .models import ChangeLog
+from .serializers import PATIENT, DOCTOR, APPOINTMENT
+from . import shards
+
+SCHEMAS = {s.model.__tablename__: s for s in (PATIENT, DOCTOR, APPOINTMENT)}
+
+# ------------------ Writing ------------------
+
+def log(entity: str, ids, op: str = "upsert"):
+    """Logs a change to rows ``ids`` of table ``entity`` in the current
+    transaction."""
+    now = datetime.utcnow()
+    rows = [{"entity": entity, "entity_id": i, "op": op, "changed_at": now} for i in ids]
+    if rows:
+        db.session.execute(db.insert(ChangeLog), rows)
+        _notify_on_commit()
+
+def upserted(obj):
+    """Logs that ORM object ``obj`` was created or updated (flushing first
+    so a new object has its ID)."""
+    db.session.flush()
+    log(obj.__tablename__, [obj.id])
+
+def deleted(obj):
+    """Logs a tombstone for ORM object ``obj``, which is being deleted."""
+    log(obj.__tablename__, [obj.id], "delete")
+
+def log_inserted(table, after_id):
+    """Logs every row of ``table`` with an ID above ``after_id``: the rows a
+    bulk insert just added in the current transaction."""
+    conn = db.session.connection()
+    source = db.select(db.literal(table.name), table.c.id, db.literal("upsert"), db.literal(datetime.utcnow())
+                       ).where(table.c.id > (after_id or 0)).order_by(table.c.id)
+    result = conn.execute(db.insert(ChangeLog).from_select(["entity", "entity_id", "op", "changed_at"], source))
+    if result.rowcount:
+        _notify_on_commit()
+
+def _notify_on_commit():
+    feed = current_app.extensions.get("hms_changes")
+    if feed is not None:
+        after_commit(feed.notify)
+
+# ------------------ Reading ------------------
+
+def head(entity: str = None) -> int:
+    """Sequence number of the newest logged change (to ``entity``), or 0."""
+    stmt = db.select(db.func.max(ChangeLog.id))
+    if entity is not None:
+        stmt = stmt.where(ChangeLog.entity == entity)
+    return db.session.execute(stmt).scalar() or 0
+
+def read(since: int, limit: int, entity: str = None) -> tuple:
+    """Reads up to ``limit`` log entries after ``since``.
+
+    Returns:
+        tuple: ``(changes, next, more)``: the entries collapsed to the last
+        one per row, as ``(seq, entity, id, op, changed_at, JSON text or
+        None)`` in sequence order; the cursor to resume from; and whether
+        the page was full.
+    """
+    stmt = db.select(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op, ChangeLog.changed_at) \
+        .where(ChangeLog.id > since).order_by(ChangeLog.id).limit(limit)
+    if entity is not None:
+        stmt = stmt.where(ChangeLog.entity == entity)
+    rows = db.session.execute(stmt).all()
+    latest = {(r.entity, r.entity_id): r for r in rows}
+    data = {}
+    for name, schema in SCHEMAS.items():
+        ids = [i for (e, i), r in latest.items() if e == name and r.op == "upsert"]
+        if ids:
+            encode = schema.encoder(schema.default)
+            for shard, group in shards.group(ids).items():
+                stmt = db.select(*schema.columns(schema.default)).where(schema.model.id.in_(group))
+                for r in db.session.execute(stmt, bind_arguments={"bind": shards.engine(shard)}):
+                    data[name, r.id] = encode(r)
+    changes = []
+    for r in sorted(latest.values(), key=lambda r: r.id):
+        body = data.get((r.entity, r.entity_id))
+        # An upserted row that is gone has a later tombstone, on this page or the next
+        if r.op != "upsert" or body is not None:
+            changes.append((r.id, r.entity, r.entity_id, r.op, r.changed_at, body))
+    # A cursor past the end (e.g. from before a restore) resumes at the end
+    return changes, rows[-1].id if rows else min(since, head()), len(rows) == limit
+
+class ChangeFeed:
+    """Wakes long-polling readers when this process commits a change."""
+
+    def __init__(self, app):
+        self.poll_every = app.config["CHANGES_POLL_SECONDS"]
+        self._cond = threading.Condition()
+        self._serial = 0
+        self.closed = False
+
+    def notify(self):
+        with self._cond:
+            self._serial += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """Releases every waiting reader (at shutdown)."""
+        self.closed = True
+        self.notify()
+
+    def wait(self, since: int, timeout: float, entity: str = None) -> bool:
+        """Blocks until a change (to ``entity``) after ``since`` is logged,
+        up to ``timeout`` seconds. Returns whether one was."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                serial = self._serial
+            if head(entity) > since:
+                return True
+            db.session.rollback()  # end the read so the next check sees new commits
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.closed:
+                return False
+            with self._cond:
+                if self._serial == serial:
+                    self._cond.wait(min(remaining, self.poll_every))
+
+def init_app(app):
+    app.extensions["hms_changes"] = ChangeFeed(app)
+
+def get_feed() -> ChangeFeed:
+    return current_app.extensions["hms_changes"]
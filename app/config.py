@@ -7,14 +7,152 @@ class Config:
     DB_PATH = os.getenv("DB_PATH", "hms.db")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Engine profile: connection PRAGMAs (SQLite) and pool sizing
+    DB_PROFILE = os.getenv("DB_PROFILE", "default")
+    DB_PROFILES = {
+        "default": {
+            "pragmas": {"busy_timeout": 5000},
+        },
+        # Many concurrent readers and writers (WAL: readers never block the writer)
+        "concurrent": {
+            "pragmas": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 10000,
+                        "cache_size": -65536, "mmap_size": 268435456, "temp_store": "MEMORY"},
+            "pool": {"pool_size": 10, "max_overflow": 20, "pool_timeout": 15},
+        },
+        # WAL, but every commit is fsynced
+        "durable": {
+            "pragmas": {"journal_mode": "WAL", "synchronous": "FULL", "busy_timeout": 10000},
+            "pool": {"pool_size": 5, "max_overflow": 10},
+        },
+    }
+    # Optional read-only database (replica file or second server) for list
+    # and analytics queries
+    READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+    # Extra databases (comma-separated URLs) that patients and their
+    # appointments are sharded over, next to the primary (see shards.py)
+    SHARD_DATABASE_URLS = os.getenv("SHARD_DATABASE_URLS", "")
 
-    # Email (stub)
+    # Email
     SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
     SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+    SMTP_USER = os.getenv("SMTP_USER")
+    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+    SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0") == "1"
+    SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
     FROM_EMAIL = os.getenv("FROM_EMAIL", "masoodahamad05@gmail.com")
+    # Outbox delivery
+    EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+    EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+    EMAIL_LEASE_SECONDS = float(os.getenv("EMAIL_LEASE_SECONDS", "300"))
+    EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
 
     # Batch
     BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    # Mark jobs left pending/running by a previous process as interrupted at
+    # startup; ``serve`` enables it for one worker only
+    JOBS_RECOVER_ON_START = os.getenv("JOBS_RECOVER_ON_START", "1") == "1"
+    # Operations per /api/batch request (see batch.py)
+    BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+
+    # Bulk import
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+    IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+    # Appointments
+    APPOINTMENT_MINUTES = int(os.getenv("APPOINTMENT_MINUTES", "30"))
+    FREE_SLOTS_MAX_DAYS = int(os.getenv("FREE_SLOTS_MAX_DAYS", "31"))
+
+    # Appointment reminders (see reminders.py): sent REMINDER_LEAD_MINUTES
+    # before the visit; the scheduler holds the next REMINDER_HORIZON_MINUTES
+    REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") == "1"
+    REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "1440"))
+    REMINDER_HORIZON_MINUTES = int(os.getenv("REMINDER_HORIZON_MINUTES", "60"))
+    REMINDER_REFRESH_SECONDS = float(os.getenv("REMINDER_REFRESH_SECONDS", "300"))
+    REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+
+    # Appointment archive (see archive.py): default age, in days since the
+    # visit, at which the archive-appointments job moves an appointment that is
+    # no longer "scheduled"
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+
+    # Analytics snapshot (see analytics.py): rows per read while loading and catching up
+    ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", "10000"))
+
+    # Change feed (see changes.py): longest long-poll a client may ask for,
+    # and how often a waiting poll checks for commits made by other processes
+    CHANGES_MAX_WAIT_SECONDS = float(os.getenv("CHANGES_MAX_WAIT_SECONDS", "30"))
+    CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+
+    # Entity cache (see cache.py); ENTITY_CACHE_SIZE=0 disables it
+    ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+    ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "300"))
+    ENTITY_CACHE_URL = os.getenv("ENTITY_CACHE_URL")  # e.g. redis://localhost:6379/0
+    # TTL of the in-process tier alone; other workers' writes are not seen by
+    # it until expiry, so ``serve`` lowers it when running several workers
+    ENTITY_CACHE_LOCAL_TTL = float(os.getenv("ENTITY_CACHE_LOCAL_TTL", "0")) or None
+
+    # Patient search (see search.py): result sets up to this size are ranked
+    # by relevance, larger ones are returned newest first
+    SEARCH_RANK_LIMIT = int(os.getenv("SEARCH_RANK_LIMIT", "1000"))
+
+    # Pagination
+    PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+    # Health information sources (see scraper.py)
+    INFO_SOURCES = [u for u in os.getenv("INFO_SOURCES", "https://www.who.int/").split(",") if u]
+    DISEASE_FACTS_URL = os.getenv("DISEASE_FACTS_URL", "https://www.who.int/news-room/fact-sheets/detail/{name}")
+    INFO_TTL_SECONDS = float(os.getenv("INFO_TTL_SECONDS", "900"))
+    INFO_STALE_SECONDS = float(os.getenv("INFO_STALE_SECONDS", "86400"))
+    INFO_CACHE_SIZE = int(os.getenv("INFO_CACHE_SIZE", "256"))
+    INFO_TIMEOUT = float(os.getenv("INFO_TIMEOUT", "5"))
+    INFO_FETCH_WORKERS = int(os.getenv("INFO_FETCH_WORKERS", "4"))
+
+    # Metrics (see metrics.py); the slow log can also be toggled at runtime
+    METRICS_SLOW_LOG = os.getenv("METRICS_SLOW_LOG", "0") == "1"
+    METRICS_SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "500"))
+    METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv("METRICS_N_PLUS_ONE_THRESHOLD", "5"))
+
+    # Admission control (see admission.py), per worker process: API requests
+    # in progress at once, and the share of those slots each priority class
+    # may fill. Classes and route limits are "<METHODS> <path pattern>=<n>"
+    # rules; ADMISSION_CLASSES is tried before the built-in ones
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+    ADMISSION_CLASS_SHARES = os.getenv("ADMISSION_CLASS_SHARES", "high=1,normal=0.75,low=0.25")
+    ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "")
+    ADMISSION_ROUTE_LIMITS = os.getenv(
+        "ADMISSION_ROUTE_LIMITS", "GET /api/analytics/average-age=2,GET /api/patients|/api/appointments=8")
+    # Requests waiting for a slot (split between classes by share), and for how long
+    ADMISSION_QUEUE_DEPTH = int(os.getenv("ADMISSION_QUEUE_DEPTH", "64"))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+    # Per-client token bucket: requests per second and burst; off (0) by
+    # default. Clients are told apart by remote address, or by this header
+    # (e.g. X-Forwarded-For behind a proxy)
+    ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0"))
+    ADMISSION_CLIENT_BURST = int(os.getenv("ADMISSION_CLIENT_BURST", "200"))
+    ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+
+    # Production server (see serve.py)
+    SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+    SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+    SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))  # 0: one per CPU
+    SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+    SERVE_READ_TIMEOUT = float(os.getenv("SERVE_READ_TIMEOUT", "10"))
+    # Requested by each worker before it accepts traffic (connections,
+    # statement caches, lazily built indexes)
+    SERVE_WARMUP_PATHS = [p for p in os.getenv(
+        "SERVE_WARMUP_PATHS", "/health,/api/patients?limit=1,/api/doctors?limit=1,/api/appointments?limit=1"
+    ).split(",") if p]
 
     # Logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # or "text"
+    # Records a logger (and its children) may write per second, and the share
+    # of their records below WARNING that is kept: "<logger>=<n>,..."
+    LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "")
+    LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # beyond this, records are dropped
@@ -6,10 +6,79 @@ for the core models: Patient, Doctor, and Appointment.
 It abstracts the database logic away from the API/route handlers.
 """
 
-from datetime import datetime
-from .db import db
-from .models import Patient, Doctor, Appointment
-from .exceptions import NotFoundError, BadRequestError
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from .db import db, after_commit, read_execute
+from .models import Patient, Doctor, Appointment, ArchivedAppointment, TableChange
+from .exceptions import NotFoundError, BadRequestError, ConflictError
+from . import schedule, reminders, changes, shards
+from .cache import get_cache
+from .emailer import enqueue_email
+
+BATCH = "hms_batch"  # session.info flag set inside transaction()
+
+@contextmanager
+def transaction():
+    """Runs the crud writes made in the block as one transaction.
+
+    The writes only flush; the block commits them together at the end, or
+    rolls all of them back if it raises. Lookups inside the block bypass
+    the entity cache so that they see the block's own changes.
+    """
+    session = db.session()
+    session.info[BATCH] = True
+    try:
+        yield
+        # Objects on other shards could not be reloaded from the primary
+        expire, session.expire_on_commit = session.expire_on_commit, False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(BATCH, None)
+
+def _commit():
+    # Inside transaction() the block commits once at its end
+    if db.session.info.get(BATCH):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+def _cache():
+    # The cache does not know about a pending transaction()'s deletes yet
+    return None if db.session.info.get(BATCH) else get_cache()
+
+def _replicate_doctor(did):
+    # Shards copy committed rows from the primary
+    if db.session.info.get(BATCH):
+        after_commit(lambda: shards.replicate(Doctor, [did]))
+    else:
+        shards.replicate(Doctor, [did])
+
+def _load_for_write(model, pk, message):
+    # Writes always start from the database row, never a cached snapshot,
+    # and drop the cached copy once the change commits.
+    obj = db.session.get(model, pk)
+    if not obj:
+        raise NotFoundError(message)
+    cache = get_cache()
+    if cache is not None:
+        after_commit(lambda: cache.invalidate(model, pk))
+    return obj
+
+def _check_email(email, pid=None):
+    # Each shard's unique index only covers its own patients, and a
+    # patient keeps their shard when their email changes
+    if email is None:
+        return
+    stmt = db.select(Patient.id).where(Patient.email == email, Patient.id != (pid or 0)).limit(1)
+    if any(result.first() is not None for result in shards.each(stmt)):
+        raise ConflictError("A patient with this email already exists")
 
 # ------------------ Patients ------------------
 
@@ -30,16 +99,19 @@ def create_patient(name, dob, email=None, gender=None, phone=None, address=None)
 
     Raises:
         BadRequestError: If the 'dob' string is not in valid ISO format.
+        ConflictError: If another patient has this email.
     """
     try:
         if isinstance(dob, str):
             dob = datetime.fromisoformat(dob).date()
     except ValueError:
         raise BadRequestError("DOB must be ISO date string YYYY-MM-DD")
-    
-    patient = Patient(name=name, dob=dob, email=email, gender=gender, phone=phone, address=address)
-    db.session.add(patient)
-    db.session.commit()
+    _check_email(email)
+    with shards.route(shards.place(email or name)):
+        patient = Patient(name=name, dob=dob, email=email, gender=gender, phone=phone, address=address)
+        db.session.add(patient)
+        changes.upserted(patient)
+        _commit()
     return patient
 
 def get_patient(pid: int) -> Patient:
@@ -54,18 +126,121 @@ def get_patient(pid: int) -> Patient:
     Raises:
         NotFoundError: If no patient with the given ID exists.
     """
-    p = db.session.get(Patient, pid)
+    cache = _cache()
+    with shards.route(shards.shard_of(pid)):
+        p = cache.get(Patient, pid) if cache else db.session.get(Patient, pid)
     if not p:
         raise NotFoundError("Patient not found")
     return p
 
-def list_patients():
-    """Lists all patients in the database, ordered by ID descending.
+def _by_id(row):
+    return row.id
+
+def _patients_stmt(after=None, columns=None):
+    stmt = (db.select(*columns) if columns else db.select(Patient)).order_by(Patient.id.desc())
+    if after is not None:
+        stmt = stmt.where(Patient.id < int(after))
+    return stmt
+
+def list_patients(limit=None, after=None, columns=None):
+    """Lists patients ordered by ID descending, one keyset page at a time.
+
+    Args:
+        limit (int, optional): Maximum number of patients to return.
+                               If None, all remaining patients are returned.
+        after (int, optional): Keyset cursor; only patients with an ID
+                               lower than this are returned.
+        columns (list, optional): Only select these column expressions
+                                  (see serializers.Schema.columns).
+
+    Returns:
+        list: Patient objects, or rows of ``columns`` if given.
+    """
+    stmt = _patients_stmt(after, columns)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return shards.read(stmt, _by_id, reverse=True, limit=limit, scalars=not columns)
+
+def iter_patients(after=None, chunk_size=100, columns=None):
+    """Yields patients ordered by ID descending through a server-side cursor.
+
+    Rows are fetched ``chunk_size`` at a time (``yield_per``), so memory use
+    stays flat regardless of the table size.
+
+    Args:
+        after (int, optional): Keyset cursor, as in list_patients().
+        chunk_size (int): Number of rows buffered per fetch.
+        columns (list, optional): Only select these column expressions.
+
+    Yields:
+        Patient objects (or rows of ``columns``), one at a time.
+    """
+    yield from shards.stream(_patients_stmt(after, columns), _by_id, reverse=True, scalars=not columns,
+                             chunk_size=chunk_size)
+
+def _contains(term):
+    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return db.or_(*(col.like(pattern, escape="\\") for col in (Patient.name, Patient.email, Patient.phone)))
+
+def search_patients(q: str, limit: int, offset: int = 0, columns=None):
+    """Searches patients by name, email and phone.
+
+    Every whitespace-separated term must occur (case-insensitively) in one
+    of the three fields. Terms of three or more characters are looked up in
+    the ``patients_fts`` trigram index (see search.py); shorter terms, or
+    all terms when the index is unavailable, are matched with LIKE.
+
+    When at most SEARCH_RANK_LIMIT patients match, they are ordered by
+    relevance (search.score: name before email before phone, word starts
+    first); larger result sets are returned newest first.
+
+    Args:
+        q (str): The search text.
+        limit (int): Maximum number of patients to return.
+        offset (int): Number of matches to skip (pagination).
+        columns (list, optional): Only select these column expressions
+                                  (see serializers.Schema.columns); must
+                                  include ``id``.
 
     Returns:
-        list[Patient]: A list of all Patient objects.
+        tuple: (Patient objects or rows of ``columns``, whether they are
+               ordered by relevance).
+
+    Raises:
+        BadRequestError: If ``q`` contains no search terms.
     """
-    return Patient.query.order_by(Patient.id.desc()).all()
+    from .search import FTS_TABLE, fts_enabled, match_query, score
+    terms = q.lower().split() if q else []
+    if not terms:
+        raise BadRequestError("Search text 'q' is required")
+    match, short = match_query(q) if fts_enabled() else (None, terms)
+    where = [_contains(t) for t in short]
+    order = Patient.id.desc()
+    stmt = db.select(Patient.id, Patient.name, Patient.email, Patient.phone)
+    if match is not None:
+        fts = db.table(FTS_TABLE, db.column("rowid"))
+        where.append(db.literal_column(FTS_TABLE).op("MATCH")(match))
+        stmt = stmt.join(fts, fts.c.rowid == Patient.id)
+        order = fts.c.rowid.desc()  # walks the index instead of sorting
+    cap = current_app.config["SEARCH_RANK_LIMIT"]
+    candidates = shards.read(stmt.where(*where).order_by(order).limit(cap + 1), _by_id, reverse=True, limit=cap + 1)
+
+    select = db.select(*columns) if columns else db.select(Patient)
+    if len(candidates) > cap:
+        # With several shards the page is among each shard's first offset + limit matches
+        skip = offset if shards.count() > 1 else 0
+        query = select.where(Patient.id.in_(stmt.with_only_columns(Patient.id).where(*where)
+                                            .order_by(order).limit(limit + skip).offset(offset - skip)))
+        rows = shards.read(query.order_by(Patient.id.desc()), _by_id, reverse=True, scalars=not columns)
+        return rows[skip:skip + limit], False
+
+    candidates.sort(key=lambda r: (-score(r, terms), -r.id))
+    ids = [r.id for r in candidates[offset:offset + limit]]
+    if not ids:
+        return [], True
+    rows = shards.read(select.where(Patient.id.in_(ids)), scalars=not columns, only=shards.group(ids))
+    found = {r.id: r for r in rows}
+    return [found[i] for i in ids if i in found], True
 
 def update_patient(pid: int, **fields):
     """Updates an existing patient's information.
@@ -81,20 +256,25 @@ def update_patient(pid: int, **fields):
     Raises:
         NotFoundError: If no patient with the given ID exists.
         BadRequestError: If 'dob' is provided as a badly formatted string.
+        ConflictError: If another patient has the new email.
     """
-    p = get_patient(pid) # Raises NotFoundError if not found
-    for k, v in fields.items():
-        if k == "dob" and isinstance(v, str):
-            try:
-                v = datetime.fromisoformat(v).date()
-            except ValueError:
-                raise BadRequestError("DOB must be ISO date string YYYY-MM-DD")
-        setattr(p, k, v)
-    db.session.commit()
+    with shards.route(shards.shard_of(pid)):
+        p = _load_for_write(Patient, pid, "Patient not found")
+        if fields.get("email") not in (None, p.email):
+            _check_email(fields["email"], pid)
+        for k, v in fields.items():
+            if k == "dob" and isinstance(v, str):
+                try:
+                    v = datetime.fromisoformat(v).date()
+                except ValueError:
+                    raise BadRequestError("DOB must be ISO date string YYYY-MM-DD")
+            setattr(p, k, v)
+        changes.upserted(p)
+        _commit()
     return p
 
 def delete_patient(pid: int):
-    """Deletes a patient from the database.
+    """Deletes a patient with their appointments, archived ones included.
 
     Args:
         pid (int): The ID of the patient to delete.
@@ -102,9 +282,12 @@ def delete_patient(pid: int):
     Raises:
         NotFoundError: If no patient with the given ID exists.
     """
-    p = get_patient(pid) # Raises NotFoundError if not found
-    db.session.delete(p)
-    db.session.commit()
+    with shards.route(shards.shard_of(pid)):
+        p = _load_for_write(Patient, pid, "Patient not found")
+        _delete_appointments(Appointment.patient_id == pid, ArchivedAppointment.patient_id == pid)
+        changes.deleted(p)
+        db.session.delete(p)
+        _commit()
 
 # ------------------ Doctors ------------------
 
@@ -121,7 +304,9 @@ def create_doctor(name, specialty=None, email=None):
     """
     doc = Doctor(name=name, specialty=specialty, email=email)
     db.session.add(doc)
-    db.session.commit()
+    changes.upserted(doc)
+    _commit()
+    _replicate_doctor(doc.id)
     return doc
 
 def get_doctor(did: int) -> Doctor:
@@ -136,18 +321,52 @@ def get_doctor(did: int) -> Doctor:
     Raises:
         NotFoundError: If no doctor with the given ID exists.
     """
-    d = db.session.get(Doctor, did)
+    cache = _cache()
+    d = cache.get(Doctor, did) if cache else db.session.get(Doctor, did)
     if not d:
         raise NotFoundError("Doctor not found")
     return d
 
-def list_doctors():
-    """Lists all doctors in the database, ordered by ID descending.
+def _doctors_stmt(after=None, columns=None):
+    stmt = (db.select(*columns) if columns else db.select(Doctor)).order_by(Doctor.id.desc())
+    if after is not None:
+        stmt = stmt.where(Doctor.id < int(after))
+    return stmt
+
+def list_doctors(limit=None, after=None, columns=None):
+    """Lists doctors ordered by ID descending, one keyset page at a time.
+
+    Args:
+        limit (int, optional): Maximum number of doctors to return.
+                               If None, all remaining doctors are returned.
+        after (int, optional): Keyset cursor; only doctors with an ID
+                               lower than this are returned.
+        columns (list, optional): Only select these column expressions
+                                  (see serializers.Schema.columns).
 
     Returns:
-        list[Doctor]: A list of all Doctor objects.
+        list: Doctor objects, or rows of ``columns`` if given.
+    """
+    stmt = _doctors_stmt(after, columns)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    result = read_execute(stmt)
+    return result.all() if columns else result.scalars().all()
+
+def iter_doctors(after=None, chunk_size=100, columns=None):
+    """Yields doctors ordered by ID descending through a server-side cursor.
+
+    Args:
+        after (int, optional): Keyset cursor, as in list_doctors().
+        chunk_size (int): Number of rows buffered per fetch.
+        columns (list, optional): Only select these column expressions.
+
+    Yields:
+        Doctor objects (or rows of ``columns``), one at a time.
     """
-    return Doctor.query.order_by(Doctor.id.desc()).all()
+    stmt = _doctors_stmt(after, columns).execution_options(yield_per=chunk_size)
+    result = read_execute(stmt)
+    yield from result if columns else result.scalars()
 
 def update_doctor(did: int, **fields):
     """Updates an existing doctor's information.
@@ -163,14 +382,16 @@ def update_doctor(did: int, **fields):
     Raises:
         NotFoundError: If no doctor with the given ID exists.
     """
-    d = get_doctor(did) # Raises NotFoundError if not found
+    d = _load_for_write(Doctor, did, "Doctor not found")
     for k, v in fields.items():
         setattr(d, k, v)
-    db.session.commit()
+    changes.upserted(d)
+    _commit()
+    _replicate_doctor(did)
     return d
 
 def delete_doctor(did: int):
-    """Deletes a doctor from the database.
+    """Deletes a doctor with their appointments, archived ones included.
 
     Args:
         did (int): The ID of the doctor to delete.
@@ -178,51 +399,209 @@ def delete_doctor(did: int):
     Raises:
         NotFoundError: If no doctor with the given ID exists.
     """
-    d = get_doctor(did) # Raises NotFoundError if not found
+    d = _load_for_write(Doctor, did, "Doctor not found")
+    for shard in range(shards.count()):  # the doctor's patients may be on any shard
+        with shards.route(shard):
+            _delete_appointments(Appointment.doctor_id == did, ArchivedAppointment.doctor_id == did)
+    changes.deleted(d)
     db.session.delete(d)
-    db.session.commit()
+    after_commit(lambda: schedule.get_index().invalidate(did))
+    _commit()
+    _replicate_doctor(did)
+
+def _delete_appointments(hot, cold):
+    # The cascade of a patient or doctor delete: one DELETE per table
+    # through the (patient_id|doctor_id, visit_time) indexes, archive
+    # included, instead of loading and deleting each appointment.
+    gone = db.session.execute(
+        db.delete(Appointment).where(hot).returning(Appointment.id, Appointment.doctor_id, Appointment.visit_time)
+    ).all()
+    archived = db.session.execute(
+        db.delete(ArchivedAppointment).where(cold).returning(ArchivedAppointment.id)).scalars().all()
+    index = schedule.get_index()
+    for aid, did, start in gone:
+        after_commit(lambda a=(did, aid, start): index.release(*a))
+        reminders.forget(aid)
+    changes.log("appointments", [aid for aid, _, _ in gone] + archived, "delete")
 
 # ------------------ Appointments ------------------
 
-def create_appointment(patient_id: int, doctor_id: int, visit_time, notes=None):
+def _parse_datetime(value, field):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise BadRequestError(f"{field} must be ISO datetime string")
+    return value
+
+def _check_duration(minutes):
+    if not isinstance(minutes, int) or isinstance(minutes, bool) or minutes < 1:
+        raise BadRequestError("duration_minutes must be a positive integer")
+    return minutes
+
+def _reserve(appt, previous=None):
+    # Flush so the row has an ID, then claim the slot in the interval index.
+    db.session.flush()
+    try:
+        schedule.get_index().reserve(appt, previous)
+    except ConflictError:
+        db.session.rollback()
+        raise
+
+def create_appointment(patient_id: int, doctor_id: int, visit_time, notes=None, duration_minutes=None,
+                       notify=True):
     """Creates a new appointment record.
 
+    If the patient has an email address, a confirmation is queued in the
+    email outbox in the same transaction.
+
     Args:
         patient_id (int): The ID of the patient.
         doctor_id (int): The ID of the doctor.
         visit_time (str or datetime): The time of the appointment.
                                      If str, must be in ISO format.
         notes (str, optional): Any notes for the appointment.
+        duration_minutes (int, optional): Length of the visit.
+                                          Defaults to APPOINTMENT_MINUTES.
+        notify (bool): Queue a confirmation email to the patient.
 
     Returns:
         Appointment: The new Appointment object.
 
     Raises:
         NotFoundError: If the patient_id or doctor_id does not exist.
-        BadRequestError: If 'visit_time' is a badly formatted string.
+        BadRequestError: If 'visit_time' or 'duration_minutes' is invalid.
+        ConflictError: If the doctor already has an overlapping appointment.
     """
-    if isinstance(visit_time, str):
-        try:
-            visit_time = datetime.fromisoformat(visit_time)
-        except ValueError:
-            raise BadRequestError("visit_time must be ISO datetime string")
+    visit_time = _parse_datetime(visit_time, "visit_time")
+    if duration_minutes is None:
+        duration_minutes = current_app.config["APPOINTMENT_MINUTES"]
+    _check_duration(duration_minutes)
     
     # ensure foreign keys exist
-    get_patient(patient_id)
+    patient = get_patient(patient_id)
     get_doctor(doctor_id)
     
-    appt = Appointment(patient_id=patient_id, doctor_id=doctor_id, visit_time=visit_time, notes=notes)
-    db.session.add(appt)
-    db.session.commit()
+    with shards.route(shards.shard_of(patient_id)):  # stored with the patient
+        appt = Appointment(patient_id=patient_id, doctor_id=doctor_id, visit_time=visit_time,
+                           notes=notes, duration_minutes=duration_minutes,
+                           reminded_at=reminders.booking_reminded_at(visit_time))
+        db.session.add(appt)
+        _reserve(appt)
+        reminders.track(appt)
+        changes.upserted(appt)
+        if notify and patient.email:
+            enqueue_email(patient.email, "Appointment Scheduled",
+                          f"Your appointment ID {appt.id} is scheduled for {visit_time:%Y-%m-%d %H:%M}.")
+        _commit()
+    return appt
+
+def get_appointment(aid: int) -> Appointment:
+    """Gets a single appointment by its unique ID.
+
+    Args:
+        aid (int): The ID of the appointment to retrieve.
+
+    Returns:
+        Appointment: The found Appointment object.
+
+    Raises:
+        NotFoundError: If no appointment with the given ID exists.
+    """
+    with shards.route(shards.shard_of(aid)):
+        appt = db.session.get(Appointment, aid)
+    if not appt:
+        raise NotFoundError("Appointment not found")
     return appt
 
-def list_appointments():
-    """Lists all appointments, ordered by visit time ascending.
+def appointment_cursor(appt: Appointment) -> str:
+    """Builds the keyset cursor that resumes a listing after ``appt``.
+
+    Args:
+        appt (Appointment): The last appointment of a page.
+
+    Returns:
+        str: A cursor of the form ``<visit_time ISO>,<id>``.
+    """
+    return f"{appt.visit_time.isoformat()},{appt.id}"
+
+def _by_visit(row):
+    return row.visit_time, row.id
+
+def _patient_shard(patient_id):
+    # A patient's appointments are all on the patient's shard
+    return None if patient_id is None else [shards.shard_of(patient_id)]
+
+def _appointments_stmt(after=None, columns=None, model=Appointment, patient_id=None, doctor_id=None,
+                       frm=None, to=None):
+    stmt = (db.select(*columns) if columns else db.select(model)).order_by(
+        model.visit_time.asc(), model.id.asc())
+    # Per-patient/doctor filters are served by the (patient_id|doctor_id, visit_time) indexes
+    if patient_id is not None:
+        stmt = stmt.where(model.patient_id == patient_id)
+    if doctor_id is not None:
+        stmt = stmt.where(model.doctor_id == doctor_id)
+    frm, to = _parse_datetime(frm, "from"), _parse_datetime(to, "to")
+    if frm is not None and to is not None and to <= frm:
+        raise BadRequestError("from must be before to")
+    if frm is not None:
+        stmt = stmt.where(model.visit_time >= frm)
+    if to is not None:
+        stmt = stmt.where(model.visit_time < to)
+    if after is not None:
+        try:
+            ts, _, aid = after.rpartition(",")
+            ts, aid = datetime.fromisoformat(ts), int(aid)
+        except ValueError:
+            raise BadRequestError("after must be a cursor of the form <visit_time>,<id>")
+        # The leading >= gives the planner a range start on the visit_time index
+        stmt = stmt.where(model.visit_time >= ts, db.or_(model.visit_time > ts, model.id > aid))
+    return stmt
+
+def list_appointments(limit=None, after=None, columns=None, patient_id=None, doctor_id=None, frm=None, to=None):
+    """Lists appointments ordered by visit time (then ID) ascending,
+    one keyset page at a time.
+
+    Args:
+        limit (int, optional): Maximum number of appointments to return.
+                               If None, all remaining appointments are returned.
+        after (str, optional): Keyset cursor from appointment_cursor().
+        columns (list, optional): Only select these column expressions
+                                  (see serializers.Schema.columns).
+        patient_id (int, optional): Only this patient's appointments.
+        doctor_id (int, optional): Only this doctor's appointments.
+        frm (str or datetime, optional): Only visits starting at or after this.
+        to (str or datetime, optional): Only visits starting before this.
 
     Returns:
-        list[Appointment]: A list of all Appointment objects.
+        list: Appointment objects, or rows of ``columns`` if given.
+
+    Raises:
+        BadRequestError: If 'after', 'frm' or 'to' is invalid.
     """
-    return Appointment.query.order_by(Appointment.visit_time.asc()).all()
+    stmt = _appointments_stmt(after, columns, Appointment, patient_id, doctor_id, frm, to)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return shards.read(stmt, _by_visit, limit=limit, scalars=not columns, only=_patient_shard(patient_id))
+
+def iter_appointments(after=None, chunk_size=100, columns=None, **filters):
+    """Yields appointments in listing order through a server-side cursor.
+
+    Args:
+        after (str, optional): Keyset cursor from appointment_cursor().
+        chunk_size (int): Number of rows buffered per fetch.
+        columns (list, optional): Only select these column expressions.
+        **filters: ``patient_id``, ``doctor_id``, ``frm`` and ``to``, as
+                   for list_appointments().
+
+    Yields:
+        Appointment objects (or rows of ``columns``), one at a time.
+
+    Raises:
+        BadRequestError: If 'after' or a filter is invalid.
+    """
+    yield from shards.stream(_appointments_stmt(after, columns, Appointment, **filters), _by_visit,
+                             scalars=not columns, chunk_size=chunk_size)
 
 def update_appointment(aid: int, **fields):
     """Updates an existing appointment.
@@ -237,22 +616,34 @@ def update_appointment(aid: int, **fields):
 
     Raises:
         NotFoundError: If no appointment with the given ID exists.
-        BadRequestError: If 'visit_time' is a badly formatted string.
+        BadRequestError: If 'visit_time' or 'duration_minutes' is invalid.
+        ConflictError: If the new time slot overlaps another appointment.
     """
-    appt = db.session.get(Appointment, aid)
-    if not appt:
-        raise NotFoundError("Appointment not found")
-    
-    if "visit_time" in fields and isinstance(fields["visit_time"], str):
-        try:
-            fields["visit_time"] = datetime.fromisoformat(fields["visit_time"])
-        except ValueError:
-            raise BadRequestError("visit_time must be ISO datetime string")
+    with shards.route(shards.shard_of(aid)):
+        return _update_appointment(aid, fields)
 
+def _update_appointment(aid, fields):
+    appt = get_appointment(aid) # Raises NotFoundError if not found
+    
+    if "patient_id" in fields and shards.shard_of(fields["patient_id"]) != shards.shard_of(aid):
+        raise BadRequestError("An appointment cannot move to a patient on another shard")
+    if "visit_time" in fields:
+        fields["visit_time"] = _parse_datetime(fields["visit_time"], "visit_time")
+    if "duration_minutes" in fields:
+        _check_duration(fields["duration_minutes"])
+    if "doctor_id" in fields:
+        get_doctor(fields["doctor_id"])
+
+    previous = (appt.doctor_id, appt.visit_time)
     for k, v in fields.items():
         setattr(appt, k, v)
-        
-    db.session.commit()
+    if appt.visit_time != previous[1]:
+        appt.reminded_at = None  # the new time gets its own reminder
+    if fields.keys() & {"visit_time", "duration_minutes", "doctor_id", "status"}:
+        _reserve(appt, previous)
+        reminders.track(appt)
+    changes.upserted(appt)
+    _commit()
     return appt
 
 def delete_appointment(aid: int):
@@ -264,9 +655,137 @@ def delete_appointment(aid: int):
     Raises:
         NotFoundError: If no appointment with the given ID exists.
     """
-    appt = db.session.get(Appointment, aid)
+    with shards.route(shards.shard_of(aid)):
+        appt = get_appointment(aid) # Raises NotFoundError if not found
+        key = (appt.doctor_id, appt.id, appt.visit_time)
+        changes.deleted(appt)
+        db.session.delete(appt)
+        after_commit(lambda: schedule.get_index().release(*key))
+        reminders.forget(aid)
+        _commit()
+
+def free_slots(did: int, frm, to, length=None):
+    """Finds a doctor's free time slots, answered from the interval index.
+
+    Args:
+        did (int): The ID of the doctor.
+        frm (str or datetime): Start of the search window (ISO format if str).
+        to (str or datetime): End of the search window (ISO format if str).
+        length (int, optional): Minimum slot length in minutes.
+                                Defaults to APPOINTMENT_MINUTES.
+
+    Returns:
+        list[tuple[datetime, datetime]]: Free ``(start, end)`` ranges, in order.
+
+    Raises:
+        NotFoundError: If no doctor with the given ID exists.
+        BadRequestError: If the window or length is invalid.
+    """
+    frm, to = _parse_datetime(frm, "from"), _parse_datetime(to, "to")
+    if frm is None or to is None or to <= frm:
+        raise BadRequestError("from and to are required and from must be before to")
+    if to - frm > timedelta(days=current_app.config["FREE_SLOTS_MAX_DAYS"]):
+        raise BadRequestError(f"window may span at most {current_app.config['FREE_SLOTS_MAX_DAYS']} days")
+    length = _check_duration(current_app.config["APPOINTMENT_MINUTES"] if length is None else length)
+    get_doctor(did)
+    return schedule.get_index().get(did).free_slots(frm, to, timedelta(minutes=length))
+
+def get_related(model, pk: int):
+    """Gets one object for ``?include=`` through the entity cache.
+
+    Raises:
+        NotFoundError: If the row does not exist.
+    """
+    cache = get_cache()
+    with shards.route(shards.shard_of(pk)):
+        obj = cache.get(model, pk) if cache else db.session.get(model, pk)
+    if not obj:
+        raise NotFoundError(f"{model.__name__} not found")
+    return obj
+
+def get_many(model, ids, columns):
+    """Loads the rows of ``model`` with the given IDs in one ``IN`` query
+    (batched relationship loading for ``?include=``).
+
+    Args:
+        model: Patient or Doctor.
+        ids (iterable): Primary keys; duplicates are loaded once.
+        columns (list): The column expressions to select.
+
+    Returns:
+        list: Rows of ``columns`` in ID order; missing IDs are skipped.
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return []
+    return shards.read(db.select(*columns).where(model.id.in_(ids)).order_by(model.id), _by_id,
+                       only=shards.group(ids))
+
+# ------------------ Archive ------------------
+
+def get_archived_appointment(aid: int) -> ArchivedAppointment:
+    """Gets an archived appointment by its (original) ID.
+
+    Raises:
+        NotFoundError: If no archived appointment has that ID.
+    """
+    appt = shards.read_shard(shards.shard_of(aid),
+                             db.select(ArchivedAppointment).where(ArchivedAppointment.id == aid)).scalar()
     if not appt:
-        raise NotFoundError("Appointment not found")
-    
-    db.session.delete(appt)
-    db.session.commit()
+        raise NotFoundError("Archived appointment not found")
+    return appt
+
+def list_archived_appointments(limit=None, after=None, columns=None, patient_id=None, doctor_id=None):
+    """Lists archived appointments in listing order (visit time, then ID),
+    optionally one patient's or doctor's.
+
+    Args:
+        limit (int, optional): Maximum number of appointments to return.
+        after (str, optional): Keyset cursor from appointment_cursor().
+        columns (list, optional): Only select these column expressions.
+        patient_id (int, optional): Only this patient's appointments.
+        doctor_id (int, optional): Only this doctor's appointments.
+
+    Returns:
+        list: ArchivedAppointment objects, or rows of ``columns`` if given.
+
+    Raises:
+        BadRequestError: If 'after' is not a valid cursor.
+    """
+    stmt = _appointments_stmt(after, columns, ArchivedAppointment, patient_id, doctor_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return shards.read(stmt, _by_visit, limit=limit, scalars=not columns, only=_patient_shard(patient_id))
+
+# ------------------ Change tracking ------------------
+
+def collection_version(model) -> tuple:
+    """Cheap markers that change whenever a table's rows do, for conditional
+    GETs: newest ``updated_at``, highest ID, and the deletion count and time
+    kept by triggers (migration 0006). Each is a single index lookup; there
+    is no ``count(*)``, which SQLite answers by scanning the table. Other
+    databases have no triggers and use the row count in place of deletions.
+
+    Args:
+        model: Patient, Doctor or Appointment.
+
+    Returns:
+        tuple: ``(max updated_at, max id, deletions, last deletion time)``,
+        combined over the shards for sharded tables.
+    """
+    tracked = db.select(TableChange).where(TableChange.name == model.__tablename__)
+    if db.engine.dialect.name == "sqlite":
+        deletions = tracked.with_only_columns(TableChange.deletions)
+    else:
+        deletions = db.select(db.func.count()).select_from(model)
+    rows = shards.read(db.select(
+        db.select(db.func.max(model.updated_at)).scalar_subquery(),
+        db.select(db.func.max(model.id)).scalar_subquery(),
+        deletions.scalar_subquery(),
+        tracked.with_only_columns(TableChange.deleted_at).scalar_subquery(),
+    ))
+    if len(rows) == 1:
+        return rows[0]
+    latest = lambda values: max(filter(None, values), default=None)
+    updated, top, deleted, deleted_at = zip(*rows)
+    return latest(updated), latest(top), sum(filter(None, deleted)), latest(deleted_at)
@@ -1,7 +1,197 @@
+import logging
+import sqlalchemy as sa
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
 
-db = SQLAlchemy()
+log = logging.getLogger(__name__)
+
+READ_BIND = "read"
+
+# ------------------ Shard routing ------------------
+
+# Tables that exist on every shard and hold that shard's rows (see shards.py)
+SHARDED_TABLES = frozenset({"patients", "appointments", "appointments_archive", "table_changes",
+                            "shard_sequences"})
+ROUTE = "hms_shard"  # session.info key: the shard chosen with shards.route()
+SHARD_BITS = 40  # IDs of rows on shard n start above n << SHARD_BITS
+
+def shard_bind(shard: int):
+    """The bind key of a shard; shard 0 is the primary database."""
+    return f"shard{shard}" if shard else None
+
+class RoutingSession(FlaskSession):
+    """Sends statements on ``SHARDED_TABLES``, and raw SQL, to the shard
+    chosen with ``shards.route()``; everything else, and everything when no
+    shard is chosen, goes where Flask-SQLAlchemy would send it. A flush
+    writes each row with an ID to the shard the ID belongs to."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, shard=None, **kwargs):
+        if bind is None:
+            if shard is None:
+                shard = self.info.get(ROUTE)
+                if shard and not _on_shard(mapper, clause):
+                    shard = None
+            if shard:
+                return self._db.engines[shard_bind(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def flush(self, objects=None):
+        # The unit of work asks connection_callable for each row's connection;
+        # set only while flushing, as ORM bulk INSERTs refuse to run with one.
+        self.connection_callable = self._row_connection
+        try:
+            super().flush(objects)
+        finally:
+            self.connection_callable = None
+
+    def _row_connection(self, mapper=None, instance=None, **kwargs):
+        pk = getattr(instance, "id", None)
+        shard = pk >> SHARD_BITS if isinstance(pk, int) and _on_shard(mapper, None) else None
+        return self.get_transaction().connection(mapper, shard=shard)
+
+def _on_shard(mapper, clause) -> bool:
+    if mapper is not None:
+        tables = [sa.inspect(mapper).local_table]
+    elif clause is not None:
+        tables = find_tables(clause, include_crud=True)
+    else:
+        tables = []
+    # text() and connection() have no tables: raw SQL goes with the rows
+    return not tables or any(t.name in SHARDED_TABLES for t in tables)
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+def _create_tables(create):
+    for attempt in range(5):
+        try:
+            create()
+            return
+        except OperationalError:
+            # Another process starting on the same new database created a
+            # table between the existence check and CREATE; check again.
+            if attempt == 4:
+                raise
 
 def init_db():
     from . import models  # noqa: F401
-    db.create_all()
+    from .migrations import migrate
+    from .search import init_search
+    _create_tables(lambda: db.create_all(bind_key=None))  # the read bind is a replica, never migrated here
+    migrate()
+    # Every other shard gets the tables of its rows (and the doctors they
+    # refer to) and the same migrations: indexes, triggers, search index.
+    tables = [t for t in db.metadata.sorted_tables if t.name in SHARDED_TABLES or t.name == "doctors"]
+    for key, engine in db.engines.items():
+        if key is not None and key.startswith("shard"):
+            _create_tables(lambda: db.metadata.create_all(engine, tables=tables))
+            migrate(engine)
+    init_search()
+
+# ------------------ Engines ------------------
+
+def _in_memory(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _engine_options(url, profile: dict, extra: dict) -> dict:
+    # Pool sizing does not apply to in-memory SQLite, which shares a
+    # single connection (StaticPool).
+    options = {} if _in_memory(url) else dict(profile.get("pool", {}))
+    options.update(extra)
+    return options
+
+def _set_pragmas(engine, pragmas: dict):
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+def setup_engines(app):
+    """Binds ``db`` to the app using the DB_PROFILE engine profile.
+
+    The profile's pool options go into SQLALCHEMY_ENGINE_OPTIONS and its
+    PRAGMAs run on every new SQLite connection. If READ_DATABASE_URL is set,
+    a ``read`` bind is added with the same profile plus ``query_only``;
+    see read_execute(). Each SHARD_DATABASE_URLS entry adds a ``shard<n>``
+    bind with the same profile; see shards.py.
+    """
+    cfg = app.config
+    name = cfg["DB_PROFILE"]
+    try:
+        profile = cfg["DB_PROFILES"][name]
+    except KeyError:
+        raise RuntimeError(f"Unknown DB_PROFILE '{name}'") from None
+    cfg["SQLALCHEMY_ENGINE_OPTIONS"] = _engine_options(
+        cfg["SQLALCHEMY_DATABASE_URI"], profile, cfg.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    read_url = cfg.get("READ_DATABASE_URL")
+    if read_url:
+        cfg.setdefault("SQLALCHEMY_BINDS", {})[READ_BIND] = _engine_options(read_url, profile, {"url": read_url})
+    shard_urls = [u.strip() for u in (cfg.get("SHARD_DATABASE_URLS") or "").split(",") if u.strip()]
+    for shard, url in enumerate(shard_urls, start=1):
+        if _in_memory(url):
+            # Shards are read from several threads at once (shards.read)
+            raise RuntimeError(f"Shard database '{url}' must not be in-memory")
+        cfg.setdefault("SQLALCHEMY_BINDS", {})[shard_bind(shard)] = _engine_options(url, profile, {"url": url})
+    cfg["SHARD_COUNT"] = len(shard_urls) + 1
+    db.init_app(app)
+
+    pragmas = profile.get("pragmas", {})
+    with app.app_context():
+        for key, engine in db.engines.items():
+            _set_pragmas(engine, dict(pragmas, query_only="ON") if key == READ_BIND else pragmas)
+    log.debug("Database profile '%s'%s, %s shard(s)", name, " with read bind" if read_url else "",
+              cfg["SHARD_COUNT"])
+
+def read_engine():
+    """Returns the engine for read-only queries: the ``read`` bind if one is
+    configured, otherwise the primary engine."""
+    engines = db.engines
+    return engines.get(READ_BIND) or engines[None]
+
+def read_execute(stmt, **kwargs):
+    """Executes a read-only ``stmt`` on the read engine, in the current session.
+
+    Used for list and analytics queries so that they do not compete with
+    booking writes. With a replica, results may lag the primary slightly.
+    """
+    return db.session.execute(stmt, bind_arguments={"bind": read_engine()}, **kwargs)
+
+# ------------------ Transaction hooks ------------------
+
+def after_commit(fn):
+    """Runs ``fn()`` once the current transaction commits.
+
+    Used to keep in-memory structures in step with the database; the hook
+    is dropped if the transaction rolls back instead.
+    """
+    db.session.info.setdefault("hms_after_commit", []).append(fn)
+
+def after_rollback(fn):
+    """Runs ``fn()`` if the current transaction ends without committing."""
+    db.session.info.setdefault("hms_after_rollback", []).append(fn)
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_hooks(session):
+    session.info.pop("hms_after_rollback", None)
+    for fn in session.info.pop("hms_after_commit", ()):
+        fn()
+
+@event.listens_for(Session, "after_transaction_end")
+def _run_rollback_hooks(session, transaction):
+    if transaction.parent is not None:
+        return
+    session.info.pop("hms_after_commit", None)
+    for fn in session.info.pop("hms_after_rollback", ()):
+        fn()
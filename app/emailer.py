@@ -1,17 +1,342 @@
-from concurrent.futures import ThreadPoolExecutor
-from flask import current_app
+"""
+Email Delivery (Outbox)
+
+Emails are not sent from request threads. ``enqueue_email`` adds a row to
+the ``email_outbox`` table inside the caller's transaction, so a booking
+and its confirmation commit (or roll back) together and nothing is lost
+on restart. A small pool of worker threads drains the outbox: each worker
+claims a batch of due rows with a lease, sends the whole batch over one
+pooled SMTP connection, and records the outcome. Transient failures are
+retried with exponential backoff; permanent (5xx) rejections, and rows
+that do not make a valid message (e.g. a CR/LF in the address), are not.
+"""
 import logging
+import queue
+import smtplib
+import threading
 import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from flask import current_app
+from .db import db, after_commit
+from .models import OutboxEmail
 
-_executor = ThreadPoolExecutor(max_workers=2)
+log = logging.getLogger(__name__)
 
-def _send(email_to: str, subject: str, body: str):
-    # Simulated email send
-    logging.getLogger(__name__).info("Sending email to %s: %s", email_to, subject)
-    time.sleep(0.5)  # simulate latency
-    return {"to": email_to, "subject": subject, "ok": True}
+# ------------------ SMTP connection pool ------------------
+
+class SMTPPool:
+    """Keeps up to ``size`` authenticated SMTP sessions open for reuse."""
+
+    def __init__(self, host, port, size=2, user=None, password=None, starttls=False, timeout=10):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.user, self.password, self.starttls = user, password, starttls
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        self.opened += 1
+        return smtp
+
+    def _checkout(self):
+        # An idle session may have been dropped by the server; NOOP finds out
+        # before a batch is sent over it.
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if _alive(smtp):
+                return smtp
+            _quietly_close(smtp)
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection, checked with NOOP if it was idle; it
+        is discarded if the block raises."""
+        with self._slots:
+            smtp = self._checkout()
+            try:
+                yield smtp
+            except BaseException:
+                _quietly_close(smtp)
+                raise
+            self._idle.put(smtp)
+
+    def close(self):
+        while True:
+            try:
+                _quietly_close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+def _alive(smtp) -> bool:
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+def _quietly_close(smtp):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+# ------------------ Outbox ------------------
+
+def enqueue_email(email_to: str, subject: str, body: str) -> OutboxEmail:
+    """Adds an email to the outbox as part of the current transaction.
+
+    The caller commits; workers are woken once that commit happens.
+
+    Returns:
+        OutboxEmail: The pending outbox row.
+    """
+    msg = OutboxEmail(email_to=email_to, subject=subject, body=body)
+    db.session.add(msg)
+    outbox = current_app.extensions.get("hms_outbox")
+    if outbox is not None:
+        after_commit(outbox.notify)
+    return msg
 
 def send_email(email_to: str, subject: str, body: str, background: bool = True):
+    """Sends an email, through the outbox by default.
+
+    Args:
+        background (bool): If True, the email is committed to the outbox and
+                           delivered by the workers; otherwise it is sent
+                           over SMTP before returning.
+
+    Returns:
+        OutboxEmail or dict: The outbox row, or the send result.
+    """
     if background:
-        return _executor.submit(_send, email_to, subject, body)
-    return _send(email_to, subject, body)
+        msg = enqueue_email(email_to, subject, body)
+        db.session.commit()
+        return msg
+    outbox = get_outbox()
+    with outbox.pool.connection() as smtp:
+        smtp.send_message(outbox.build_message(email_to, subject, body))
+    return {"to": email_to, "subject": subject, "ok": True}
+
+
+class Outbox:
+    """Per-application outbox drainer: worker threads, SMTP pool and stats."""
+
+    def __init__(self, app):
+        cfg = app.config
+        self.app = app
+        self.batch_size = cfg["EMAIL_BATCH_SIZE"]
+        self.max_attempts = cfg["EMAIL_MAX_ATTEMPTS"]
+        self.retry_base = cfg["EMAIL_RETRY_BASE_SECONDS"]
+        self.lease = timedelta(seconds=cfg["EMAIL_LEASE_SECONDS"])
+        self.poll = cfg["EMAIL_POLL_SECONDS"]
+        self.from_email = cfg["FROM_EMAIL"]
+        self.pool = SMTPPool(cfg["SMTP_HOST"], cfg["SMTP_PORT"], size=max(cfg["EMAIL_WORKERS"], 1),
+                             user=cfg["SMTP_USER"], password=cfg["SMTP_PASSWORD"],
+                             starttls=cfg["SMTP_STARTTLS"], timeout=cfg["SMTP_TIMEOUT"])
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._recent = deque()  # (timestamp, count) of sent batches
+        self.sent_total = 0
+        self.failed_total = 0
+        self.retried_total = 0
+
+    # --- lifecycle ---
+
+    def start(self, workers: int):
+        for n in range(workers):
+            t = threading.Thread(target=self._work, name=f"hms-outbox-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.notify()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+        self.pool.close()
+
+    def notify(self):
+        with self._wake:
+            self._wake.notify_all()
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    sent = self.process_batch()
+            except Exception:
+                log.exception("Outbox worker error")
+                sent = None
+            if not sent:
+                with self._wake:
+                    self._wake.wait(self.poll)
+
+    # --- delivery ---
+
+    def build_message(self, email_to, subject, body):
+        msg = EmailMessage()
+        msg["From"], msg["To"], msg["Subject"] = self.from_email, email_to, subject
+        msg.set_content(body)
+        return msg
+
+    def _claim(self, now):
+        # Rows whose lease expired (a worker died mid-batch) are claimable
+        # again. The guarded UPDATE makes the claim safe against other
+        # workers and processes picking the same IDs.
+        ids = db.session.execute(
+            db.select(OutboxEmail.id)
+            .where(OutboxEmail.status.in_(("pending", "sending")), OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at)
+            .limit(self.batch_size)
+        ).scalars().all()
+        if not ids:
+            db.session.commit()
+            return []
+        token = uuid.uuid4().hex
+        db.session.execute(
+            db.update(OutboxEmail)
+            .where(OutboxEmail.id.in_(ids),
+                   OutboxEmail.status.in_(("pending", "sending")),
+                   OutboxEmail.next_attempt_at <= now)
+            .values(status="sending", claim_token=token, next_attempt_at=now + self.lease)
+        )
+        db.session.commit()
+        return db.session.execute(
+            db.select(OutboxEmail)
+            .where(OutboxEmail.id.in_(ids), OutboxEmail.claim_token == token)
+            .order_by(OutboxEmail.id)
+        ).scalars().all()
+
+    def process_batch(self, now: datetime = None) -> int:
+        """Claims and sends one batch of due emails over a single connection.
+
+        Returns:
+            int: Number of emails sent.
+        """
+        now = now or datetime.utcnow()
+        batch = self._claim(now)
+        if not batch:
+            return 0
+        sent, failures = [], {}
+        error = "Batch interrupted"
+        try:
+            with self.pool.connection() as smtp:
+                for msg in batch:
+                    try:
+                        message = self.build_message(msg.email_to, msg.subject, msg.body)
+                    except ValueError as exc:  # e.g. a header with CR/LF
+                        failures[msg.id] = (f"Invalid message: {exc}", True)
+                        continue
+                    try:
+                        smtp.send_message(message)
+                        sent.append(msg)
+                    except smtplib.SMTPRecipientsRefused as exc:
+                        codes = [code for code, _ in exc.recipients.values()]
+                        failures[msg.id] = (str(exc), all(c >= 500 for c in codes))
+                    except (smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as exc:
+                        failures[msg.id] = (str(exc), exc.smtp_code >= 500)
+        except (smtplib.SMTPException, OSError) as exc:
+            # Connection-level failure: everything not yet sent is retried.
+            log.warning("SMTP session failed after %s/%s emails: %s", len(sent), len(batch), exc)
+            error = str(exc)
+        finally:
+            # Every claimed row is settled, whatever went wrong: one left
+            # "sending" would be claimed again when its lease expires, and
+            # the rows sent before it would go out twice.
+            sent_ids = {msg.id for msg in sent}
+            for msg in batch:
+                if msg.id not in sent_ids and msg.id not in failures:
+                    failures[msg.id] = (error, False)
+            self._record(batch, sent, failures, now)
+        return len(sent)
+
+    def _record(self, batch, sent, failures, now):
+        for msg in sent:
+            msg.status, msg.sent_at, msg.claim_token, msg.last_error = "sent", now, None, None
+            msg.attempts += 1
+        failed = retried = 0
+        for msg in batch:
+            if msg.id not in failures:
+                continue
+            error, permanent = failures[msg.id]
+            msg.attempts += 1
+            msg.claim_token, msg.last_error = None, error[:500]
+            if permanent or msg.attempts >= self.max_attempts:
+                msg.status = "failed"
+                failed += 1
+            else:
+                msg.status = "pending"
+                msg.next_attempt_at = now + timedelta(seconds=self.retry_base * 2 ** (msg.attempts - 1))
+                retried += 1
+        db.session.commit()
+        with self._lock:
+            self.sent_total += len(sent)
+            self.failed_total += failed
+            self.retried_total += retried
+            if sent:
+                self._recent.append((time.monotonic(), len(sent)))
+        if failed or retried:
+            log.warning("Outbox batch: %s sent, %s retrying, %s failed", len(sent), retried, failed)
+
+    def drain(self, now: datetime = None) -> int:
+        """Sends every due email in the calling thread; returns how many."""
+        total = 0
+        while True:
+            n = self.process_batch(now)
+            total += n
+            if not n and not self._due(now):
+                return total
+
+    def _due(self, now=None):
+        now = now or datetime.utcnow()
+        return db.session.execute(
+            db.select(db.func.count(OutboxEmail.id))
+            .where(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now)
+        ).scalar_one()
+
+    # --- stats ---
+
+    def stats(self) -> dict:
+        counts = dict(db.session.execute(
+            db.select(OutboxEmail.status, db.func.count(OutboxEmail.id))
+            .where(OutboxEmail.status.in_(("pending", "sending", "failed")))
+            .group_by(OutboxEmail.status)
+        ).all())
+        cutoff = time.monotonic() - 60
+        with self._lock:
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
+            last_minute = sum(n for _, n in self._recent)
+            totals = {"sent_total": self.sent_total, "failed_total": self.failed_total,
+                      "retried_total": self.retried_total}
+        return {
+            "queue_depth": counts.get("pending", 0) + counts.get("sending", 0),
+            "in_flight": counts.get("sending", 0),
+            "failed": counts.get("failed", 0),
+            "sent_last_minute": last_minute,
+            "connections_opened": self.pool.opened,
+            "workers": len(self._threads),
+            **totals,
+        }
+
+def init_app(app):
+    outbox = app.extensions["hms_outbox"] = Outbox(app)
+    if app.config["EMAIL_WORKERS"] > 0 and not app.testing:
+        outbox.start(app.config["EMAIL_WORKERS"])
+
+def get_outbox() -> Outbox:
+    return current_app.extensions["hms_outbox"]
@@ -3,3 +3,9 @@ class NotFoundError(Exception):
 
 class BadRequestError(Exception):
     pass
+
+class ConflictError(Exception):
+    pass
+
+class UpstreamError(Exception):
+    pass
@@ -0,0 +1,220 @@
+"""
+Background Batch Jobs
+
+Runs the chunked reports from ``batch_calc`` on a small thread pool so a
+request worker never waits on them. After every chunk the job's state is
+committed to the ``batch_jobs`` table, which gives callers progress,
+lets a job be cancelled between chunks, and lets a cancelled, failed or
+interrupted job resume from its last checkpoint.
+
+Jobs still pending or running when a process exits are ``interrupted``:
+``shutdown()`` marks its own on a graceful stop, and the startup sweep in
+``init_app`` (``JOBS_RECOVER_ON_START``) catches those of a process that
+crashed. With several worker processes on one database only one of them
+may run the sweep, or it would interrupt jobs its siblings are running.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from .db import db
+from .models import BatchJob, Patient
+from .exceptions import NotFoundError, BadRequestError
+from . import batch_calc
+
+log = logging.getLogger(__name__)
+
+RESUMABLE = ("cancelled", "failed", "interrupted")
+
+class JobRunner:
+    """Per-application job executor."""
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._cancel = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def _submit(self, job_id):
+        with self._lock:
+            stopping = self._stopping
+            if not stopping:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.app.config["JOB_WORKERS"], thread_name_prefix="hms-job")
+                event = self._cancel[job_id] = threading.Event()
+                future = self._futures[job_id] = self._executor.submit(self._run, job_id, event)
+        if stopping:  # submitted while the process drains: left for a resume
+            self._interrupt([job_id])
+            return None
+        return future
+
+    def wait(self, job_id: int, timeout: float = None):
+        """Blocks until the job's current run finishes (no-op if not running)."""
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def submit(self, report: str, params: dict = None) -> BatchJob:
+        """Creates a job for ``report`` and starts it in the background.
+
+        Raises:
+            BadRequestError: If the report is unknown or batch_size is invalid.
+        """
+        report_obj = batch_calc.get_report(report)
+        params = dict(params or {})
+        batch_size = params.get("batch_size")
+        if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+            raise BadRequestError("batch_size must be a positive integer")
+        job = BatchJob(report=report, params=params, checkpoint=report_obj.start(params))
+        db.session.add(job)
+        db.session.commit()
+        db.session.refresh(job)  # load before the worker starts touching the row
+        self._submit(job.id)
+        return job
+
+    def cancel(self, job_id: int) -> BatchJob:
+        """Asks a running job to stop after its current chunk.
+
+        Raises:
+            NotFoundError: If the job does not exist.
+        """
+        job = get_job(job_id)
+        event = self._cancel.get(job_id)
+        if event is not None:
+            event.set()
+        elif job.status == "pending":
+            job.status = "cancelled"
+            db.session.commit()
+        return job
+
+    def resume(self, job_id: int) -> BatchJob:
+        """Restarts a stopped job from its last checkpoint.
+
+        Raises:
+            NotFoundError: If the job does not exist.
+            BadRequestError: If the job is not in a resumable state.
+        """
+        job = get_job(job_id)
+        if job.status not in RESUMABLE or job_id in self._cancel:
+            raise BadRequestError(f"Job in state '{job.status}' cannot be resumed")
+        job.status, job.error = "pending", None
+        db.session.commit()
+        db.session.refresh(job)
+        self._submit(job_id)
+        return job
+
+    def shutdown(self, timeout: float = None):
+        """Stops every job after its current chunk, marking it interrupted
+        (resumable), and waits up to ``timeout`` seconds for them."""
+        with self._lock:
+            self._stopping = True
+            futures = dict(self._futures)
+            events = list(self._cancel.values())
+        for event in events:
+            event.set()
+        self._interrupt([job_id for job_id, future in futures.items() if future.cancel()])
+        wait(list(futures.values()), timeout)
+
+    def _interrupt(self, job_ids):
+        if job_ids:
+            with self.app.app_context():
+                db.session.execute(db.update(BatchJob).where(BatchJob.id.in_(job_ids)).values(status="interrupted"))
+                db.session.commit()
+
+    def _run(self, job_id, cancel):
+        with self.app.app_context():
+            try:
+                self._execute(job_id, cancel)
+            except Exception as exc:
+                log.exception("Job %s failed", job_id)
+                db.session.rollback()
+                job = db.session.get(BatchJob, job_id)
+                job.status, job.error = "failed", str(exc)[:500]
+                db.session.commit()
+            finally:
+                with self._lock:
+                    self._cancel.pop(job_id, None)
+                    self._futures.pop(job_id, None)
+
+    def _execute(self, job_id, cancel):
+        job = db.session.get(BatchJob, job_id)
+        report = batch_calc.get_report(job.report)
+        batch_size = job.params.get("batch_size") or current_app.config["BATCH_SIZE"]
+        state = job.checkpoint or report.start(job.params)
+        fresh = job.processed == 0
+        # Only a single uninterrupted pass over an unchanged table is cacheable.
+        fingerprint = batch_calc.table_fingerprint(Patient) if report.cacheable and fresh else None
+
+        cached = batch_calc.cached_result(report.name, fingerprint) if fingerprint is not None else None
+        if cached is not None:
+            job.status, job.result = "completed", cached
+            db.session.commit()
+            return
+
+        job.status = "running"
+        if job.total is None:
+            job.total = report.total(state)
+        db.session.commit()
+
+        done = False
+        while not done:
+            if cancel.is_set():
+                job.status = "interrupted" if self._stopping else "cancelled"
+                db.session.commit()
+                log.info("Job %s %s after %s rows", job_id, job.status, job.processed)
+                return
+            state, count, done = report.step(state, batch_size)
+            job.checkpoint = state
+            job.processed += count
+            db.session.commit()
+
+        job.result = report.finish(state)
+        job.status = "completed"
+        db.session.commit()
+        if fingerprint is not None and batch_calc.table_fingerprint(Patient) == fingerprint:
+            batch_calc.store_result(report.name, fingerprint, job.result)
+        log.info("Job %s (%s) completed: %s rows", job_id, report.name, job.processed)
+
+def init_app(app):
+    """Registers the job runner and marks jobs orphaned by a previous process
+    as interrupted, so they can be resumed."""
+    app.extensions["hms_jobs"] = JobRunner(app)
+    if not app.config["JOBS_RECOVER_ON_START"]:
+        return
+    with app.app_context():
+        db.session.execute(
+            db.update(BatchJob)
+            .where(BatchJob.status.in_(("pending", "running")))
+            .values(status="interrupted")
+        )
+        db.session.commit()
+
+def get_runner() -> JobRunner:
+    return current_app.extensions["hms_jobs"]
+
+def get_job(job_id: int) -> BatchJob:
+    """Gets a job by ID.
+
+    Raises:
+        NotFoundError: If no job with the given ID exists.
+    """
+    job = db.session.get(BatchJob, job_id)
+    if not job:
+        raise NotFoundError("Job not found")
+    return job
+
+def job_dict(job: BatchJob) -> dict:
+    return {
+        "id": job.id,
+        "report": job.report,
+        "status": job.status,
+        "params": job.params,
+        "processed": job.processed,
+        "total": job.total,
+        "progress": (job.processed / job.total) if job.total else None,
+        "result": job.result,
+        "error": job.error,
+    }
@@ -1,6 +1,282 @@
+"""
+Logging Pipeline
+
+Log calls never wait on I/O. The root logger's only handler stamps each
+record with the current request's ID, applies the per-logger rate limits
+(``LOG_RATE_LIMITS``) and sampling (``LOG_SAMPLING``) and puts the record
+on a bounded queue. One writer thread per process formats queued records
+as compact JSON lines (``LOG_FORMAT=text`` for the classic format) and
+writes them to stderr in batches, one write per batch. When the queue is
+full the record is dropped and counted instead of blocking the caller.
+
+Rules are ``<logger>=<value>`` pairs separated by commas and apply to the
+logger and its children, e.g. ``LOG_RATE_LIMITS=app.metrics=20`` (records
+per second, bursts up to the same number) and ``LOG_SAMPLING=werkzeug=0.1``
+(the share of records below WARNING that is kept).
+
+The pipeline belongs to the process, not the app: every ``create_app``
+reconfigures the one pipeline, and a forked child (a ``serve`` worker)
+gets a fresh queue and writer thread. Counters are served at
+``/api/logging/stats`` and ``/metrics``.
+"""
+import atexit
+import json
 import logging
+import os
+import queue
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from flask import g, has_request_context, request
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+REQUEST_ID = re.compile(r"[\w.:-]{1,64}")
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, without whitespace."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")[:-6] + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+class _Rule:
+    """Token bucket and sampling rate shared by a logger and its children."""
+    __slots__ = ("rate", "sample", "tokens", "stamp")
+
+    def __init__(self, rate=None, sample=None):
+        self.rate, self.sample = rate, sample
+        self.tokens, self.stamp = rate, time.monotonic()
+
+def parse_rules(value: str) -> dict:
+    """Parses ``name=value,name=value`` into ``{name: float}``.
+
+    Raises:
+        ValueError: If a pair is malformed.
+    """
+    rules = {}
+    for pair in filter(None, (p.strip() for p in (value or "").split(","))):
+        name, sep, number = pair.rpartition("=")
+        if not sep or not name:
+            raise ValueError(f"Invalid logging rule '{pair}': expected <logger>=<number>")
+        rules[name.strip()] = float(number)
+    return rules
+
+class LogPipeline:
+    """Bounded record queue, throttling rules and the writer thread."""
+
+    def __init__(self, capacity=10000, formatter=None, stream=None, batch_size=500):
+        self.capacity = capacity
+        self.formatter = formatter or JsonFormatter()
+        self.stream = stream or sys.stderr
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._by_logger = {}  # logger name -> _Rule or None, resolved through the dotted parents
+        self._reset()
+
+    def _reset(self):
+        self.queue = queue.Queue(self.capacity)
+        self._thread = None
+        self.enqueued = self.written = self.dropped = self.rate_limited = self.sampled_out = 0
+        self.max_backlog = 0
+
+    # --- configuration ---
+
+    def configure(self, rate_limits: dict = None, sampling: dict = None, formatter=None):
+        rules = {}
+        for name, rate in (rate_limits or {}).items():
+            rules[name] = _Rule(rate=rate)
+        for name, share in (sampling or {}).items():
+            rules.setdefault(name, _Rule()).sample = share
+        with self._lock:
+            self._rules, self._by_logger = rules, {}
+            if formatter is not None:
+                self.formatter = formatter
+
+    def _rule(self, name):
+        try:
+            return self._by_logger[name]
+        except KeyError:
+            pass
+        rule, prefix = None, name
+        while prefix:
+            rule = self._rules.get(prefix)
+            if rule is not None:
+                break
+            prefix = prefix.rpartition(".")[0]
+        self._by_logger[name] = rule
+        return rule
+
+    def _admit(self, record) -> bool:
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        if rule.sample is not None and record.levelno < logging.WARNING and random.random() >= rule.sample:
+            self.sampled_out += 1
+            return False
+        if rule.rate is not None:
+            with self._lock:
+                now = time.monotonic()
+                rule.tokens = min(rule.rate, rule.tokens + (now - rule.stamp) * rule.rate)
+                rule.stamp = now
+                if rule.tokens < 1:
+                    self.rate_limited += 1
+                    return False
+                rule.tokens -= 1
+        return True
+
+    # --- producer side (any thread) ---
+
+    def submit(self, record):
+        """Queues ``record`` unless a rule rejects it or the queue is full."""
+        if not self._admit(record):
+            return
+        # Resolve the message and traceback now: the arguments may change
+        # and the traceback pins frames until the writer gets to it.
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.enqueued += 1
+        backlog = self.queue.qsize()
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    # --- writer thread ---
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="hms-log-writer", daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self.stream.write("".join(self.formatter.format(r) + "\n" for r in records))
+                    self.stream.flush()
+                    self.written += len(records)
+            except Exception:  # a broken stream must not kill the writer
+                self.dropped += len(records)
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if len(records) < len(batch):
+                return  # stop sentinel
+
+    def flush(self):
+        """Blocks until every queued record has been written."""
+        if self._thread is not None:
+            self.queue.join()
+
+    def stop(self, timeout: float = 5.0):
+        """Writes what is queued, then ends the writer thread."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            thread.join(timeout)
+
+    def after_fork(self):
+        # The parent's writer thread does not exist here, and its queue may
+        # have been locked mid-operation; the parent writes its own backlog.
+        self._reset()
+        self.start()
+
+    def stats(self) -> dict:
+        return {"backlog": self.queue.qsize(), "max_backlog": self.max_backlog, "capacity": self.capacity,
+                "enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+                "rate_limited": self.rate_limited, "sampled_out": self.sampled_out}
+
+class QueueingHandler(logging.Handler):
+    """Root handler feeding the pipeline. It takes no lock: the queue is
+    thread-safe and the counters tolerate the odd lost increment."""
+
+    def __init__(self, pipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def handle(self, record):
+        if self.filter(record):
+            if has_request_context():
+                record.request_id = g.get("request_id")
+            self.pipeline.submit(record)
+        return record
+
+    def close(self):
+        self.pipeline.stop()
+        super().close()
+
+_pipeline = None
+
+def install(level="INFO", fmt="json", rate_limits=None, sampling=None, capacity=10000) -> LogPipeline:
+    """Routes the root logger through the pipeline (once per process) and
+    applies ``level``, ``fmt`` and the throttling rules."""
+    global _pipeline
+    formatter = logging.Formatter(FORMAT) if fmt == "text" else JsonFormatter()
+    if _pipeline is None:
+        _pipeline = LogPipeline(capacity, formatter)
+        logging.getLogger().addHandler(QueueingHandler(_pipeline))
+        _pipeline.start()
+        atexit.register(_pipeline.stop)
+    _pipeline.configure(rate_limits, sampling, formatter)
+    logging.getLogger().setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    return _pipeline
+
+def _after_fork_in_child():
+    if _pipeline is not None:
+        _pipeline.after_fork()
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def get_pipeline() -> LogPipeline:
+    return _pipeline
+
+# ------------------ Request IDs ------------------
+
+def _assign_request_id():
+    incoming = request.headers.get("X-Request-ID", "")
+    g.request_id = incoming if REQUEST_ID.fullmatch(incoming) else secrets.token_hex(8)
+
+def _echo_request_id(response):
+    request_id = g.get("request_id")
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
+    return response
 
 def setup_logging(app):
-    level = getattr(logging, app.config.get("LOG_LEVEL", "INFO"), logging.INFO)
-    logging.basicConfig(level=level,
-                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    cfg = app.config
+    install(cfg.get("LOG_LEVEL", "INFO"), cfg["LOG_FORMAT"], parse_rules(cfg["LOG_RATE_LIMITS"]),
+            parse_rules(cfg["LOG_SAMPLING"]), cfg["LOG_QUEUE_SIZE"])
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
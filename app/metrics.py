@@ -0,0 +1,237 @@
+"""
+Request Metrics
+
+Per-endpoint latency and SQL instrumentation for the API blueprint:
+
+- ``start_request`` / ``finish_request`` run as ``api_bp`` before/after
+  request hooks and time each request;
+- engine ``before/after_cursor_execute`` events count statements and DB
+  time for the request running on the current thread;
+- the ORM ``loaded_as_persistent`` event counts rows (entities) loaded,
+  and ``count_rows`` the rows of column selects (list endpoints).
+
+A request that runs the same statement METRICS_N_PLUS_ONE_THRESHOLD times
+or more (typically a lazy load such as ``Appointment.patient`` inside a
+loop) is logged as a likely N+1 and counted. Requests slower than the slow
+log threshold are logged with their statement list when the slow log is
+on; it can be switched at runtime through ``/api/metrics/slow-log``.
+
+Everything is exposed in Prometheus text format at ``/metrics``. Work done
+while a streamed response body is being generated is not included.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .db import db
+from . import logger, admission
+
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger(__name__ + ".slow")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus model."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            yield bound, total
+
+
+class _RequestStats:
+    __slots__ = ("started", "statements", "db_time", "rows", "queries")
+
+    def __init__(self, keep_queries):
+        self.started = time.perf_counter()
+        self.statements = Counter()
+        self.db_time = 0.0
+        self.rows = 0
+        self.queries = [] if keep_queries else None
+
+
+class Metrics:
+    """Per-application metric registry."""
+
+    def __init__(self, slow_log_enabled=False, slow_ms=500, n_plus_one=5):
+        self.slow_log_enabled = slow_log_enabled
+        self.slow_ms = slow_ms
+        self.n_plus_one = n_plus_one
+        self._lock = threading.Lock()
+        self.requests = Counter()  # (endpoint, method, status) -> n
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self.db_time = Counter()
+        self.rows = Counter()
+        self.n_plus_one_total = Counter()
+        self.slow_total = Counter()
+
+    def record(self, endpoint, method, status, stats):
+        elapsed = time.perf_counter() - stats.started
+        statements = sum(stats.statements.values())
+        repeated = [(sql, n) for sql, n in stats.statements.items() if n >= self.n_plus_one]
+        slow = elapsed * 1000 >= self.slow_ms
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            self.latency[endpoint].observe(elapsed)
+            self.statements[endpoint].observe(statements)
+            self.db_time[endpoint] += stats.db_time
+            self.rows[endpoint] += stats.rows
+            if repeated:
+                self.n_plus_one_total[endpoint] += 1
+            if slow:
+                self.slow_total[endpoint] += 1
+        for sql, n in repeated:
+            log.warning("Possible N+1 in %s %s: statement ran %s times: %s", method, endpoint, n, sql)
+        if slow and stats.queries is not None:
+            slow_log.warning("Slow request %s %s: %.1f ms, %s statements, %.1f ms in DB\n%s",
+                             method, endpoint, elapsed * 1000, statements, stats.db_time * 1000,
+                             "\n".join(f"  {ms:8.2f} ms  {sql}" for sql, ms in stats.queries))
+
+    def render(self) -> str:
+        """Returns all metrics in Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, text, data):
+            header(name, "histogram", text)
+            for endpoint, h in sorted(data.items()):
+                label = f'endpoint="{_escape(endpoint)}"'
+                for bound, total in h.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{label},le="{le}"}} {total}')
+                lines.append(f"{name}_sum{{{label}}} {h.sum}")
+                lines.append(f"{name}_count{{{label}}} {h.count}")
+
+        def counter(name, text, data):
+            header(name, "counter", text)
+            for endpoint, value in sorted(data.items()):
+                lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {value}')
+
+        with self._lock:
+            header("hms_requests_total", "counter", "API requests by endpoint, method and status.")
+            for (endpoint, method, status), n in sorted(self.requests.items()):
+                lines.append(f'hms_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",'
+                             f'status="{status}"}} {n}')
+            histogram("hms_request_duration_seconds", "API request latency.", self.latency)
+            histogram("hms_request_sql_statements", "SQL statements per API request.", self.statements)
+            counter("hms_db_time_seconds_total", "Time spent executing SQL.", self.db_time)
+            counter("hms_db_rows_loaded_total", "Rows loaded from the database (entities and column rows).", self.rows)
+            counter("hms_n_plus_one_total", "Requests that repeated one statement too often.",
+                    self.n_plus_one_total)
+            counter("hms_slow_requests_total", "Requests slower than the slow-log threshold.",
+                    self.slow_total)
+        pipeline = logger.get_pipeline()
+        if pipeline is not None:
+            stats = pipeline.stats()
+            header("hms_log_records_total", "counter", "Log records by outcome.")
+            for outcome in ("written", "dropped", "rate_limited", "sampled_out"):
+                lines.append(f'hms_log_records_total{{outcome="{outcome}"}} {stats[outcome]}')
+            header("hms_log_backlog", "gauge", "Log records waiting for the writer thread.")
+            lines.append(f"hms_log_backlog {stats['backlog']}")
+        controller = admission.get_controller()
+        if controller is not None:
+            stats = controller.stats()
+            header("hms_admission_shed_total", "counter", "API requests refused by admission control.")
+            for reason, by_class in stats["shed"].items():
+                for cls, n in by_class.items():
+                    lines.append(f'hms_admission_shed_total{{reason="{reason}",class="{cls}"}} {n}')
+            for name, kind, text in (("admitted", "counter", "API requests admitted, by priority class."),
+                                     ("running", "gauge", "API requests holding an admission slot."),
+                                     ("waiting", "gauge", "API requests waiting for an admission slot.")):
+                metric = f"hms_admission_{name}" + ("_total" if kind == "counter" else "")
+                header(metric, kind, text)
+                for cls, n in stats[name].items():
+                    lines.append(f'{metric}{{class="{cls}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _current():
+    return g.get("hms_request_stats") if has_app_context() else None
+
+# ------------------ Hooks ------------------
+
+def start_request():
+    metrics = current_app.extensions.get("hms_metrics")
+    if metrics is not None:
+        g.hms_request_stats = _RequestStats(keep_queries=metrics.slow_log_enabled)
+
+def finish_request(response):
+    stats = g.pop("hms_request_stats", None)
+    if stats is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        current_app.extensions["hms_metrics"].record(endpoint, request.method, response.status_code, stats)
+    return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault("hms_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current()
+    if stats is None or not conn.info.get("hms_query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["hms_query_start"].pop()
+    stats.statements[statement] += 1
+    stats.db_time += elapsed
+    if stats.queries is not None:
+        stats.queries.append((" ".join(statement.split()), elapsed * 1000))
+
+def _on_error(context):
+    starts = context.connection.info.get("hms_query_start") if context.connection is not None else None
+    if starts and _current() is not None:
+        starts.pop()
+
+def count_rows(n: int):
+    """Counts ``n`` rows of a column (non-entity) select, which the ORM
+    does not report, as loaded by the current request."""
+    stats = _current()
+    if stats is not None:
+        stats.rows += n
+
+@event.listens_for(Session, "loaded_as_persistent")
+def _count_loaded(session, instance):
+    stats = _current()
+    if stats is not None:
+        stats.rows += 1
+
+def init_app(app):
+    cfg = app.config
+    app.extensions["hms_metrics"] = Metrics(
+        slow_log_enabled=cfg["METRICS_SLOW_LOG"], slow_ms=cfg["METRICS_SLOW_REQUEST_MS"],
+        n_plus_one=cfg["METRICS_N_PLUS_ONE_THRESHOLD"])
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(engine, "handle_error", _on_error)
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
+
+def get_metrics() -> Metrics:
+    return current_app.extensions["hms_metrics"]
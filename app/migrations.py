@@ -0,0 +1,226 @@
+"""
+Schema Migrations
+
+``create_all`` only creates missing tables; it never adds a column or an
+index to a table that already exists. Changes to live databases are
+therefore written here as numbered migrations, applied in order at
+startup and recorded in ``schema_migrations``.
+
+Each migration runs in its own transaction, which starts by inserting its
+version row: on SQLite that takes the write lock, so when several worker
+processes start at once exactly one applies each migration and the others
+see the duplicate version and move on. Migrations must be idempotent
+(``IF NOT EXISTS``, column checks), because on a new database ``create_all``
+has usually built their objects already.
+
+Adding an index is a ``CREATE INDEX`` over the existing table; it blocks
+writers while it runs but never rebuilds the table. Only 0007 rebuilds
+one (``appointments``, to make its IDs AUTOINCREMENT), copying every row
+once.
+"""
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+from .db import db
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+def migration(version: str):
+    """Registers ``fn(conn)`` as the migration ``version`` (applied in
+    registration order)."""
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        return fn
+    return register
+
+# ------------------ Migrations ------------------
+
+@migration("0001_appointment_duration")
+def _appointment_duration(conn):
+    cols = {c["name"] for c in inspect(conn).get_columns("appointments")}
+    if "duration_minutes" not in cols:
+        conn.exec_driver_sql(
+            "ALTER TABLE appointments ADD COLUMN duration_minutes INTEGER NOT NULL DEFAULT 30")
+
+@migration("0002_appointment_indexes")
+def _appointment_indexes(conn):
+    # Per-doctor schedules and free slots, per-patient cascades, the
+    # visit_time listing order and status filters.
+    for name, columns in (
+        ("ix_appointments_doctor_time", "doctor_id, visit_time"),
+        ("ix_appointments_patient_time", "patient_id, visit_time"),
+        ("ix_appointments_visit_time", "visit_time"),
+        ("ix_appointments_status_time", "status, visit_time"),
+    ):
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON appointments ({columns})")
+
+@migration("0003_patients_fts")
+def _patients_fts(conn):
+    # Full-text index for search.py; SQLite only. Raises OperationalError if
+    # SQLite lacks FTS5 or the trigram tokenizer, which leaves the migration
+    # pending (and search on LIKE) until it does.
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql("""CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+        name, email, phone, content='patients', content_rowid='id', tokenize='trigram')""")
+    # One-row switch that search.deferred_index() flips inside a bulk
+    # insert's own transaction, so no other connection ever sees it set
+    conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS patients_fts_sync (deferred INTEGER NOT NULL)")
+    conn.exec_driver_sql("INSERT INTO patients_fts_sync SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM patients_fts_sync)")
+    conn.exec_driver_sql("""CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients
+    WHEN (SELECT deferred FROM patients_fts_sync) = 0 BEGIN
+        INSERT INTO patients_fts(rowid, name, email, phone) VALUES (new.id, new.name, new.email, new.phone);
+    END""")
+    conn.exec_driver_sql("""CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, name, email, phone)
+        VALUES ('delete', old.id, old.name, old.email, old.phone);
+    END""")
+    conn.exec_driver_sql("""CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF name, email, phone
+    ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, name, email, phone)
+        VALUES ('delete', old.id, old.name, old.email, old.phone);
+        INSERT INTO patients_fts(rowid, name, email, phone) VALUES (new.id, new.name, new.email, new.phone);
+    END""")
+    conn.exec_driver_sql("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')")
+
+@migration("0004_schedule_versions")
+def _schedule_versions(conn):
+    # Per-doctor change counter, bumped in the same transaction as every
+    # booking change, so each process can tell when its in-memory schedule
+    # (schedule.py) is stale. SQLite upsert syntax.
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schedule_versions (doctor_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)")
+    bump = ("INSERT INTO schedule_versions (doctor_id, version) {} "
+            "ON CONFLICT (doctor_id) DO UPDATE SET version = version + 1;")
+    conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS schedule_versions_ai AFTER INSERT ON appointments BEGIN
+        {bump.format("VALUES (new.doctor_id, 1)")}
+    END""")
+    conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS schedule_versions_ad AFTER DELETE ON appointments BEGIN
+        {bump.format("VALUES (old.doctor_id, 1)")}
+    END""")
+    conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS schedule_versions_au
+    AFTER UPDATE OF doctor_id, visit_time, duration_minutes, status ON appointments BEGIN
+        {bump.format("VALUES (new.doctor_id, 1)")}
+        {bump.format("SELECT old.doctor_id, 1 WHERE old.doctor_id <> new.doctor_id")}
+    END""")
+
+@migration("0005_appointment_reminders")
+def _appointment_reminders(conn):
+    # When the reminder went out (reminders.py); the index serves the
+    # scheduler's range query over unreminded, scheduled visits.
+    cols = {c["name"] for c in inspect(conn).get_columns("appointments")}
+    if "reminded_at" not in cols:
+        conn.exec_driver_sql("ALTER TABLE appointments ADD COLUMN reminded_at DATETIME")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_appointments_reminder_due "
+                         "ON appointments (status, reminded_at, visit_time)")
+
+TRACKED_TABLES = ("patients", "doctors", "appointments")
+
+@migration("0006_change_tracking")
+def _change_tracking(conn):
+    # Validators for conditional GETs (routes.py): max(updated_at) per table
+    # from an index, and a deletion counter bumped by triggers (SQLite upsert
+    # syntax; the time is written with the microseconds SQLAlchemy expects).
+    for table in TRACKED_TABLES:
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{table}_updated_at ON {table} (updated_at)")
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS table_changes "
+                         "(name VARCHAR(64) PRIMARY KEY, deletions INTEGER NOT NULL, deleted_at DATETIME)")
+    for table in TRACKED_TABLES:
+        conn.exec_driver_sql(f"""CREATE TRIGGER IF NOT EXISTS {table}_deleted AFTER DELETE ON {table} BEGIN
+            INSERT INTO table_changes (name, deletions, deleted_at)
+            VALUES ('{table}', 1, strftime('%Y-%m-%d %H:%M:%f000', 'now'))
+            ON CONFLICT (name) DO UPDATE SET deletions = deletions + 1, deleted_at = excluded.deleted_at;
+        END""")
+
+@migration("0007_appointment_autoincrement")
+def _appointment_autoincrement(conn):
+    # Archiving (archive.py) deletes the newest appointments too, and a plain
+    # SQLite rowid would hand their IDs out again, clashing with the archived
+    # rows. AUTOINCREMENT never reuses an ID; it needs a rebuilt table, after
+    # which the earlier (idempotent) migrations put back its indexes and
+    # triggers. The sequence starts above every ID the archive holds.
+    if conn.dialect.name != "sqlite":
+        return
+    ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'appointments'").scalar()
+    if "AUTOINCREMENT" not in ddl.upper():
+        columns = ("id, patient_id, doctor_id, visit_time, notes, status, duration_minutes, reminded_at, "
+                   "created_at, updated_at")
+        conn.exec_driver_sql("""CREATE TABLE appointments_rebuild (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL REFERENCES patients (id) ON DELETE CASCADE,
+            doctor_id INTEGER NOT NULL REFERENCES doctors (id) ON DELETE CASCADE,
+            visit_time DATETIME NOT NULL,
+            notes VARCHAR(500),
+            status VARCHAR(32) NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            reminded_at DATETIME,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL)""")
+        conn.exec_driver_sql(f"INSERT INTO appointments_rebuild ({columns}) SELECT {columns} FROM appointments")
+        conn.exec_driver_sql("DROP TABLE appointments")
+        conn.exec_driver_sql("ALTER TABLE appointments_rebuild RENAME TO appointments")
+        for restore in (_appointment_indexes, _schedule_versions, _appointment_reminders, _change_tracking):
+            restore(conn)
+    top = conn.exec_driver_sql(
+        "SELECT max(coalesce((SELECT max(id) FROM appointments), 0), "
+        "coalesce((SELECT max(id) FROM appointments_archive), 0))").scalar()
+    conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'appointments'")
+    conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('appointments', ?)", (top,))
+
+@migration("0008_archivable_index")
+def _archivable_index(conn):
+    # Past visits that archive.py may move, oldest first; SQLite partial
+    # index (elsewhere ix_appointments_visit_time serves the same query).
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_appointments_archivable "
+                         "ON appointments (visit_time) WHERE status <> 'scheduled'")
+
+# ------------------ Runner ------------------
+
+def _ensure_table(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version VARCHAR(64) PRIMARY KEY, applied_at DATETIME NOT NULL)")
+
+def applied_versions(conn) -> set:
+    """Returns the versions recorded in ``schema_migrations``."""
+    _ensure_table(conn)
+    return set(conn.exec_driver_sql("SELECT version FROM schema_migrations").scalars())
+
+def migrate(engine=None) -> list:
+    """Applies pending migrations in order.
+
+    Returns:
+        list: Versions applied by this call.
+    """
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, fn in MIGRATIONS:
+        if version in done:
+            continue
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(db.text("INSERT INTO schema_migrations (version, applied_at) VALUES (:v, :t)"),
+                             {"v": version, "t": datetime.utcnow()})
+                fn(conn)
+        except IntegrityError:
+            continue  # applied concurrently by another process
+        except OperationalError as exc:
+            # Left pending and retried on the next start; later migrations
+            # do not depend on earlier ones having succeeded.
+            log.warning("Migration %s not applied: %s", version, exc.orig)
+            continue
+        applied.append(version)
+        log.info("Applied migration %s in %.2fs", version, time.perf_counter() - started)
+    return applied
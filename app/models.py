@@ -1,5 +1,6 @@
 from .db import db
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from sqlalchemy.ext.hybrid import hybrid_property
 
 class TimestampMixin(db.Model):
     __abstract__ = True
@@ -8,6 +9,9 @@ class TimestampMixin(db.Model):
 
 class Patient(TimestampMixin):
     __tablename__ = "patients"
+    # Indexes on updated_at serve the collection validators (routes.py) and
+    # are mirrored by migration 0006 for existing databases
+    __table_args__ = (db.Index("ix_patients_updated_at", "updated_at"),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(200), unique=True, nullable=True)
@@ -15,29 +19,136 @@ class Patient(TimestampMixin):
     gender = db.Column(db.String(16), nullable=True)
     phone = db.Column(db.String(32), nullable=True)
     address = db.Column(db.String(300), nullable=True)
-    appointments = db.relationship("Appointment", back_populates="patient", cascade="all, delete-orphan")
+    # crud deletes a patient's appointments with one statement (passive_deletes:
+    # the ORM never loads them to delete one by one)
+    appointments = db.relationship("Appointment", back_populates="patient", cascade="all, delete-orphan",
+                                   passive_deletes=True)
 
-    @property
+    @hybrid_property
     def age(self) -> int:
         today = date.today()
         return today.year - self.dob.year - ((today.month, today.day) < (self.dob.month, self.dob.day))
 
+    @age.inplace.expression
+    @classmethod
+    def _age_expression(cls):
+        # Same rule as above, evaluated by the database from ``dob``.
+        today = date.today()
+        birthday_later = db.extract("month", cls.dob) * 100 + db.extract("day", cls.dob) > today.month * 100 + today.day
+        return today.year - db.extract("year", cls.dob) - db.case((birthday_later, 1), else_=0)
+
 class Doctor(TimestampMixin):
     __tablename__ = "doctors"
+    __table_args__ = (db.Index("ix_doctors_updated_at", "updated_at"),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     specialty = db.Column(db.String(120), nullable=True)
     email = db.Column(db.String(200), unique=True, nullable=True)
-    appointments = db.relationship("Appointment", back_populates="doctor", cascade="all, delete-orphan")
+    appointments = db.relationship("Appointment", back_populates="doctor", cascade="all, delete-orphan",
+                                   passive_deletes=True)
 
 class Appointment(TimestampMixin):
     __tablename__ = "appointments"
+    # Mirrored by migrations 0002, 0005, 0006, 0007 and 0008 for existing databases.
+    # AUTOINCREMENT: IDs freed by archiving (archive.py) are never reused.
+    __table_args__ = (
+        db.Index("ix_appointments_doctor_time", "doctor_id", "visit_time"),
+        db.Index("ix_appointments_patient_time", "patient_id", "visit_time"),
+        db.Index("ix_appointments_visit_time", "visit_time"),
+        db.Index("ix_appointments_status_time", "status", "visit_time"),
+        db.Index("ix_appointments_reminder_due", "status", "reminded_at", "visit_time"),
+        db.Index("ix_appointments_updated_at", "updated_at"),
+        # Archival candidates (archive.py), oldest first
+        db.Index("ix_appointments_archivable", "visit_time", sqlite_where=db.text("status <> 'scheduled'")),
+        {"sqlite_autoincrement": True},
+    )
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey("patients.id"), nullable=False)
-    doctor_id = db.Column(db.Integer, db.ForeignKey("doctors.id"), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey("patients.id", ondelete="CASCADE"), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey("doctors.id", ondelete="CASCADE"), nullable=False)
     visit_time = db.Column(db.DateTime, nullable=False)
     notes = db.Column(db.String(500), nullable=True)
     status = db.Column(db.String(32), default="scheduled", nullable=False)
+    duration_minutes = db.Column(db.Integer, default=30, nullable=False)
+    reminded_at = db.Column(db.DateTime, nullable=True)
 
     patient = db.relationship("Patient", back_populates="appointments")
     doctor = db.relationship("Doctor", back_populates="appointments")
+
+    @property
+    def end_time(self) -> datetime:
+        return self.visit_time + timedelta(minutes=self.duration_minutes)
+
+class ArchivedAppointment(db.Model):
+    """A past appointment moved out of ``appointments`` by archive.py, with
+    its original ID and timestamps. Rows are never updated; they go when
+    their patient or doctor is deleted."""
+    __tablename__ = "appointments_archive"
+    __table_args__ = (
+        db.Index("ix_appointments_archive_patient_time", "patient_id", "visit_time"),
+        db.Index("ix_appointments_archive_doctor_time", "doctor_id", "visit_time"),
+        db.Index("ix_appointments_archive_visit_time", "visit_time"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    visit_time = db.Column(db.DateTime, nullable=False)
+    notes = db.Column(db.String(500), nullable=True)
+    status = db.Column(db.String(32), nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False)
+    reminded_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class TableChange(db.Model):
+    """Deletion counter per table, kept by triggers (migration 0006).
+    Inserts and updates show up in a table's max(updated_at) instead."""
+    __tablename__ = "table_changes"
+    name = db.Column(db.String(64), primary_key=True)
+    deletions = db.Column(db.Integer, default=0, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+class ShardSequence(db.Model):
+    """Highest ID handed out for a table on one shard other than shard 0
+    (see shards.py); shard 0 tables use their own autoincrement."""
+    __tablename__ = "shard_sequences"
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+
+class ChangeLog(db.Model):
+    """One create, update or delete of a patient, doctor or appointment,
+    written in the same transaction (see changes.py). ``id`` is the feed
+    cursor; AUTOINCREMENT keeps it from ever being reused."""
+    __tablename__ = "change_log"
+    __table_args__ = (db.Index("ix_change_log_entity", "entity", "id"), {"sqlite_autoincrement": True})
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(32), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)  # "upsert", "delete" or "archive"
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class BatchJob(TimestampMixin):
+    __tablename__ = "batch_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    report = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(32), default="pending", nullable=False)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    checkpoint = db.Column(db.JSON, nullable=True)
+    processed = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+
+class OutboxEmail(TimestampMixin):
+    __tablename__ = "email_outbox"
+    __table_args__ = (db.Index("ix_email_outbox_due", "status", "next_attempt_at"),)
+    id = db.Column(db.Integer, primary_key=True)
+    email_to = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claim_token = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.String(500), nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
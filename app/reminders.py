@@ -0,0 +1,226 @@
+"""
+Appointment Reminders
+
+A reminder is due ``REMINDER_LEAD_MINUTES`` before a scheduled visit. The
+scheduler keeps the reminders due within the next ``REMINDER_HORIZON_MINUTES``
+in a heap ordered by due time, loaded with one range query over the
+``(status, reminded_at, visit_time)`` index, so the cost of a reload is the
+number of upcoming visits, never the size of the table. ``crud`` pushes
+bookings, reschedules and cancellations made by this process once they
+commit; the window is reloaded every ``REMINDER_REFRESH_SECONDS`` (and as
+it runs out) to pick up changes made by other processes.
+
+Due reminders are sent in batches of ``REMINDER_BATCH_SIZE``: one
+``UPDATE ... RETURNING`` (per shard, see shards.py) claims the appointments that are still scheduled,
+unreminded and due by setting ``reminded_at``, and the emails are queued
+in the outbox in the same transaction. Stale heap entries (rescheduled,
+cancelled or deleted visits) simply fail the claim, and when several
+processes run a scheduler each reminder is still claimed exactly once.
+
+A booking made within the lead time is marked reminded at once: its
+confirmation email serves as the reminder. A reschedule clears
+``reminded_at``, so the new time gets a reminder of its own.
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from .db import db, after_commit
+from .models import Appointment, Patient, Doctor
+from .emailer import enqueue_email
+from . import changes, shards
+
+log = logging.getLogger(__name__)
+
+class ReminderScheduler:
+    """Per-application heap of upcoming reminders and its sender thread."""
+
+    def __init__(self, app):
+        cfg = app.config
+        self.app = app
+        self.lead = timedelta(minutes=cfg["REMINDER_LEAD_MINUTES"])
+        self.horizon = timedelta(minutes=cfg["REMINDER_HORIZON_MINUTES"])
+        self.refresh_every = min(timedelta(seconds=cfg["REMINDER_REFRESH_SECONDS"]), self.horizon / 2)
+        self.batch_size = cfg["REMINDER_BATCH_SIZE"]
+        self._heap = []  # (due, appointment id)
+        self._due = {}   # appointment id -> due; heap entries that disagree are stale
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.loaded_until = None  # every reminder due before this is in the heap
+        self.next_refresh = None
+        self.sent_total = 0
+        self.skipped_total = 0
+
+    # --- queue ---
+
+    def refresh(self, now: datetime = None) -> int:
+        """Reloads the reminders due before ``now + horizon`` (including
+        overdue ones for visits that have not started). Returns how many."""
+        now = now or datetime.utcnow()
+        results = shards.each(
+            db.select(Appointment.id, Appointment.visit_time)
+            .where(Appointment.status == "scheduled", Appointment.reminded_at.is_(None),
+                   Appointment.visit_time > now, Appointment.visit_time < now + self.lead + self.horizon))
+        due = {aid: visit - self.lead for r in results for aid, visit in r}
+        heap = [(d, aid) for aid, d in due.items()]
+        heapq.heapify(heap)
+        with self._lock:
+            self._due, self._heap = due, heap
+            self.loaded_until = now + self.horizon
+            self.next_refresh = now + self.refresh_every
+        self._wake.set()
+        return len(due)
+
+    def push(self, appt_id: int, visit_time: datetime, status: str, reminded_at: datetime = None):
+        """Adds, moves or drops one appointment's reminder."""
+        due = visit_time - self.lead
+        with self._lock:
+            if status != "scheduled" or reminded_at is not None or self.loaded_until is None \
+                    or due >= self.loaded_until:
+                self._due.pop(appt_id, None)  # beyond the window: the next refresh loads it
+                return
+            self._due[appt_id] = due
+            heapq.heappush(self._heap, (due, appt_id))
+            earliest = self._heap[0][1] == appt_id
+        if earliest:
+            self._wake.set()
+
+    def discard(self, appt_id: int):
+        with self._lock:
+            self._due.pop(appt_id, None)
+
+    def _pop_due(self, now):
+        ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(ids) < self.batch_size:
+                due, aid = heapq.heappop(self._heap)
+                if self._due.get(aid) == due:
+                    del self._due[aid]
+                    ids.append(aid)
+        return ids
+
+    def next_due(self):
+        """Due time of the earliest queued reminder, or None."""
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)  # stale
+            return self._heap[0][0] if self._heap else None
+
+    # --- sending ---
+
+    def fire_due(self, now: datetime = None) -> int:
+        """Sends every reminder due by ``now`` in the calling thread, one
+        batch per transaction. Returns how many were queued for delivery."""
+        now = now or datetime.utcnow()
+        total = 0
+        while True:
+            ids = self._pop_due(now)
+            if not ids:
+                return total
+            total += self._send(ids, now)
+
+    def _send(self, ids, now):
+        claimed, rows = [], []
+        for shard, group in shards.group(ids).items():
+            with shards.route(shard):
+                claimed_here, rows_here = self._claim(group, now)
+            claimed += claimed_here
+            rows += rows_here
+        changes.log("appointments", claimed)
+        for aid, visit, email, doctor in rows:
+            enqueue_email(email, "Appointment Reminder",
+                          f"Reminder: your appointment ID {aid} with {doctor} is on {visit:%Y-%m-%d %H:%M}.")
+        db.session.commit()
+        self.sent_total += len(rows)
+        self.skipped_total += len(ids) - len(claimed)
+        return len(rows)
+
+    def _claim(self, ids, now):
+        claimed = db.session.execute(
+            db.update(Appointment)
+            .where(Appointment.id.in_(ids), Appointment.status == "scheduled",
+                   Appointment.reminded_at.is_(None),
+                   Appointment.visit_time > now, Appointment.visit_time <= now + self.lead)
+            .values(reminded_at=now)
+            .returning(Appointment.id),
+            execution_options={"synchronize_session": False},
+        ).scalars().all()
+        # Doctors are replicated to every shard, so the join runs where the appointments are
+        rows = db.session.execute(
+            db.select(Appointment.id, Appointment.visit_time, Patient.email, Doctor.name)
+            .join(Patient, Patient.id == Appointment.patient_id)
+            .join(Doctor, Doctor.id == Appointment.doctor_id)
+            .where(Appointment.id.in_(claimed), Patient.email.is_not(None))
+        ).all() if claimed else []
+        return claimed, rows
+
+    # --- lifecycle ---
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name="hms-reminders", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _work(self):
+        while not self._stop.is_set():
+            wait = 30.0
+            try:
+                with self.app.app_context():
+                    now = datetime.utcnow()
+                    if self.next_refresh is None or now >= self.next_refresh:
+                        self.refresh(now)
+                    self.fire_due(now)
+                    until = min(filter(None, (self.next_due(), self.next_refresh)))
+                    wait = (until - datetime.utcnow()).total_seconds()
+            except Exception:
+                log.exception("Reminder scheduler error")
+            self._wake.wait(max(wait, 0.05))
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = len(self._due)
+        return {"queued": queued, "sent_total": self.sent_total, "skipped_total": self.skipped_total,
+                "loaded_until": self.loaded_until.isoformat() if self.loaded_until else None,
+                "running": self._thread is not None}
+
+# ------------------ crud hooks ------------------
+
+def booking_reminded_at(visit_time: datetime):
+    """``reminded_at`` for a new booking: now if the visit is within the
+    lead time (the confirmation doubles as its reminder), else None."""
+    now = datetime.utcnow()
+    if visit_time - timedelta(minutes=current_app.config["REMINDER_LEAD_MINUTES"]) <= now:
+        return now
+    return None
+
+def track(appt: Appointment):
+    """Queues, moves or drops ``appt``'s reminder once the current
+    transaction commits."""
+    scheduler = current_app.extensions.get("hms_reminders")
+    if scheduler is not None:
+        key = (appt.id, appt.visit_time, appt.status, appt.reminded_at)
+        after_commit(lambda: scheduler.push(*key))
+
+def forget(appt_id: int):
+    """Drops a deleted appointment's reminder once the transaction commits."""
+    scheduler = current_app.extensions.get("hms_reminders")
+    if scheduler is not None:
+        after_commit(lambda: scheduler.discard(appt_id))
+
+def init_app(app):
+    scheduler = app.extensions["hms_reminders"] = ReminderScheduler(app)
+    if app.config["REMINDERS_ENABLED"] and not app.testing:
+        scheduler.start()
+
+def get_scheduler() -> ReminderScheduler:
+    return current_app.extensions["hms_reminders"]
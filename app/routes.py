@@ -1,11 +1,28 @@
-from flask import Blueprint, request, jsonify
+import hashlib
+from datetime import date, datetime, timezone
+from urllib.parse import urlencode
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from . import crud
-from .exceptions import NotFoundError, BadRequestError
-from .emailer import send_email
+from .exceptions import NotFoundError, BadRequestError, ConflictError, UpstreamError
+from .emailer import get_outbox
+from .reminders import get_scheduler
+from .cache import get_cache
+from .serializers import PATIENT, DOCTOR, APPOINTMENT, ARCHIVED_APPOINTMENT
 from .batch_calc import average_age
-from .scraper import get_hospital_info, get_disease_facts
+from . import jobs
+from . import bulk
+from . import changes
+from . import analytics
+from . import metrics
+from . import logger
+from . import admission
+from . import batch
 
 api_bp = Blueprint("api", __name__)
+api_bp.before_request(metrics.start_request)
+api_bp.after_request(metrics.finish_request)
+api_bp.before_request(admission.admit)
+api_bp.teardown_request(admission.release)
 
 # ---------- Error handlers ----------
 @api_bp.errorhandler(NotFoundError)
@@ -16,30 +33,211 @@ def handle_not_found(err):
 def handle_bad_request(err):
     return jsonify({"error": str(err)}), 400
 
+@api_bp.errorhandler(ConflictError)
+def handle_conflict(err):
+    return jsonify({"error": str(err)}), 409
+
+@api_bp.errorhandler(UpstreamError)
+def handle_upstream(err):
+    return jsonify({"error": str(err)}), 503
+
+# ---------- Listing helpers ----------
+def _page_args(cursor_type=int):
+    """Reads ``limit``/``after`` from the query string."""
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE"])
+    after = request.args.get("after")
+    try:
+        limit = int(limit)
+        if after is not None:
+            after = cursor_type(after)
+    except ValueError:
+        raise BadRequestError("limit and after must be valid cursor values")
+    if not 1 <= limit <= current_app.config["MAX_PAGE_SIZE"]:
+        raise BadRequestError(f"limit must be between 1 and {current_app.config['MAX_PAGE_SIZE']}")
+    return limit, after
+
+def _wants_stream():
+    return (request.args.get("stream") in ("1", "true")
+            or request.accept_mimetypes.best == "application/x-ndjson")
+
+def _ndjson(rows, encode, flush_every=100):
+    """Streams ``rows`` as NDJSON, writing ``flush_every`` lines per chunk."""
+    def generate():
+        buf = []
+        for row in rows:
+            buf.append(encode(row))
+            if len(buf) >= flush_every:
+                yield "\n".join(buf) + "\n"
+                buf.clear()
+        if buf:
+            yield "\n".join(buf) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def _json(body: str, status=200):
+    return Response(body, status=status, mimetype="application/json")
+
+def _list(schema, list_fn, iter_fn, cursor, cursor_type=int, keys=("id",)):
+    """Serves a keyset-paginated (or streamed) list, loading only the
+    columns named in ``?fields=`` plus the cursor ``keys``. Pages carry a
+    weak ETag and Last-Modified derived from crud.collection_version (of
+    every included table too), so an unchanged table is answered with 304
+    before the list query runs."""
+    limit, after = _page_args(cursor_type)
+    fields = schema.parse(request.args.get("fields"))
+    includes = schema.parse_includes(request.args.get("include"))
+    keys += tuple(schema.includes[name][1] for name in includes)
+    columns = schema.columns(fields, keys)
+    if _wants_stream():
+        if includes:
+            raise BadRequestError("include is not supported for streamed listings")
+        return _ndjson(iter_fn(after, current_app.config["BATCH_SIZE"], columns), schema.encoder(fields))
+    related = [schema.includes[name][0] for name in includes]
+    versions = [crud.collection_version(s.model) for s in [schema] + related]
+    daily = schema.daily(fields) or any(s.daily(s.default) for s in related)
+    not_modified, stamp = _conditional(
+        _etag(schema.model.__tablename__, versions, request.query_string, daily and date.today()),
+        max(filter(None, [v[0] for v in versions] + [v[3] for v in versions] + [daily and _midnight()]),
+            default=None), weak=True)
+    if not_modified is not None:
+        return not_modified
+    rows = list_fn(limit, after, columns)
+    metrics.count_rows(len(rows))
+    resp = _json(_dump_with_includes(schema, rows, fields, includes))
+    if len(rows) == limit:
+        _link_next(resp, cursor(rows[-1]), limit)
+    return stamp(resp)
+
+def _dump_with_includes(schema, rows, fields, includes):
+    """Encodes a page as a JSON array, or with ``includes`` as an object
+    holding the page and each related resource once, e.g.
+    ``{"appointments": [...], "patients": [...]}``: one query per relation
+    for the whole page, however many rows refer to the same entity."""
+    body = schema.dump_rows(rows, fields)
+    if not includes:
+        return body
+    parts = [f'"{schema.model.__tablename__}":{body}']
+    for name in includes:
+        related, key = schema.includes[name]
+        found = crud.get_many(related.model, (getattr(r, key) for r in rows), related.columns(related.default))
+        metrics.count_rows(len(found))
+        parts.append(f'"{related.model.__tablename__}":{related.dump_rows(found, related.default)}')
+    return "{" + ",".join(parts) + "}"
+
+def _link_next(resp, nxt: str, limit: int):
+    resp.headers["X-Next-Cursor"] = nxt
+    args = request.args.to_dict()
+    args.update(after=nxt, limit=limit)
+    resp.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+
+def _entity(schema, obj, status=200):
+    """Serves one object with a strong ETag and Last-Modified; a matching
+    conditional GET gets 304 without serializing. ``?include=`` embeds
+    related objects (e.g. ``"patient": {...}``) and their versions."""
+    fields = schema.parse(request.args.get("fields"))
+    related = []
+    for name in schema.parse_includes(request.args.get("include")):
+        rel, key = schema.includes[name]
+        related.append((name, rel, crud.get_related(rel.model, getattr(obj, key))))
+    daily = schema.daily(fields) or any(s.daily(s.default) for _, s, _ in related)
+    modified = max([obj.updated_at] + [o.updated_at for _, _, o in related] + ([_midnight()] if daily else []))
+    not_modified, stamp = _conditional(
+        _etag(schema.model.__tablename__, obj.id, obj.updated_at, fields,
+              [(name, o.id, o.updated_at) for name, _, o in related], daily and date.today()),
+        modified)
+    if not_modified is not None and request.method in ("GET", "HEAD"):
+        return not_modified
+    body = schema.dump(obj, fields)
+    if related:
+        body = body[:-1] + "".join(f',"{name}":{s.dump(o)}' for name, s, o in related) + "}"
+    return stamp(_json(body, status))
+
+# ---------- Conditional GET ----------
+def _etag(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+def _midnight() -> datetime:
+    # Start of the local day (when ``daily`` fields such as age change), in UTC
+    return datetime.combine(date.today(), datetime.min.time()).astimezone(timezone.utc).replace(tzinfo=None)
+
+def _conditional(etag: str, last_modified: datetime = None, weak=False):
+    """Evaluates If-None-Match (or, without it, If-Modified-Since) against
+    a resource's validators.
+
+    Returns:
+        tuple: A 304 response if the client's copy is current, else None;
+        and a function that adds the validators to a full response.
+    """
+    if last_modified is not None:  # naive UTC; HTTP dates have whole seconds
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+    def stamp(resp):
+        resp.set_etag(etag, weak=weak)
+        if last_modified is not None:
+            resp.last_modified = last_modified
+        resp.headers["Cache-Control"] = "no-cache"  # revalidate on every use
+        return resp
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = last_modified is not None and since is not None and last_modified <= since
+    return (stamp(Response(status=304)) if fresh else None), stamp
+
+def _bulk_import(kind):
+    fmt = bulk.detect_format(request.content_type, request.args.get("format"))
+    report = bulk.import_records(
+        kind,
+        bulk.iter_records(request.stream, fmt),
+        chunk_size=current_app.config["IMPORT_CHUNK_SIZE"],
+        max_errors=current_app.config["IMPORT_MAX_ERRORS"],
+    )
+    return jsonify(report), 200 if report["inserted"] or not report["failed"] else 400
+
 # ---------- Patients ----------
 @api_bp.post("/patients")
 def create_patient():
     data = request.get_json(force=True)
     p = crud.create_patient(**data)
-    return jsonify({"id": p.id, "name": p.name, "email": p.email, "dob": p.dob.isoformat(), "address": p.address}), 201
+    return _entity(PATIENT, p, 201)
+
+@api_bp.post("/patients/bulk")
+def bulk_patients():
+    return _bulk_import("patients")
 
 @api_bp.get("/patients")
 def list_patients():
-    out = []
-    for p in crud.list_patients():
-        out.append({"id": p.id, "name": p.name, "email": p.email, "dob": p.dob.isoformat(), "age": p.age})
-    return jsonify(out)
+    return _list(PATIENT, crud.list_patients, crud.iter_patients, lambda p: str(p.id))
+
+@api_bp.get("/patients/search")
+def search_patients():
+    # ``after`` is an offset here: relevance order has no keyset cursor
+    limit, offset = _page_args()
+    if offset is not None and offset < 0:
+        raise BadRequestError("after must not be negative")
+    fields = PATIENT.parse(request.args.get("fields"))
+    rows, ranked = crud.search_patients(request.args.get("q"), limit, offset or 0,
+                                      PATIENT.columns(fields, ("id",)))
+    metrics.count_rows(len(rows))
+    resp = _json(PATIENT.dump_rows(rows, fields))
+    resp.headers["X-Search-Ranked"] = "1" if ranked else "0"
+    if len(rows) == limit:
+        _link_next(resp, str((offset or 0) + limit), limit)
+    return resp
 
 @api_bp.get("/patients/<int:pid>")
 def get_patient(pid):
-    p = crud.get_patient(pid)
-    return jsonify({"id": p.id, "name": p.name, "email": p.email, "dob": p.dob.isoformat(), "age": p.age})
+    return _entity(PATIENT, crud.get_patient(pid))
 
-@api_bp.put("/patients/<int:pid>")
+@api_bp.get("/patients/<int:pid>/appointments")
+def patient_appointments(pid):
+    crud.get_patient(pid)
+    return _appointments(patient_id=pid)
+
+@api_bp.route("/patients/<int:pid>", methods=["PUT", "PATCH"])
 def update_patient(pid):
     data = request.get_json(force=True)
-    p = crud.update_patient(pid, **data)
-    return jsonify({"ok": True, "id": p.id})
+    return _entity(PATIENT, crud.update_patient(pid, **data))
 
 @api_bp.delete("/patients/<int:pid>")
 def delete_patient(pid):
@@ -50,52 +248,212 @@ def delete_patient(pid):
 @api_bp.post("/doctors")
 def create_doctor():
     data = request.get_json(force=True)
-    d = crud.create_doctor(**data)
-    return jsonify({"id": d.id}), 201
+    return _entity(DOCTOR, crud.create_doctor(**data), 201)
+
+@api_bp.post("/doctors/bulk")
+def bulk_doctors():
+    return _bulk_import("doctors")
 
 @api_bp.get("/doctors")
 def list_doctors():
-    out = [{"id": d.id, "name": d.name, "specialty": d.specialty} for d in crud.list_doctors()]
-    return jsonify(out)
+    return _list(DOCTOR, crud.list_doctors, crud.iter_doctors, lambda d: str(d.id))
+
+@api_bp.get("/doctors/<int:did>/appointments")
+def doctor_appointments(did):
+    crud.get_doctor(did)
+    return _appointments(doctor_id=did)
+
+@api_bp.get("/doctors/<int:did>/free-slots")
+def doctor_free_slots(did):
+    slots = crud.free_slots(did, request.args.get("from"), request.args.get("to"),
+                            request.args.get("length", type=int))
+    return jsonify([{"start": s.isoformat(), "end": e.isoformat()} for s, e in slots])
 
 # ---------- Appointments ----------
 @api_bp.post("/appointments")
 def create_appointment():
     data = request.get_json(force=True)
-    a = crud.create_appointment(**data)
-    # Send background email if patient has email (simulated)
-    try:
-        p = crud.get_patient(a.patient_id)
-        if p.email:
-            send_email(p.email, "Appointment Scheduled", f"Your appointment ID {a.id} is scheduled.", background=True)
-    except Exception:
-        pass
-    return jsonify({"id": a.id}), 201
+    a = crud.create_appointment(**data)  # also queues the confirmation email
+    return _entity(APPOINTMENT, a, 201)
+
+@api_bp.get("/appointments/<int:aid>")
+def get_appointment(aid):
+    return _entity(APPOINTMENT, crud.get_appointment(aid))
+
+@api_bp.route("/appointments/<int:aid>", methods=["PUT", "PATCH"])
+def update_appointment(aid):
+    data = request.get_json(force=True)
+    return _entity(APPOINTMENT, crud.update_appointment(aid, **data))
+
+@api_bp.delete("/appointments/<int:aid>")
+def delete_appointment(aid):
+    crud.delete_appointment(aid)
+    return jsonify({"ok": True})
 
 @api_bp.get("/appointments")
 def list_appointments():
-    out = []
-    for a in crud.list_appointments():
-        out.append({
-            "id": a.id,
-            "patient_id": a.patient_id,
-            "doctor_id": a.doctor_id,
-            "visit_time": a.visit_time.isoformat(),
-            "status": a.status,
-        })
-    return jsonify(out)
+    return _appointments()
+
+def _appointments(**filters):
+    # Appointment listings, optionally one patient's or doctor's, within ?from=/?to=
+    filters.update(frm=request.args.get("from"), to=request.args.get("to"))
+    return _list(APPOINTMENT,
+                 lambda limit, after, columns: crud.list_appointments(limit, after, columns, **filters),
+                 lambda after, chunk_size, columns: crud.iter_appointments(after, chunk_size, columns, **filters),
+                 crud.appointment_cursor, cursor_type=str, keys=("visit_time", "id"))
+
+# ---------- Archive ----------
+@api_bp.get("/archive/appointments")
+def list_archived_appointments():
+    limit, after = _page_args(str)
+    schema = ARCHIVED_APPOINTMENT
+    fields = schema.parse(request.args.get("fields"))
+    includes = schema.parse_includes(request.args.get("include"))
+    keys = ("visit_time", "id") + tuple(schema.includes[name][1] for name in includes)
+    rows = crud.list_archived_appointments(limit, after, schema.columns(fields, keys),
+                                           request.args.get("patient_id", type=int),
+                                           request.args.get("doctor_id", type=int))
+    resp = _json(_dump_with_includes(schema, rows, fields, includes))
+    if len(rows) == limit:
+        _link_next(resp, crud.appointment_cursor(rows[-1]), limit)
+    return resp
+
+@api_bp.get("/archive/appointments/<int:aid>")
+def get_archived_appointment(aid):
+    return _entity(ARCHIVED_APPOINTMENT, crud.get_archived_appointment(aid))
+
+# ---------- Change feed ----------
+@api_bp.get("/changes")
+def change_feed():
+    cfg = current_app.config
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", cfg["PAGE_SIZE"]))
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        raise BadRequestError("since and limit must be integers and wait a number of seconds")
+    entity = request.args.get("entity")
+    if since < 0 or not 1 <= limit <= cfg["MAX_PAGE_SIZE"]:
+        raise BadRequestError(f"since must not be negative and limit must be between 1 and {cfg['MAX_PAGE_SIZE']}")
+    if not 0 <= wait <= cfg["CHANGES_MAX_WAIT_SECONDS"]:
+        raise BadRequestError(f"wait must be between 0 and {cfg['CHANGES_MAX_WAIT_SECONDS']:g} seconds")
+    if entity is not None and entity not in changes.SCHEMAS:
+        raise BadRequestError(f"entity must be one of {', '.join(changes.SCHEMAS)}")
+    if wait:
+        changes.get_feed().wait(since, wait, entity)
+    rows, nxt, more = changes.read(since, limit, entity)
+    items = ",".join(
+        f'{{"seq":{seq},"entity":"{name}","id":{eid},"op":"{op}","at":"{at.isoformat()}"'
+        + (f',"data":{data}}}' if data is not None else "}")
+        for seq, name, eid, op, at, data in rows)
+    resp = _json(f'{{"changes":[{items}],"next":{nxt},"more":{"true" if more else "false"}}}')
+    resp.headers["X-Next-Cursor"] = str(nxt)
+    return resp
+
+# ---------- Batch ----------
+@api_bp.post("/batch")
+def run_batch():
+    data = request.get_json(force=True)
+    operations = batch.parse(data.get("operations") if isinstance(data, dict) else None,
+                             current_app.config["BATCH_MAX_OPERATIONS"])
+    schemas = {"patients": PATIENT, "doctors": DOCTOR, "appointments": APPOINTMENT}
+    results = [
+        f'{{"op":"{op}","entity":"{entity}","id":{pk},"status":{201 if op == "create" else 200}'
+        + (f',"data":{body}}}' if body is not None else "}")
+        for op, entity, pk, body in batch.run(operations, lambda entity, obj: schemas[entity].dump(obj))]
+    return _json(f'{{"results":[{",".join(results)}]}}')
+
+# ---------- Cache / metrics ----------
+@api_bp.get("/cache/stats")
+def cache_stats():
+    cache = get_cache()
+    return jsonify(cache.info() if cache else {"enabled": False})
+
+@api_bp.route("/metrics/slow-log", methods=["GET", "PUT"])
+def slow_log():
+    m = metrics.get_metrics()
+    if request.method == "PUT":
+        data = request.get_json(force=True)
+        threshold = data.get("threshold_ms", m.slow_ms)
+        if not isinstance(threshold, (int, float)) or threshold < 0:
+            raise BadRequestError("threshold_ms must be a non-negative number")
+        m.slow_log_enabled, m.slow_ms = bool(data.get("enabled", m.slow_log_enabled)), threshold
+    return jsonify({"enabled": m.slow_log_enabled, "threshold_ms": m.slow_ms})
+
+@api_bp.get("/admission/stats")
+def admission_stats():
+    controller = admission.get_controller()
+    return jsonify(controller.stats() if controller else {"enabled": False})
+
+@api_bp.get("/logging/stats")
+def logging_stats():
+    pipeline = logger.get_pipeline()
+    return jsonify(pipeline.stats() if pipeline else {"enabled": False})
+
+# ---------- Email outbox ----------
+@api_bp.get("/outbox/stats")
+def outbox_stats():
+    return jsonify(get_outbox().stats())
+
+@api_bp.get("/reminders/stats")
+def reminder_stats():
+    return jsonify(get_scheduler().stats())
 
 # ---------- Batch calc ----------
 @api_bp.get("/analytics/average-age")
 def avg_age():
-    size = int(request.args.get("batch_size", 100))
+    size = request.args.get("batch_size", type=int)
     return jsonify({"average_age": average_age(size)})
 
+@api_bp.get("/analytics/patients")
+def patient_cohorts():
+    a = request.args
+    return jsonify(analytics.patient_cohorts(a.get("group_by"), a.get("bucket"), a.get("gender"),
+                                             a.get("min_age"), a.get("max_age")))
+
+@api_bp.get("/analytics/appointments")
+def appointment_cohorts():
+    a = request.args
+    return jsonify(analytics.appointment_cohorts(a.get("group_by"), a.get("from"), a.get("to"), a.get("status"),
+                                                 a.get("doctor_id"), a.get("specialty")))
+
+@api_bp.get("/analytics/snapshot")
+def analytics_snapshot():
+    return jsonify(analytics.get_snapshot().stats())
+
+@api_bp.post("/jobs")
+def submit_job():
+    data = request.get_json(force=True)
+    if "report" not in data:
+        raise BadRequestError("report is required")
+    job = jobs.get_runner().submit(data["report"], data.get("params"))
+    return jsonify(jobs.job_dict(job)), 202
+
+@api_bp.get("/jobs/<int:job_id>")
+def get_job(job_id):
+    return jsonify(jobs.job_dict(jobs.get_job(job_id)))
+
+@api_bp.post("/jobs/<int:job_id>/cancel")
+def cancel_job(job_id):
+    return jsonify(jobs.job_dict(jobs.get_runner().cancel(job_id)))
+
+@api_bp.post("/jobs/<int:job_id>/resume")
+def resume_job(job_id):
+    return jsonify(jobs.job_dict(jobs.get_runner().resume(job_id))), 202
+
 # ---------- Scraper utils ----------
+# scraper (and requests) is imported on first use to keep worker startup fast
 @api_bp.get("/info/hospitals")
 def hospitals_info():
+    from .scraper import get_hospital_info
     return jsonify(get_hospital_info())
 
 @api_bp.get("/info/disease/<name>")
 def disease_facts(name):
+    from .scraper import get_disease_facts
     return jsonify({"name": name, "fact": get_disease_facts(name)})
+
+@api_bp.get("/info/stats")
+def info_stats():
+    from .scraper import get_fetcher
+    return jsonify(get_fetcher().stats)
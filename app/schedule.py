@@ -0,0 +1,199 @@
+"""
+Doctor Schedules (Interval Index)
+
+Keeps each doctor's active appointments as a sorted list of
+non-overlapping ``[start, end)`` intervals. Conflict checks are a binary
+search plus a look at the two neighbours, and free-slot searches walk
+only the intervals inside the requested window, so neither touches the
+appointments table once a doctor's schedule is loaded.
+
+A doctor's schedule is loaded lazily with one query the first time it is
+needed. ``crud`` reserves new bookings in the index before committing and
+drops the doctor's schedule if the transaction rolls back, so the index
+never disagrees with what was committed by this process.
+
+Other processes (``serve`` workers) book too. Triggers keep a per-doctor
+counter in ``schedule_versions`` (migration 0004) that every booking change
+bumps in its own transaction; a schedule is reloaded whenever the stored
+counter differs from the changes this process accounted for. Bookings
+are serialized by the database write lock taken at flush, so the conflict
+check in ``reserve`` always sees every committed booking.
+
+With several shards (shards.py) a doctor's appointments are spread over
+all of them: a schedule is loaded from every shard and its version is the
+sum of the shards' counters.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from flask import current_app
+from .db import db, after_rollback
+from .models import Appointment
+from .exceptions import ConflictError
+from . import shards
+
+INACTIVE_STATUSES = ("cancelled",)
+
+class DoctorSchedule:
+    """Sorted, non-overlapping intervals for one doctor."""
+
+    def __init__(self, intervals=(), version=0):
+        self.version = version
+        intervals = sorted(intervals)
+        self.starts = [s for s, _, _ in intervals]
+        self.ends = [e for _, e, _ in intervals]
+        self.ids = [i for _, _, i in intervals]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def conflict(self, start, end, ignore=None):
+        """Returns the ID of an appointment overlapping ``[start, end)``, or None.
+
+        Args:
+            ignore (int, optional): An appointment ID to disregard (the one
+                                    being rescheduled).
+        """
+        i = bisect_right(self.starts, start)
+        # Intervals are disjoint, so only the last one starting at or before
+        # ``start`` and the first ones starting after it can overlap.
+        j = i - 1
+        while j >= 0 and self.ids[j] == ignore:
+            j -= 1
+        if j >= 0 and self.ends[j] > start:
+            return self.ids[j]
+        while i < len(self.starts) and self.ids[i] == ignore:
+            i += 1
+        if i < len(self.starts) and self.starts[i] < end:
+            return self.ids[i]
+        return None
+
+    def add(self, start, end, appt_id):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, appt_id)
+
+    def remove(self, appt_id, start):
+        """Removes an appointment starting at ``start``; no-op if absent."""
+        i = bisect_left(self.starts, start)
+        while i < len(self.starts) and self.starts[i] == start:
+            if self.ids[i] == appt_id:
+                del self.starts[i], self.ends[i], self.ids[i]
+                return
+            i += 1
+
+    def free_slots(self, frm, to, length):
+        """Returns the gaps of at least ``length`` inside ``[frm, to)``.
+
+        Returns:
+            list[tuple[datetime, datetime]]: ``(start, end)`` pairs.
+        """
+        slots = []
+        i = bisect_right(self.starts, frm) - 1
+        if i < 0 or self.ends[i] <= frm:
+            i += 1
+        cursor = frm
+        while i < len(self.starts) and self.starts[i] < to:
+            if self.starts[i] - cursor >= length:
+                slots.append((cursor, self.starts[i]))
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        if to - cursor >= length:
+            slots.append((cursor, to))
+        return slots
+
+
+class ScheduleIndex:
+    """Per-application map of doctor ID to DoctorSchedule."""
+
+    def __init__(self, versioned=False):
+        self.lock = threading.RLock()
+        self._doctors = {}
+        self.versioned = versioned
+
+    def _version(self, doctor_id):
+        if not self.versioned:
+            return 0
+        return sum(r.scalar() or 0 for r in shards.each(
+            db.text("SELECT version FROM schedule_versions WHERE doctor_id = :d"), {"d": doctor_id}))
+
+    def get(self, doctor_id: int, own_changes: int = 0) -> DoctorSchedule:
+        """Returns the doctor's schedule, (re)loading it if another process
+        changed it since it was loaded.
+
+        Args:
+            own_changes (int): Changes to this doctor's appointments already
+                flushed in the current transaction (and so counted in the
+                stored version) that the caller is about to apply in memory.
+        """
+        version = self._version(doctor_id)  # read before the rows, never after
+        with self.lock:
+            sched = self._doctors.get(doctor_id)
+            if sched is None or (self.versioned and sched.version + own_changes != version):
+                results = shards.each(
+                    db.select(Appointment.visit_time, Appointment.duration_minutes, Appointment.id)
+                    .where(Appointment.doctor_id == doctor_id,
+                           Appointment.status.not_in(INACTIVE_STATUSES)))
+                sched = self._doctors[doctor_id] = DoctorSchedule(
+                    (start, start + timedelta(minutes=mins), aid) for r in results for start, mins, aid in r)
+            sched.version = version
+            return sched
+
+    def invalidate(self, doctor_id: int = None):
+        """Forgets one doctor's schedule (or all of them); reloaded on next use."""
+        with self.lock:
+            if doctor_id is None:
+                self._doctors.clear()
+            else:
+                self._doctors.pop(doctor_id, None)
+
+    def reserve(self, appt: Appointment, previous=None):
+        """Puts a flushed (not yet committed) appointment into the index.
+
+        Args:
+            appt (Appointment): The new or updated appointment.
+            previous (tuple, optional): ``(doctor_id, visit_time)`` the
+                appointment had before an update.
+
+        Rolling back the current transaction drops the affected schedules,
+        so a failed booking never lingers in the index.
+
+        Raises:
+            ConflictError: If the slot overlaps another active appointment.
+        """
+        doctor_id, aid, start, end = appt.doctor_id, appt.id, appt.visit_time, appt.end_time
+        active = appt.status not in INACTIVE_STATUSES
+        with self.lock:
+            sched = self.get(doctor_id, own_changes=1)
+            if active:
+                other = sched.conflict(start, end, ignore=aid)
+                if other is not None:
+                    raise ConflictError(f"Doctor already has appointment {other} overlapping this time slot")
+            if previous is not None and previous[0] != doctor_id:
+                self.release(previous[0], aid, previous[1])
+            elif previous is not None:
+                sched.remove(aid, previous[1])
+            # A schedule loaded just now already contains the flushed row.
+            sched.remove(aid, start)
+            if active:
+                sched.add(start, end, aid)
+        doctors = {doctor_id, previous[0]} if previous else {doctor_id}
+        after_rollback(lambda: [self.invalidate(d) for d in doctors])
+
+    def release(self, doctor_id: int, appt_id: int, start):
+        """Removes an appointment from its doctor's schedule (if loaded);
+        accounts for the one version bump its delete or move caused."""
+        with self.lock:
+            sched = self._doctors.get(doctor_id)
+            if sched is not None:
+                sched.remove(appt_id, start)
+                sched.version += 1
+
+def init_app(app):
+    with app.app_context():
+        versioned = db.engine.dialect.name == "sqlite"  # see migration 0004
+    app.extensions["hms_schedule"] = ScheduleIndex(versioned)
+
+def get_index() -> ScheduleIndex:
+    return current_app.extensions["hms_schedule"]
@@ -1,26 +1,327 @@
-import requests 
-from bs4 import BeautifulSoup
-
-url = 'https://www.who.int/'
-
-response = requests.get(url) 
-#print(response.text)
-#print('\n\n\n\n\n')
-
-soup = BeautifulSoup(response.text, "html.parser", from_encoding="utf-8")
-articles = []
-
-article_elements = soup.find_all("div", attrs={"data-testid":'card-text-wrapper'})
-for article_element in article_elements:
-    try: 
-        headline_element = article_element.find('h2')#, attrs={"data-testid":'card-headline'})
-        description_element = article_element.find('p')#, attrs={"data-testid":'card-description'})
-        #if headline_element and description_element:
-        news_dict = {'headline' : headline_element.get_text(strip=True),
-                    'description' : description_element.get_text(strip=True)
-                    }
-        articles.append(news_dict)
-    except:
-        pass 
-
-print(articles)
+"""
+Health Information Fetcher
+
+Pulls public health news and disease facts from configured web pages.
+Nothing is fetched at import time: pages are fetched on first use and
+kept in a TTL + LRU cache of parsed results, so ``/api/info/*`` normally
+answers from memory.
+
+- Fresh entries (younger than INFO_TTL_SECONDS) are served as-is.
+- Stale entries (younger than INFO_STALE_SECONDS) are served immediately
+  while one background refresh revalidates them (stale-while-revalidate).
+- Refreshes are conditional GETs (If-None-Match / If-Modified-Since), so an
+  unchanged page costs a 304 and no re-parse.
+- If a refresh fails, the last good value keeps being served; only a page
+  that was never fetched successfully raises UpstreamError. Such a failure
+  is cached too, as a negative entry in the same bounded LRU, so the page
+  is not tried again for a while.
+- Concurrent misses for the same page share one fetch (single-flight).
+
+Requests go through one pooled keep-alive ``requests.Session`` and several
+sources are fetched concurrently.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import quote
+from flask import current_app
+import requests
+from requests.adapters import HTTPAdapter
+from .exceptions import UpstreamError
+
+log = logging.getLogger(__name__)
+
+# ------------------ Parsers ------------------
+
+def _clean(text):
+    return " ".join(text.split())
+
+class _CardParser(HTMLParser):
+    """Collects the first h2/p pair of each ``card-text-wrapper`` div."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.articles = []
+        self._depth = 0
+        self._card = None
+        self._field = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div":
+            if self._depth:
+                self._depth += 1
+            elif dict(attrs).get("data-testid") == "card-text-wrapper":
+                self._depth, self._card = 1, {"headline": "", "description": ""}
+        elif self._depth and tag in ("h2", "p"):
+            field = "headline" if tag == "h2" else "description"
+            if not self._card[field]:
+                self._field = field
+
+    def handle_endtag(self, tag):
+        if tag in ("h2", "p"):
+            self._field = None
+        elif tag == "div" and self._depth:
+            self._depth -= 1
+            if not self._depth:
+                card = {k: _clean(v) for k, v in self._card.items()}
+                if card["headline"] and card["description"]:
+                    self.articles.append(card)
+
+    def handle_data(self, data):
+        if self._field:
+            self._card[self._field] += data
+
+class _FactParser(HTMLParser):
+    """Finds the page's meta description, or failing that its first paragraph."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.description = None
+        self.paragraph = None
+        self._in_p = False
+        self._text = ""
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "meta" and attrs.get("name") == "description" and self.description is None:
+            self.description = _clean(attrs.get("content") or "") or None
+        elif tag == "p" and self.paragraph is None:
+            self._in_p, self._text = True, ""
+
+    def handle_endtag(self, tag):
+        if tag == "p" and self._in_p:
+            self._in_p = False
+            self.paragraph = _clean(self._text) or None
+
+    def handle_data(self, data):
+        if self._in_p:
+            self._text += data
+
+def parse_articles(html: str) -> list:
+    """Extracts ``{"headline", "description"}`` dicts from a news page."""
+    parser = _CardParser()
+    parser.feed(html)
+    return parser.articles
+
+def parse_fact(html: str):
+    """Extracts a one-paragraph summary from a fact sheet page."""
+    parser = _FactParser()
+    parser.feed(html)
+    return parser.description or parser.paragraph
+
+# ------------------ Cache + fetcher ------------------
+
+_FAILED = object()  # value of a negative entry: the page could not be fetched
+
+class _Entry:
+    __slots__ = ("value", "etag", "last_modified", "fresh_until", "stale_until")
+
+    def __init__(self, value, etag, last_modified, fresh_until, stale_until):
+        self.value, self.etag, self.last_modified = value, etag, last_modified
+        self.fresh_until, self.stale_until = fresh_until, stale_until
+
+
+class Fetcher:
+    """Cached, conditional, concurrent page fetcher."""
+
+    def __init__(self, ttl=900, stale=86400, maxsize=256, timeout=5, workers=4, error_backoff=30):
+        self.ttl, self.stale, self.maxsize, self.timeout = ttl, stale, maxsize, timeout
+        self.workers = workers
+        # After a failed fetch, wait this long before trying the page again
+        # rather than making every request wait on a dead upstream.
+        self.error_backoff = min(error_backoff, ttl)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = set()  # urls being revalidated in the background
+        self._pending = {}  # url -> Future of the fetch for a miss
+        self._session = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hms-fetch")
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "not_modified": 0, "errors": 0}
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _lookup(self, url):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+            return entry
+
+    def _store(self, url, entry):
+        with self._lock:
+            self._cache[url] = entry
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def get(self, url: str, parser):
+        """Returns ``parser(page)`` for ``url``, from cache when possible.
+
+        Raises:
+            UpstreamError: If the page cannot be fetched and was never cached.
+        """
+        entry = self._lookup(url)
+        now = time.monotonic()
+        if entry is not None and entry.value is _FAILED:
+            if now < entry.fresh_until:
+                self._count("errors")
+                raise UpstreamError(f"Could not fetch {url}")
+            entry = None
+        if entry is not None and now < entry.fresh_until:
+            self._count("hits")
+            return entry.value
+        if entry is not None and now < entry.stale_until:
+            self._count("stale_hits")
+            self._revalidate_async(url, parser)
+            return entry.value
+        with self._lock:
+            future = self._pending.get(url)
+            leader = future is None
+            if leader:
+                future = self._pending[url] = Future()
+        if not leader:
+            self._count("coalesced")
+            return future.result()  # or raises the fetch's UpstreamError
+        self._count("misses")
+        try:
+            value = self._fetch(url, parser, entry)
+            future.set_result(value)
+            return value
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[url]
+
+    def get_many(self, urls, parser) -> dict:
+        """Fetches several pages concurrently.
+
+        Returns:
+            dict: url -> parsed value, or the UpstreamError for that url.
+        """
+        futures = {url: self._executor.submit(self.get, url, parser) for url in urls}
+        out = {}
+        for url, fut in futures.items():
+            try:
+                out[url] = fut.result()
+            except UpstreamError as exc:
+                out[url] = exc
+        return out
+
+    def _revalidate_async(self, url, parser):
+        with self._lock:
+            if url in self._inflight:
+                return
+            self._inflight.add(url)
+
+        def run():
+            try:
+                entry = self._lookup(url)
+                self._fetch(url, parser, entry if entry is not None and entry.value is not _FAILED else None)
+            except UpstreamError:
+                pass
+            finally:
+                with self._lock:
+                    self._inflight.discard(url)
+        self._executor.submit(run)
+
+    def _fetch(self, url, parser, entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            if resp.status_code == 304 and entry is not None:
+                self._count("not_modified")
+                value = entry.value
+            else:
+                resp.raise_for_status()
+                value = parser(resp.text)
+        except requests.RequestException as exc:
+            self._count("errors")
+            retry_at = time.monotonic() + self.error_backoff
+            if entry is not None:
+                log.warning("Refreshing %s failed, serving cached copy: %s", url, exc)
+                entry.fresh_until = max(entry.fresh_until, retry_at)
+                entry.stale_until = max(entry.stale_until, retry_at)
+                return entry.value
+            self._store(url, _Entry(_FAILED, None, None, retry_at, retry_at))
+            raise UpstreamError(f"Could not fetch {url}") from exc
+        now = time.monotonic()
+        self._store(url, _Entry(
+            value,
+            resp.headers.get("ETag", entry.etag if entry else None),
+            resp.headers.get("Last-Modified", entry.last_modified if entry else None),
+            now + self.ttl,
+            now + self.ttl + self.stale,
+        ))
+        return value
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+def get_fetcher() -> Fetcher:
+    """Returns the application's fetcher, creating it on first use."""
+    ext = current_app.extensions
+    fetcher = ext.get("hms_fetcher")
+    if fetcher is None:
+        cfg = current_app.config
+        fetcher = ext.setdefault("hms_fetcher", Fetcher(
+            ttl=cfg["INFO_TTL_SECONDS"], stale=cfg["INFO_STALE_SECONDS"], maxsize=cfg["INFO_CACHE_SIZE"],
+            timeout=cfg["INFO_TIMEOUT"], workers=cfg["INFO_FETCH_WORKERS"]))
+    return fetcher
+
+# ------------------ Public API ------------------
+
+def get_hospital_info() -> list:
+    """Returns news articles from every INFO_SOURCES page, fetched concurrently.
+
+    Sources that fail are skipped (and logged); if all of them fail with
+    nothing cached, UpstreamError is raised.
+    """
+    sources = current_app.config["INFO_SOURCES"]
+    results = get_fetcher().get_many(sources, parse_articles)
+    articles, failed = [], []
+    for url in sources:
+        value = results[url]
+        if isinstance(value, UpstreamError):
+            failed.append(url)
+            continue
+        articles.extend(dict(a, source=url) for a in value)
+    if failed:
+        log.warning("Info sources unavailable: %s", ", ".join(failed))
+        if len(failed) == len(sources):
+            raise UpstreamError("No information source is reachable")
+    return articles
+
+def get_disease_facts(name: str):
+    """Returns a short summary for a disease fact sheet, or None if the page
+    has no usable text.
+
+    Raises:
+        UpstreamError: If the fact sheet cannot be fetched and was never cached.
+    """
+    slug = quote(name.strip().lower().replace(" ", "-"), safe="")
+    url = current_app.config["DISEASE_FACTS_URL"].format(name=slug)
+    return get_fetcher().get(url, parse_fact)
@@ -0,0 +1,91 @@
+"""
+Patient Search Index
+
+On SQLite, ``patients_fts`` is an FTS5 external-content table over
+``patients.name``, ``email`` and ``phone`` with the trigram tokenizer, so
+any substring of three or more characters is an index lookup. Triggers on
+``patients`` keep it in sync with every write path; both are created by a
+migration (migrations.py). Bulk inserts index their rows in one statement
+instead (``deferred_index``).
+
+Queries shorter than three characters, and databases without FTS5, fall
+back to LIKE scans (see ``crud.search_patients``).
+"""
+import logging
+import re
+from contextlib import contextmanager
+from flask import current_app
+from .db import db
+
+log = logging.getLogger(__name__)
+
+FTS_TABLE = "patients_fts"
+MIN_TERM = 3  # trigram tokenizer: shorter terms cannot use the index
+
+def init_search():
+    """Enables FTS queries if the ``patients_fts`` index exists; it is
+    created by migration 0003 (see migrations.py), which needs SQLite with
+    FTS5 and the trigram tokenizer."""
+    engine = db.engine
+    enabled = False
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            enabled = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).first() is not None
+    if not enabled:
+        log.warning("Full-text search unavailable, using LIKE scans")
+    current_app.extensions["hms_fts"] = enabled
+
+def fts_enabled() -> bool:
+    return current_app.extensions.get("hms_fts", False)
+
+@contextmanager
+def deferred_index(table, conn):
+    """Indexes rows inserted into ``table`` in the block with one
+    INSERT ... SELECT at the end instead of a trigger per row (about 4x
+    faster for bulk inserts). Must run inside the inserting transaction; if
+    the block raises, the caller's rollback also undoes the switch."""
+    if table.name != "patients" or not fts_enabled():
+        yield
+        return
+    conn.exec_driver_sql(f"UPDATE {FTS_TABLE}_sync SET deferred = 1")  # takes the write lock first
+    start = conn.exec_driver_sql("SELECT coalesce(max(id), 0) FROM patients").scalar()
+    yield
+    conn.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, email, phone) "
+        "SELECT id, name, email, phone FROM patients WHERE id > ?", (start,))
+    conn.exec_driver_sql(f"UPDATE {FTS_TABLE}_sync SET deferred = 0")
+
+# Relevance: which field a term occurs in, with bonuses when it starts the
+# field or a word and when it ends a word.
+# bm25 is not used: its IDF step reads the full doclist of every term, which
+# for a common trigram ("pat") costs as much as a table scan.
+WEIGHTS = (("name", 4), ("email", 2), ("phone", 1))
+_WORD = re.compile(r"[\s@.\-_+]")
+
+def score(row, terms) -> int:
+    """Relevance of a row with ``name``, ``email`` and ``phone`` attributes
+    for lowercase ``terms``; higher is better."""
+    total = 0
+    for term in terms:
+        best = 0
+        for field, weight in WEIGHTS:
+            value = (getattr(row, field) or "").lower()
+            pos = value.find(term)
+            if pos >= 0:
+                starts = 4 if pos == 0 else 3 if _WORD.match(value, pos - 1) else 1
+                end = pos + len(term)
+                ends = 1 if end == len(value) or _WORD.match(value, end) else 0
+                best = max(best, weight * (starts + ends))
+        total += best
+    return total
+
+def match_query(q: str):
+    """Builds an FTS5 MATCH string from free text: each whitespace-separated
+    term of at least MIN_TERM characters becomes a quoted substring term
+    (all must match). Returns ``(match, short_terms)``; ``match`` is None if
+    no term is long enough for the index."""
+    terms = q.split()
+    long_terms = ['"' + t.replace('"', '""') + '"' for t in terms if len(t) >= MIN_TERM]
+    short = [t for t in terms if len(t) < MIN_TERM]
+    return (" ".join(long_terms) or None), short
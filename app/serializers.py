@@ -0,0 +1,175 @@
+"""
+Response Serializers
+
+One schema per resource describes the fields the API can return, their
+JSON type and the SQL expression that loads them. Routes use it to:
+
+- validate ``?fields=a,b,c`` sparse fieldsets (``parse``);
+- select only those columns, with ``age`` computed in SQL (``columns``);
+- encode rows or ORM objects straight to JSON text (``encoder``/``dump``);
+- validate ``?include=patient,doctor`` related resources (``parse_includes``).
+
+The encoder for a fieldset is generated once and cached: a single
+%-format over the row's values, so no per-row dict is built and strings
+are escaped by the json module's C encoder. Output matches what
+``flask.jsonify`` would produce for the same dict.
+"""
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from .exceptions import BadRequestError
+from .models import Patient, Doctor, Appointment, ArchivedAppointment
+
+class Field:
+    """A serializable attribute: JSON kind ("int", "str", "date" or
+    "datetime"), nullability, the SQL expression it is loaded from and
+    whether its value changes with the date (``daily``, e.g. age)."""
+
+    __slots__ = ("kind", "nullable", "expr", "daily")
+
+    def __init__(self, kind, nullable=False, expr=None, daily=False):
+        self.kind, self.nullable, self.expr, self.daily = kind, nullable, expr, daily
+
+_FORMATS = {
+    # kind -> (format spec, value expression) for a non-null value ``v``
+    "int": ("%d", "{v}"),
+    "str": ("%s", "es({v})"),
+    "date": ('"%s"', "{v}.isoformat()"),
+    "datetime": ('"%s"', "{v}.isoformat()"),
+}
+
+class Schema:
+    """Describes how one model is exposed over the API."""
+
+    def __init__(self, model, fields: dict, default: tuple):
+        self.model = model
+        self.fields = fields
+        self.default = default
+        self.includes = {}  # name -> (Schema, foreign key field); see parse_includes
+        for name, field in fields.items():
+            if field.expr is None:
+                field.expr = getattr(model, name)
+
+    def parse(self, value: str = None) -> tuple:
+        """Turns a ``fields`` query parameter into a tuple of field names.
+
+        Raises:
+            BadRequestError: If a field does not exist.
+        """
+        if not value:
+            return self.default
+        names = tuple(dict.fromkeys(n.strip() for n in value.split(",") if n.strip()))
+        unknown = [n for n in names if n not in self.fields]
+        if unknown or not names:
+            raise BadRequestError(
+                f"Unknown field(s): {', '.join(unknown) or value}; available: {', '.join(self.fields)}")
+        return names
+
+    def parse_includes(self, value: str = None) -> tuple:
+        """Turns an ``include`` query parameter into a tuple of relation names.
+
+        Raises:
+            BadRequestError: If a relation does not exist.
+        """
+        if not value:
+            return ()
+        names = tuple(dict.fromkeys(n.strip() for n in value.split(",") if n.strip()))
+        unknown = [n for n in names if n not in self.includes]
+        if unknown or not names:
+            raise BadRequestError(f"Unknown include(s): {', '.join(unknown) or value}; "
+                                  f"available: {', '.join(self.includes) or 'none'}")
+        return names
+
+    def daily(self, names: tuple) -> bool:
+        """Whether any of ``names`` changes with the date alone."""
+        return any(self.fields[n].daily for n in names)
+
+    def columns(self, names: tuple, keys: tuple = ()) -> list:
+        """Labeled SELECT expressions for ``names`` followed by any extra
+        ``keys`` (e.g. keyset cursor columns) that were not requested."""
+        names = names + tuple(k for k in keys if k not in names)
+        return [self.fields[n].expr.label(n) for n in names]
+
+    @lru_cache(maxsize=64)
+    def encoder(self, names: tuple):
+        """Returns a function that encodes a row (its first ``len(names)``
+        values, in order) as a JSON object string."""
+        specs, args = [], []
+        for i, name in enumerate(names):
+            field = self.fields[name]
+            spec, value = _FORMATS[field.kind]
+            value = value.format(v=f"r[{i}]")
+            if field.nullable:
+                spec = "%s"
+                if field.kind in ("date", "datetime"):
+                    value = f"'\"' + {value} + '\"'"
+                elif field.kind == "int":
+                    value = f"str({value})"
+                value = f"('null' if r[{i}] is None else {value})"
+            specs.append(f'"{name}":{spec}')
+            args.append(value)
+        template = "{" + ",".join(specs) + "}"
+        source = f"def encode(r):\n    return {template!r} % ({', '.join(args)},)\n"
+        namespace = {"es": encode_basestring_ascii}
+        exec(source, namespace)  # noqa: S102 - built only from schema field names
+        return namespace["encode"]
+
+    def dump(self, obj, names: tuple = None) -> str:
+        """Encodes one ORM object."""
+        names = names or self.default
+        return self.encoder(names)(tuple(getattr(obj, n) for n in names))
+
+    def dump_rows(self, rows, names: tuple) -> str:
+        """Encodes rows from a ``columns()`` query as a JSON array."""
+        return "[" + ",".join(map(self.encoder(names), rows)) + "]"
+
+
+PATIENT = Schema(Patient, {
+    "id": Field("int"),
+    "name": Field("str"),
+    "email": Field("str", nullable=True),
+    "dob": Field("date"),
+    "gender": Field("str", nullable=True),
+    "phone": Field("str", nullable=True),
+    "address": Field("str", nullable=True),
+    "age": Field("int", daily=True),
+    "created_at": Field("datetime"),
+    "updated_at": Field("datetime"),
+}, default=("id", "name", "email", "dob", "gender", "phone", "address", "age"))
+
+DOCTOR = Schema(Doctor, {
+    "id": Field("int"),
+    "name": Field("str"),
+    "specialty": Field("str", nullable=True),
+    "email": Field("str", nullable=True),
+    "created_at": Field("datetime"),
+    "updated_at": Field("datetime"),
+}, default=("id", "name", "specialty", "email"))
+
+APPOINTMENT = Schema(Appointment, {
+    "id": Field("int"),
+    "patient_id": Field("int"),
+    "doctor_id": Field("int"),
+    "visit_time": Field("datetime"),
+    "duration_minutes": Field("int"),
+    "status": Field("str"),
+    "notes": Field("str", nullable=True),
+    "reminded_at": Field("datetime", nullable=True),
+    "created_at": Field("datetime"),
+    "updated_at": Field("datetime"),
+}, default=("id", "patient_id", "doctor_id", "visit_time", "duration_minutes", "status", "notes"))
+APPOINTMENT.includes = {"patient": (PATIENT, "patient_id"), "doctor": (DOCTOR, "doctor_id")}
+
+ARCHIVED_APPOINTMENT = Schema(ArchivedAppointment, {
+    "id": Field("int"),
+    "patient_id": Field("int"),
+    "doctor_id": Field("int"),
+    "visit_time": Field("datetime"),
+    "duration_minutes": Field("int"),
+    "status": Field("str"),
+    "notes": Field("str", nullable=True),
+    "reminded_at": Field("datetime", nullable=True),
+    "created_at": Field("datetime"),
+    "updated_at": Field("datetime"),
+    "archived_at": Field("datetime"),
+}, default=("id", "patient_id", "doctor_id", "visit_time", "duration_minutes", "status", "notes", "archived_at"))
+ARCHIVED_APPOINTMENT.includes = APPOINTMENT.includes
@@ -0,0 +1,363 @@
+"""
+Production Server
+
+``python -m app.serve`` runs the app factory in a pool of pre-forked
+worker processes, each serving the shared listening socket with a
+threaded werkzeug server::
+
+    python -m app.serve --host 0.0.0.0 --port 8000 --workers 4
+
+The master imports the application once, then forks; a worker therefore
+only builds its app, runs the warm-up and starts accepting, which keeps
+the cold start of a new worker well below a fresh interpreter's. Heavy
+optional modules (the health-info scraper and ``requests``) are imported
+on first use, and background threads start in ``init_app``, never at
+import. Workers that die are replaced. Signals to the master:
+
+- ``TERM``/``INT``: graceful stop. Workers stop accepting, finish their
+  in-flight requests, interrupt running jobs (resumable) and exit; any
+  still running after ``SERVE_GRACEFUL_TIMEOUT`` are killed. A second
+  signal kills them at once.
+- ``HUP``: graceful reload. The master re-executes itself (same PID,
+  same listening socket), so new code and environment are picked up,
+  starts a new generation of workers and stops the old one once every
+  new worker is ready. If the new code does not import, or its workers
+  fail to boot, the old workers keep serving.
+- ``TTIN``/``TTOU``: one worker more / less.
+
+A worker reports ready only after requesting ``SERVE_WARMUP_PATHS`` and
+running the ``on_warmup`` hooks. POSIX only.
+"""
+import argparse
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from .config import Config
+from .logger import install, parse_rules
+
+log = logging.getLogger(__name__)
+
+BOOT_ERROR = 3
+# Imported by the master before forking, on top of the app package itself:
+# modules a worker would otherwise load while booting
+PRELOAD = ("app.migrations", "app.search", "flask.testing", "werkzeug.serving")
+# Environment handed to the re-executed master on reload
+ENV_FD, ENV_WORKERS, ENV_TARGET = "HMS_SERVE_FD", "HMS_SERVE_WORKERS", "HMS_SERVE_TARGET"
+
+_warmup_hooks = []
+
+def on_warmup(fn):
+    """Registers ``fn(app)`` to run in every worker before it accepts
+    traffic (after the ``SERVE_WARMUP_PATHS`` requests)."""
+    _warmup_hooks.append(fn)
+    return fn
+
+def warm_up(app):
+    """Requests ``SERVE_WARMUP_PATHS`` through the test client, which opens
+    the database connections and fills the statement and entity caches,
+    then runs the ``on_warmup`` hooks."""
+    client = app.test_client()
+    for path in app.config["SERVE_WARMUP_PATHS"]:
+        status = client.get(path).status_code
+        if status >= 500:
+            log.warning("Warm-up request %s returned %s", path, status)
+    for fn in _warmup_hooks:
+        fn(app)
+
+# ------------------ Worker ------------------
+
+def _handler(read_timeout):
+    from werkzeug.serving import WSGIRequestHandler
+
+    class Handler(WSGIRequestHandler):
+        # werkzeug closes every connection after its response; this bounds
+        # how long a client that connects but sends nothing holds a thread
+        # (and so how long it can delay a graceful stop).
+        timeout = read_timeout
+    return Handler
+
+def _serve(fd, ready_fd, overrides, master_pid):
+    """Worker body: builds and warms up the app, serves until TERM (or the
+    master's death), then drains. Returns the exit code."""
+    started = time.perf_counter()
+    try:
+        from werkzeug.serving import make_server
+        from . import create_app
+        from .db import db
+        app = create_app(config=overrides)
+        warm_up(app)
+        cfg = app.config
+        server = make_server(cfg["SERVE_HOST"], 0, app, threaded=True, fd=fd,
+                             request_handler=_handler(cfg["SERVE_READ_TIMEOUT"]))
+    except Exception:
+        log.exception("Worker %s failed to boot", os.getpid())
+        return BOOT_ERROR
+    # Join request threads on close instead of abandoning them
+    server.daemon_threads, server.block_on_close = False, True
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    thread = threading.Thread(target=server.serve_forever, name="hms-serve", daemon=True)
+    thread.start()
+    log.info("Worker %s ready in %.0f ms", os.getpid(), (time.perf_counter() - started) * 1000)
+    os.write(ready_fd, b".")
+    os.close(ready_fd)
+
+    while not stop.wait(1.0):
+        if os.getppid() != master_pid:
+            log.warning("Master %s is gone; worker %s exiting", master_pid, os.getpid())
+            break
+    app.extensions["hms_changes"].close()  # answer long polls now
+    server.shutdown()  # stop accepting; the socket's backlog goes to the other workers
+    thread.join()      # serve_forever closes the server, waiting for in-flight requests
+    timeout = cfg["SERVE_GRACEFUL_TIMEOUT"]
+    app.extensions["hms_jobs"].shutdown(timeout)
+    app.extensions["hms_reminders"].stop(timeout)
+    app.extensions["hms_outbox"].stop(timeout)
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    return 0
+
+# ------------------ Master ------------------
+
+class _Worker:
+    def __init__(self, pid, generation, ready_fd=None):
+        self.pid = pid
+        self.generation = generation
+        self.ready_fd = ready_fd
+        self.ready = ready_fd is None
+        self.stop_at = None
+
+class Master:
+    """Keeps ``target`` ready workers of the current generation running."""
+
+    def __init__(self, sock, target, graceful_timeout, adopted=()):
+        self.sock = sock
+        self.target = target
+        self.graceful_timeout = graceful_timeout
+        self.workers = {pid: _Worker(pid, 0) for pid in adopted}
+        # Generation 0 holds workers adopted from before a reload
+        self.generation = 1
+        self.ready_generation = 0 if adopted else None
+        self.recover_jobs = not adopted
+        self.stopping_since = None
+        self.exit_code = 0
+        self._spawn_after = 0.0
+        self._signals = []
+        self._wake_r, self._wake_w = os.pipe()
+
+    # ---- signals ----
+    def _install_signals(self):
+        os.set_blocking(self._wake_w, False)
+        signal.set_wakeup_fd(self._wake_w)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(sig, lambda signum, _: self._signals.append(signum))
+        signal.signal(signal.SIGCHLD, lambda *_: None)  # wakes select() to reap
+
+    def _handle(self, sig):
+        if sig in (signal.SIGTERM, signal.SIGINT):
+            if self.stopping_since is not None:
+                log.info("Second stop signal: killing workers")
+                self._kill_all()
+            else:
+                log.info("Stopping gracefully")
+                self.stopping_since = time.monotonic()
+                for w in list(self.workers.values()):
+                    self._stop(w)
+        elif self.stopping_since is not None:
+            return
+        elif sig == signal.SIGHUP:
+            self._reexec()
+        elif sig == signal.SIGTTIN:
+            self.target += 1
+            log.info("Scaling up to %d workers", self.target)
+        elif sig == signal.SIGTTOU and self.target > 1:
+            self.target -= 1
+            log.info("Scaling down to %d workers", self.target)
+
+    # ---- workers ----
+    def _overrides(self):
+        overrides = {}
+        if self.target > 1 and not Config.ENTITY_CACHE_LOCAL_TTL:
+            overrides["ENTITY_CACHE_LOCAL_TTL"] = 1.0  # bound staleness between workers
+        # Only one worker may sweep jobs left over by a previous run
+        overrides["JOBS_RECOVER_ON_START"], self.recover_jobs = self.recover_jobs, False
+        return overrides
+
+    def _spawn(self):
+        ready_r, ready_w = os.pipe()
+        overrides = self._overrides()
+        master_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.set_wakeup_fd(-1)
+                for sig in (signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+                    signal.signal(sig, signal.SIG_IGN)  # the master decides
+                for sig in (signal.SIGTERM, signal.SIGCHLD):
+                    signal.signal(sig, signal.SIG_DFL)
+                for fd in (ready_r, self._wake_r, self._wake_w):
+                    os.close(fd)
+                code = _serve(self.sock.fileno(), ready_w, overrides, master_pid)
+            except Exception:
+                log.exception("Worker %s crashed", os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(ready_w)
+        self.workers[pid] = _Worker(pid, self.generation, ready_r)
+
+    def _stop(self, w):
+        if w.stop_at is None:
+            w.stop_at = time.monotonic()
+            self._signal(w.pid, signal.SIGTERM)
+
+    def _kill_all(self):
+        for w in self.workers.values():
+            self._signal(w.pid, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _mark_ready(self, fd):
+        w = next(w for w in self.workers.values() if w.ready_fd == fd)
+        w.ready = os.read(fd, 1) != b""  # EOF: exited before becoming ready
+        os.close(fd)
+        w.ready_fd = None
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            w = self.workers.pop(pid, None)
+            if w is None:
+                continue
+            if w.ready_fd is not None:
+                os.close(w.ready_fd)
+            if w.stop_at is not None or self.stopping_since is not None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if w.ready:
+                log.warning("Worker %s exited unexpectedly (%s); replacing it", pid, code)
+            elif self.ready_generation is None:
+                log.error("Worker %s failed to boot (%s); shutting down", pid, code)
+                self.exit_code = 1
+                self._handle(signal.SIGTERM)
+            elif w.generation > self.ready_generation:
+                log.error("Reload failed: worker %s did not boot (%s); keeping generation %d",
+                          pid, code, self.ready_generation)
+                for other in self.workers.values():
+                    if other.generation == w.generation:
+                        self._stop(other)
+                self.generation = self.ready_generation
+            else:
+                log.error("Worker %s failed to boot (%s); retrying", pid, code)
+                self._spawn_after = time.monotonic() + 1.0
+
+    def _maintain(self):
+        now = time.monotonic()
+        if self.stopping_since is not None:
+            if now - self.stopping_since > self.graceful_timeout:
+                log.warning("Graceful timeout: killing %d workers", len(self.workers))
+                self._kill_all()
+            return
+        current = [w for w in self.workers.values() if w.generation == self.generation and w.stop_at is None]
+        if len(current) < self.target and now >= self._spawn_after:
+            for _ in range(self.target - len(current)):
+                self._spawn()
+        for w in current[self.target:]:
+            self._stop(w)
+        if len(current) >= self.target and all(w.ready for w in current):
+            if self.ready_generation != self.generation:
+                log.info("Generation %d ready (%d workers)", self.generation, len(current))
+                self.ready_generation = self.generation
+            for w in self.workers.values():
+                if w.generation != self.generation:
+                    self._stop(w)
+        for w in self.workers.values():
+            if w.stop_at is not None and now - w.stop_at > self.graceful_timeout:
+                log.warning("Worker %s did not stop in time; killing it", w.pid)
+                self._signal(w.pid, signal.SIGKILL)
+
+    def _reexec(self):
+        # Checked in a fresh interpreter first: a master that cannot import
+        # its own code would orphan the running workers.
+        check = subprocess.run([sys.executable, "-c", "import app.serve"], capture_output=True, text=True)
+        if check.returncode:
+            log.error("Reload aborted, the new code does not import:\n%s", check.stderr)
+            return
+        log.info("Reloading")
+        os.environ[ENV_FD] = str(self.sock.fileno())
+        os.environ[ENV_WORKERS] = ",".join(str(w.pid) for w in self.workers.values() if w.stop_at is None)
+        os.environ[ENV_TARGET] = str(self.target)
+        self.sock.set_inheritable(True)
+        os.execv(sys.executable, sys.orig_argv)
+
+    def run(self) -> int:
+        self._install_signals()
+        while self.workers or self.stopping_since is None:
+            self._maintain()
+            fds = [self._wake_r] + [w.ready_fd for w in self.workers.values() if w.ready_fd is not None]
+            readable, _, _ = select.select(fds, [], [], 1.0)
+            for fd in readable:
+                if fd == self._wake_r:
+                    os.read(fd, 4096)
+                else:
+                    self._mark_ready(fd)
+            self._reap()
+            while self._signals:
+                self._handle(self._signals.pop(0))
+        log.info("Stopped")
+        return self.exit_code
+
+def preload():
+    from sqlalchemy.engine import make_url
+    for name in PRELOAD:
+        importlib.import_module(name)
+    make_url(Config.SQLALCHEMY_DATABASE_URI).get_dialect().import_dbapi()
+
+def _listen(host, port):
+    if ENV_FD in os.environ:
+        return socket.socket(fileno=int(os.environ.pop(ENV_FD)))
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Serve the API with pre-forked, multi-threaded workers")
+    ap.add_argument("--host", default=Config.SERVE_HOST)
+    ap.add_argument("--port", type=int, default=Config.SERVE_PORT, help="0 picks a free port")
+    ap.add_argument("--workers", type=int, default=Config.SERVE_WORKERS, help="default: one per CPU")
+    ap.add_argument("--graceful-timeout", type=float, default=Config.SERVE_GRACEFUL_TIMEOUT)
+    args = ap.parse_args(argv)
+    install(Config.LOG_LEVEL, Config.LOG_FORMAT, parse_rules(Config.LOG_RATE_LIMITS),
+            parse_rules(Config.LOG_SAMPLING), Config.LOG_QUEUE_SIZE)
+    preload()
+
+    sock = _listen(args.host, args.port)
+    adopted = [int(pid) for pid in os.environ.pop(ENV_WORKERS, "").split(",") if pid]
+    target = int(os.environ.pop(ENV_TARGET, 0)) or args.workers or os.cpu_count() or 1
+    host, port = sock.getsockname()[:2]
+    log.info("Listening on http://%s:%s with %d workers (master %s)", host, port, target, os.getpid())
+    sys.exit(Master(sock, target, args.graceful_timeout, adopted).run())
+
+if __name__ == "__main__":
+    main()
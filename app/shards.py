@@ -0,0 +1,216 @@
+"""
+Horizontal Sharding
+
+Patients, their appointments (archived ones included) and the per-table
+bookkeeping that goes with them (``table_changes``, the search index,
+``schedule_versions``) can be spread over several databases. Shard 0 is
+the primary database (SQLALCHEMY_DATABASE_URI), which also keeps every
+other table: doctors, jobs, the email outbox and the change log; each
+``SHARD_DATABASE_URLS`` entry adds one more shard. Without it there is
+one shard and every function here reduces to the unsharded code path.
+
+A row's ID says where it lives: shard ``n`` hands out IDs above
+``n << SHARD_BITS`` (from ``shard_sequences``, in the inserting
+transaction), shard 0 uses plain autoincrement IDs, and ``shard_of``
+recovers the shard from any patient or appointment ID. A new patient is
+placed by a hash of their email (or name without one) and stays there
+when it changes. Each shard's unique email index therefore only covers
+its own patients, and ``crud`` (like ``bulk``) checks a new or changed
+email against every shard. An appointment lives with its patient, so a
+patient's visits and cascading deletes stay on one database.
+
+``route(shard)`` points the session's statements on sharded tables, and
+raw SQL, at one shard (see ``db.RoutingSession``); ``crud`` routes every
+single-patient or single-appointment operation this way. Listings and
+analytics run on every shard, the column queries of shards other than 0
+in parallel on a thread pool, and are merged in their listing order
+(``read``/``stream``), which is exact for keyset pages: each shard
+returns its first ``limit`` rows after the cursor. Doctors are written to
+the primary and copied to every shard (``replicate``) so that joins from
+appointments to doctors work on each of them.
+
+Limits: a transaction that writes to several databases (e.g. a booking
+and its change log entry) is committed one database after the other, so
+a crash in between can leave the change log short of an entry. Booking
+conflicts are checked against the doctor's appointments on every shard,
+but the write lock that serializes bookings across processes is per
+database, so two processes booking the same slot for patients on
+different shards at the same instant can both succeed; the same goes for
+two patients given the same email on different shards at once.
+"""
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from sqlalchemy.sql.util import find_tables
+from .db import db, read_execute, shard_bind, ROUTE, SHARD_BITS, SHARDED_TABLES
+from .models import Patient, Doctor, Appointment
+
+# ------------------ Placement ------------------
+
+def count() -> int:
+    """Number of shards, the primary included."""
+    return current_app.config["SHARD_COUNT"]
+
+def engine(shard: int):
+    return db.engines[shard_bind(shard)]
+
+def floor(shard: int) -> int:
+    """Every ID on ``shard`` is above this."""
+    return shard << SHARD_BITS
+
+def shard_of(pk) -> int:
+    """The shard holding the patient or appointment with ID ``pk``; IDs that
+    cannot exist are sent to shard 0, where they are simply not found."""
+    shard = int(pk) >> SHARD_BITS
+    return shard if 0 < shard < count() else 0
+
+def place(key) -> int:
+    """The shard for a new patient with placement key ``key``."""
+    return zlib.crc32(str(key).encode()) % count()
+
+@contextmanager
+def route(shard: int):
+    """Sends the session's sharded statements to ``shard`` within the block.
+
+    Objects committed in the block are not expired: reloading one after
+    the block would read the primary.
+    """
+    session = db.session()
+    previous, expire = session.info.get(ROUTE), session.expire_on_commit
+    session.info[ROUTE] = shard
+    if shard:
+        session.expire_on_commit = False
+    try:
+        yield
+    finally:
+        session.info[ROUTE] = previous
+        session.expire_on_commit = expire
+
+def next_ids(conn, table: str, shard: int, n: int = 1) -> range:
+    """Allocates ``n`` consecutive IDs for ``table`` on ``shard`` (> 0) in
+    the transaction of ``conn``, a connection to that shard. SQLite upsert
+    syntax; the statement takes the write lock, so IDs are never handed out
+    twice."""
+    top = conn.execute(db.text(
+        "INSERT INTO shard_sequences (name, value) VALUES (:name, :start) "
+        "ON CONFLICT (name) DO UPDATE SET value = value + :n RETURNING value"),
+        {"name": table, "start": floor(shard) + n, "n": n}).scalar_one()
+    return range(top - n + 1, top + 1)
+
+@event.listens_for(Patient, "before_insert")
+@event.listens_for(Appointment, "before_insert")
+def _assign_id(mapper, connection, target):
+    shard = object_session(target).info.get(ROUTE)
+    if shard and target.id is None:
+        target.id = next_ids(connection, mapper.local_table.name, shard)[0]
+
+# ------------------ Scatter-gather ------------------
+
+def is_sharded(stmt) -> bool:
+    """Whether ``stmt`` reads a sharded table (and so must run on every shard)."""
+    return count() > 1 and any(t.name in SHARDED_TABLES for t in find_tables(stmt))
+
+def read_shard(shard: int, stmt, **kwargs):
+    """Executes a read-only ``stmt`` on one shard, in the current session;
+    shard 0 is read through read_execute()."""
+    if not shard:
+        return read_execute(stmt, **kwargs)
+    return db.session.execute(stmt, bind_arguments={"bind": engine(shard)}, **kwargs)
+
+def each(stmt, params=None) -> list:
+    """Executes ``stmt`` on every shard in the current session, which also
+    sees the transaction's own uncommitted writes. Returns one result per
+    shard, in shard order."""
+    return [db.session.execute(stmt, params, bind_arguments={"bind": engine(s)}) for s in range(count())]
+
+def _fetch(bind, stmt):
+    with bind.connect() as conn:
+        return conn.execute(stmt).all()
+
+def _merge(parts, key, reverse):
+    if key is None:
+        return chain.from_iterable(parts)
+    return heapq.merge(*parts, key=key, reverse=reverse)
+
+def read(stmt, key=None, reverse=False, limit=None, scalars=False, only=None) -> list:
+    """Runs a read-only SELECT on every shard and merges the results.
+
+    Statements that touch no sharded table, and every statement when there
+    is one shard, run once through read_execute().
+
+    Args:
+        stmt: The SELECT; each shard's results must already be in ``key`` order.
+        key (callable, optional): Sort key of a row; without it the shards'
+                                  results are concatenated in shard order.
+        reverse (bool): The rows are in descending ``key`` order.
+        limit (int, optional): Keep only the first ``limit`` merged rows.
+        scalars (bool): ``stmt`` selects ORM objects; they are loaded
+                        through the session, one shard after another.
+        only (iterable, optional): Query only these shards.
+
+    Returns:
+        list: Rows, or objects with ``scalars``.
+    """
+    if not is_sharded(stmt):
+        result = read_execute(stmt)
+        return result.scalars().all() if scalars else result.all()
+    targets = sorted(set(only)) if only is not None else range(count())
+    if scalars:
+        parts = [read_shard(s, stmt).scalars().all() for s in targets]
+    else:
+        # Shards other than 0 are read on the pool while shard 0 runs here
+        pool = current_app.extensions["hms_shards"]
+        futures = [pool.submit(_fetch, engine(s), stmt) for s in targets if s]
+        parts = ([read_execute(stmt).all()] if 0 in targets else []) + [f.result() for f in futures]
+    rows = list(_merge(parts, key, reverse))
+    return rows[:limit] if limit is not None else rows
+
+def stream(stmt, key=None, reverse=False, scalars=False, chunk_size=100):
+    """Like read(), but yields the merged rows lazily through one
+    server-side cursor per shard (``yield_per``)."""
+    stmt = stmt.execution_options(yield_per=chunk_size)
+    if not is_sharded(stmt):
+        result = read_execute(stmt)
+        yield from result.scalars() if scalars else result
+        return
+    results = [read_shard(s, stmt) for s in range(count())]
+    yield from _merge([r.scalars() if scalars else r for r in results], key, reverse)
+
+def group(ids) -> dict:
+    """Groups IDs by the shard holding them: ``{shard: [id, ...]}``."""
+    groups = {}
+    for pk in ids:
+        groups.setdefault(shard_of(pk), []).append(pk)
+    return groups
+
+# ------------------ Replication ------------------
+
+def replicate(model, ids=None):
+    """Copies rows of an unsharded ``model`` (doctors) from the primary to
+    every other shard: the rows with the given IDs, or all of them. Rows
+    that are gone from the primary are deleted from the shards."""
+    if count() == 1:
+        return
+    table = model.__table__
+    stmt = db.select(table)
+    if ids is not None:
+        ids = list(ids)
+        stmt = stmt.where(table.c.id.in_(ids))
+    with engine(0).connect() as conn:
+        rows = [r._asdict() for r in conn.execute(stmt)]
+    for s in range(1, count()):
+        with engine(s).begin() as conn:
+            conn.execute(table.delete().where(table.c.id.in_(ids)) if ids is not None else table.delete())
+            if rows:
+                conn.execute(table.insert(), rows)
+
+def init_app(app):
+    shard_count = app.config["SHARD_COUNT"]
+    app.extensions["hms_shards"] = ThreadPoolExecutor(shard_count, "hms-shard") if shard_count > 1 else None
+    with app.app_context():
+        replicate(Doctor)  # shards added, or missed updates while one was down
@@ -0,0 +1,63 @@
+"""
+Baseline comparison for benchmark results::
+
+    python -m benchmarks.compare results.json benchmarks/baseline.json --tolerance 0.25
+
+A scenario regresses if its p50 or p99 latency grew, or its throughput
+fell, by more than ``tolerance`` (relative). Latency changes smaller than
+``min_ms`` are treated as noise. New errors also count as a regression,
+and so does a baseline scenario missing from the results (it crashed the
+run or was renamed) unless the run left it out on purpose: ``--only``, or
+an in-process (DIRECT) scenario in a server run.
+"""
+import argparse
+import json
+import sys
+
+def _expected(name: str, base: dict, meta: dict) -> bool:
+    """Whether the run described by ``meta`` should include scenario ``name``."""
+    only = meta.get("only")
+    if only and not any(name.startswith(p) for p in only):
+        return False
+    return not (base.get("direct") and meta.get("target") == "server")
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.25, min_ms: float = 0.5) -> list:
+    """Returns one human-readable line per regression (empty if none)."""
+    out = []
+    current = results["scenarios"]
+    for name, base in baseline["scenarios"].items():
+        now = current.get(name)
+        if now is None:
+            if _expected(name, base, results.get("meta", {})):
+                out.append(f"{name}: missing from the results")
+            continue
+        if now["errors"] > base["errors"]:
+            out.append(f"{name}: errors {base['errors']} -> {now['errors']}")
+        for key in ("p50_ms", "p99_ms"):
+            old, new = base.get(key), now.get(key)
+            if old is not None and new is not None and new - old > min_ms and new > old * (1 + tolerance):
+                out.append(f"{name}: {key} {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+        old, new = base.get("rps"), now.get("rps")
+        if old and new is not None and new < old * (1 - tolerance):
+            out.append(f"{name}: rps {old} -> {new} ({(new / old - 1) * 100:.0f}%)")
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare benchmark results with a baseline")
+    ap.add_argument("results")
+    ap.add_argument("baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args(argv)
+    with open(args.results) as fh:
+        results = json.load(fh)
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print("REGRESSION:", line)
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+Benchmark runner.
+
+Runs the scenarios in ``benchmarks.scenarios`` against a seeded database
+and writes JSON results (latency percentiles, throughput, errors)::
+
+    python -m benchmarks.seed --db bench.db --patients 1000000 --doctors 200 --appointments 5000000
+    python -m benchmarks.run --db bench.db --target client --out results.json
+    python -m benchmarks.run --db bench.db --target server --workers 4 --concurrency 16 \\
+        --baseline benchmarks/baseline.json
+
+``--target client`` drives the app in-process through the Flask test client
+and also runs the DIRECT (batch_calc / bulk / crud) scenarios.
+``--target server`` starts the production server (``app.serve``) with
+several worker processes, or uses ``--url`` for a server that is already
+running.
+With ``--baseline`` the run is compared against stored results and exits
+non-zero on a regression; ``--save-baseline`` stores this run as the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .scenarios import HTTP, DIRECT, Context
+from .compare import compare
+
+NEWS = ('<html><body>' + '<div data-testid="card-text-wrapper"><h2>Headline {0}</h2><p>Story {0}</p></div>' * 20
+        + '</body></html>')
+FACT = '<html><head><meta name="description" content="A preventable disease."></head></html>'
+
+# ------------------ Local info pages ------------------
+
+class _PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"bench"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = (FACT if self.path.startswith("/facts/") else NEWS).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"bench"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@contextmanager
+def info_server():
+    """Serves static news/fact pages so the /api/info routes never hit the network."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        yield {"INFO_SOURCES": [f"{base}/news"], "DISEASE_FACTS_URL": f"{base}/facts/{{name}}"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# ------------------ Callers ------------------
+
+class ClientCaller:
+    """Issues requests through the Flask test client."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def request(self, method, path, body=None, data=None, content_type=None):
+        resp = self.client.open(path, method=method, json=body, data=data, content_type=content_type)
+        resp.get_data()  # drains streamed bodies
+        return resp.status_code, resp
+
+    def call(self, method, path, body=None):
+        status, resp = self.request(method, path, body)
+        return resp.get_json() if status < 400 else None
+
+
+class HTTPCaller:
+    """Issues requests to a running server, one keep-alive session per thread."""
+
+    def __init__(self, base_url):
+        import requests  # only needed for the server target
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def request(self, method, path, body=None, data=None, content_type=None):
+        headers = {"Content-Type": content_type} if content_type else None
+        resp = self.session.request(method, self.base_url + path, json=body, data=data, headers=headers,
+                                    timeout=120)
+        return resp.status_code, resp
+
+    def call(self, method, path, body=None):
+        status, resp = self.request(method, path, body)
+        return resp.json() if status < 400 else None
+
+# ------------------ Measurement ------------------
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+def summarize(latencies, errors, wall) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1) if wall > 0 else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p90_ms": ms(percentile(latencies, 90)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+def run_http(scenario, ctx, caller, iterations, concurrency=1, warmup=2) -> dict:
+    n = max(1, int(iterations * scenario.weight))
+    lock = threading.Lock()
+    latencies, failures = [], []
+
+    def once(timed=True):
+        try:
+            prepared = scenario.prepare(ctx, caller.call) if scenario.prepare else None
+            method, path, body, data, ctype = scenario.request(ctx, prepared)
+            started = time.perf_counter()
+            status, _ = caller.request(method, path, body, data, ctype)
+            elapsed = time.perf_counter() - started
+            ok = status in scenario.expect
+        except Exception as exc:  # recorded, the run continues
+            ok, elapsed, status = False, None, repr(exc)
+        if timed:
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    failures.append(status)
+
+    for _ in range(min(warmup, n)):
+        once(timed=False)
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda _: once(), range(n)))
+    else:
+        for _ in range(n):
+            once()
+    result = summarize(latencies, len(failures), time.perf_counter() - started)
+    if failures:
+        result["sample_errors"] = [str(f) for f in failures[:3]]
+    return result
+
+def run_direct(app, scenario, ctx, iterations, warmup=1) -> dict:
+    from app.db import db
+    n = max(1, int(iterations * scenario.weight))
+    latencies, errors = [], 0
+    with app.app_context():
+        for i in range(warmup + n):
+            started = time.perf_counter()
+            try:
+                scenario.fn(ctx)
+            except Exception:
+                db.session.rollback()
+                errors += i >= warmup
+                continue
+            finally:
+                db.session.remove()
+            if i >= warmup:
+                latencies.append(time.perf_counter() - started)
+    return summarize(latencies, errors, sum(latencies))
+
+# ------------------ Targets ------------------
+
+def _app_config(db_path, extra):
+    return {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.abspath(db_path)}", "EMAIL_WORKERS": 0,
+            "REMINDERS_ENABLED": False, "DB_PROFILE": "concurrent", "LOG_LEVEL": "WARNING", **extra}
+
+def _select(scenarios, only):
+    return [s for s in scenarios if not only or any(s.name.startswith(p) for p in only)]
+
+def run_client(db_path, iterations, concurrency=1, only=None) -> dict:
+    from app import create_app
+    results = {}
+    with info_server() as info:
+        app = create_app(config=_app_config(db_path, info))
+        with app.app_context():
+            ctx = Context.from_db()
+        caller = ClientCaller(app)
+        for scenario in _select(HTTP, only):
+            results[scenario.name] = run_http(scenario, ctx, caller, iterations, concurrency)
+        for scenario in _select(DIRECT, only):
+            results[scenario.name] = dict(run_direct(app, scenario, ctx, iterations), direct=True)
+    return results
+
+@contextmanager
+def _spawn_server(db_path, workers, port, info):
+    env = dict(os.environ, DATABASE_URL=_app_config(db_path, {})["SQLALCHEMY_DATABASE_URI"],
+               EMAIL_WORKERS="0", REMINDERS_ENABLED="0", DB_PROFILE="concurrent", INFO_SOURCES=",".join(info["INFO_SOURCES"]),
+               DISEASE_FACTS_URL=info["DISEASE_FACTS_URL"], LOG_LEVEL="WARNING")
+    proc = subprocess.Popen([sys.executable, "-m", "app.serve", "--port", str(port),
+                             "--workers", str(workers)], env=env)
+    import requests
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            try:
+                requests.get(url + "/health", timeout=5)
+                break
+            except requests.RequestException:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("benchmark server did not start")
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+def run_server(db_path, iterations, concurrency, workers, port=5055, url=None, only=None) -> dict:
+    from app import create_app
+    app = create_app(config=_app_config(db_path, {}))
+    with app.app_context():
+        ctx = Context.from_db()
+    results = {}
+    with info_server() as info:
+        with (_spawn_server(db_path, workers, port, info) if url is None else _nullctx(url)) as base:
+            caller = HTTPCaller(base)
+            for scenario in _select(HTTP, only):
+                results[scenario.name] = run_http(scenario, ctx, caller, iterations, concurrency)
+    return results
+
+@contextmanager
+def _nullctx(value):
+    yield value
+
+def _meta(args):
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    conn = sqlite3.connect(args.db)
+    try:
+        sizes = {t: conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0]
+                 for t in ("patients", "doctors", "appointments")}
+    finally:
+        conn.close()
+    return {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "target": args.target,
+        "workers": args.workers if args.target == "server" else 1,
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "only": args.only,
+        "dataset": sizes,
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run the HMS benchmark suite")
+    ap.add_argument("--db", required=True, help="SQLite file seeded with benchmarks.seed")
+    ap.add_argument("--target", choices=("client", "server"), default="client")
+    ap.add_argument("--iterations", type=int, default=200, help="Timed requests per scenario (before weights)")
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=4, help="Server worker processes")
+    ap.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    ap.add_argument("--only", action="append", help="Scenario name prefix (repeatable)")
+    ap.add_argument("--out", default="benchmark-results.json")
+    ap.add_argument("--baseline", help="Compare against this results file")
+    ap.add_argument("--save-baseline", help="Also write this run to the given baseline path")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    args = ap.parse_args(argv)
+
+    if args.target == "client":
+        scenarios = run_client(args.db, args.iterations, args.concurrency, args.only)
+    else:
+        scenarios = run_server(args.db, args.iterations, args.concurrency, args.workers, url=args.url,
+                               only=args.only)
+    results = {"meta": _meta(args), "scenarios": scenarios}
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as fh:
+            json.dump(results, fh, indent=2)
+    width = max(map(len, scenarios))
+    for name, r in scenarios.items():
+        print(f"{name:<{width}}  p50 {r['p50_ms']!s:>9} ms  p99 {r['p99_ms']!s:>9} ms  "
+              f"{r['rps']!s:>8} req/s  errors {r['errors']}")
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for line in regressions:
+            print("REGRESSION:", line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Benchmark scenarios.
+
+``HTTP`` covers every ``/api`` route (plus ``/health`` and ``/metrics``);
+each scenario is one timed request, optionally preceded by an untimed
+``prepare`` step (e.g. creating the patient a DELETE will remove).
+``DIRECT`` scenarios call ``batch_calc``, ``bulk`` and ``crud`` in-process
+and only run against the Flask test client target.
+"""
+import io
+import itertools
+import random
+import threading
+from datetime import date, datetime, timedelta
+from app import batch_calc, bulk, crud
+from app.db import db
+from app.models import Patient, Doctor, Appointment
+
+FUTURE = datetime(2100, 1, 1, 8, 0)
+
+class Context:
+    """Dataset ID ranges plus per-run unique counters for generated values."""
+
+    def __init__(self, ranges: dict, seed: int = 1):
+        self.ranges = ranges
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self.run = f"{seed}-{datetime.utcnow():%H%M%S%f}"
+
+    @classmethod
+    def from_db(cls, seed: int = 1):
+        """Reads the ID ranges of the current app's database."""
+        ranges = {}
+        for name, model in (("patients", Patient), ("doctors", Doctor), ("appointments", Appointment)):
+            lo, hi = db.session.execute(db.select(db.func.min(model.id), db.func.max(model.id))).one()
+            if lo is None:
+                raise RuntimeError(f"No {name} in the database; run benchmarks.seed first")
+            ranges[name] = [lo, hi]
+        return cls(ranges, seed)
+
+    def pick(self, kind: str) -> int:
+        lo, hi = self.ranges[kind]
+        with self._lock:
+            return self._rnd.randint(lo, hi)
+
+    def unique(self) -> int:
+        return next(self._counter)
+
+    def email(self, kind="patient") -> str:
+        return f"bench-{kind}-{self.run}-{self.unique()}@example.test"
+
+    def future_slot(self) -> str:
+        # Globally unique times, so generated bookings never conflict.
+        return (FUTURE + timedelta(minutes=30 * self.unique())).isoformat()
+
+    def csv(self, rows: int) -> bytes:
+        out = io.StringIO()
+        out.write("name,dob,email,gender\n")
+        for i in range(rows):
+            out.write(f"Bulk {i},1980-05-0{1 + i % 9},{self.email('bulk')},female\n")
+        return out.getvalue().encode()
+
+    def ndjson_doctors(self, rows: int) -> bytes:
+        return "".join(f'{{"name": "Dr Bulk {i}", "specialty": "Radiology"}}\n' for i in range(rows)).encode()
+
+
+class Scenario:
+    """One timed HTTP request.
+
+    ``path`` and ``body`` may be callables of ``(ctx, prepared)``, where
+    ``prepared`` is what ``prepare(ctx, call)`` returned (None without one).
+    ``weight`` scales the run's iteration count for expensive scenarios.
+    """
+
+    def __init__(self, name, method, path, body=None, data=None, content_type=None, prepare=None,
+                 expect=(200,), weight=1.0):
+        self.name, self.method, self.path = name, method, path
+        self.body, self.data, self.content_type = body, data, content_type
+        self.prepare, self.expect, self.weight = prepare, expect, weight
+
+    def request(self, ctx, prepared):
+        path = self.path(ctx, prepared) if callable(self.path) else self.path
+        body = self.body(ctx, prepared) if callable(self.body) else self.body
+        data = self.data(ctx, prepared) if callable(self.data) else self.data
+        return self.method, path, body, data, self.content_type
+
+
+class DirectScenario:
+    """One timed in-process call of ``fn(ctx)`` inside an app context."""
+
+    def __init__(self, name, fn, weight=1.0):
+        self.name, self.fn, self.weight = name, fn, weight
+
+# ------------------ Prepare steps ------------------
+
+def _new_patient(ctx, call):
+    return call("POST", "/api/patients", {"name": "Bench", "dob": "1985-02-03", "email": ctx.email()})["id"]
+
+def _new_appointment(ctx, call):
+    return call("POST", "/api/appointments", {
+        "patient_id": ctx.pick("patients"), "doctor_id": ctx.pick("doctors"),
+        "visit_time": ctx.future_slot()})["id"]
+
+def _appointment_cursor(ctx, call):
+    a = call("GET", f"/api/appointments/{ctx.pick('appointments')}")
+    return f"{a['visit_time']},{a['id']}" if a else None
+
+def _new_job(ctx, call):
+    return call("POST", "/api/jobs", {"report": "average-age"})["id"]
+
+def _cancelled_job(ctx, call):
+    job_id = _new_job(ctx, call)
+    call("POST", f"/api/jobs/{job_id}/cancel")
+    return job_id
+
+def _front_desk(ctx, _):
+    # Create patient, book, add notes: one request, one commit
+    return {"operations": [
+        {"op": "create", "entity": "patients", "ref": "p",
+         "data": {"name": "Bench", "dob": "1985-02-03", "email": ctx.email("batch")}},
+        {"op": "create", "entity": "appointments", "ref": "a",
+         "data": {"patient_id": "$p", "doctor_id": ctx.pick("doctors"), "visit_time": ctx.future_slot()}},
+        {"op": "update", "entity": "appointments", "id": "$a", "data": {"notes": "benchmark"}},
+    ]}
+
+def _day(ctx, _):
+    day = date.today() + timedelta(days=1 + ctx.unique() % 30)
+    return f"/api/doctors/{ctx.pick('doctors')}/free-slots?from={day}T08:00&to={day}T17:00&length=30"
+
+HTTP = [
+    Scenario("health", "GET", "/health"),
+    # patients
+    Scenario("patients.create", "POST", "/api/patients",
+             lambda ctx, _: {"name": "Bench", "dob": "1985-02-03", "email": ctx.email()}, expect=(201,)),
+    Scenario("patients.bulk_csv_1000", "POST", "/api/patients/bulk", data=lambda ctx, _: ctx.csv(1000),
+             content_type="text/csv", weight=0.1),
+    Scenario("patients.list", "GET", "/api/patients?limit=100"),
+    Scenario("patients.list_after", "GET", lambda ctx, _: f"/api/patients?limit=100&after={ctx.pick('patients')}"),
+    Scenario("patients.stream_1000", "GET",
+             lambda ctx, _: f"/api/patients?stream=1&after={ctx.ranges['patients'][0] + 1000}", weight=0.2),
+    Scenario("patients.search", "GET", lambda ctx, _: f"/api/patients/search?q=patient{ctx.pick('patients')}"),
+    Scenario("patients.search_broad", "GET", "/api/patients/search?q=patient&limit=20"),
+    Scenario("patients.get", "GET", lambda ctx, _: f"/api/patients/{ctx.pick('patients')}", expect=(200, 404)),
+    Scenario("patients.update", "PATCH", lambda ctx, _: f"/api/patients/{ctx.pick('patients')}",
+             lambda ctx, _: {"phone": f"555-{ctx.unique():07d}"}, expect=(200, 404)),
+    Scenario("patients.replace", "PUT", lambda ctx, _: f"/api/patients/{ctx.pick('patients')}",
+             lambda ctx, _: {"name": "Bench", "phone": f"555-{ctx.unique():07d}"}, expect=(200, 404)),
+    Scenario("patients.appointments", "GET", lambda ctx, _: f"/api/patients/{ctx.pick('patients')}/appointments",
+             expect=(200, 404)),
+    Scenario("patients.delete", "DELETE", lambda ctx, pid: f"/api/patients/{pid}", prepare=_new_patient),
+    # doctors
+    Scenario("doctors.create", "POST", "/api/doctors",
+             lambda ctx, _: {"name": "Dr Bench", "specialty": "Surgery", "email": ctx.email("doctor")},
+             expect=(201,)),
+    Scenario("doctors.bulk_ndjson_100", "POST", "/api/doctors/bulk", data=lambda ctx, _: ctx.ndjson_doctors(100),
+             content_type="application/x-ndjson", weight=0.1),
+    Scenario("doctors.list", "GET", "/api/doctors?limit=100"),
+    Scenario("doctors.free_slots", "GET", _day),
+    Scenario("doctors.appointments", "GET",
+             lambda ctx, _: f"/api/doctors/{ctx.pick('doctors')}/appointments?limit=100", expect=(200, 404)),
+    # appointments
+    Scenario("appointments.create", "POST", "/api/appointments",
+             lambda ctx, _: {"patient_id": ctx.pick("patients"), "doctor_id": ctx.pick("doctors"),
+                             "visit_time": ctx.future_slot()}, expect=(201, 404)),
+    Scenario("appointments.get", "GET", lambda ctx, _: f"/api/appointments/{ctx.pick('appointments')}",
+             expect=(200, 404)),
+    Scenario("appointments.get_include", "GET",
+             lambda ctx, _: f"/api/appointments/{ctx.pick('appointments')}?include=patient,doctor",
+             expect=(200, 404)),
+    Scenario("appointments.update", "PATCH", lambda ctx, _: f"/api/appointments/{ctx.pick('appointments')}",
+             {"notes": "benchmark"}, expect=(200, 404)),
+    Scenario("appointments.replace", "PUT", lambda ctx, _: f"/api/appointments/{ctx.pick('appointments')}",
+             {"notes": "benchmark", "status": "scheduled"}, expect=(200, 404, 409)),
+    Scenario("appointments.delete", "DELETE", lambda ctx, aid: f"/api/appointments/{aid}",
+             prepare=_new_appointment),
+    Scenario("appointments.list", "GET", "/api/appointments?limit=100"),
+    Scenario("appointments.list_include", "GET", "/api/appointments?limit=100&include=patient,doctor"),
+    Scenario("appointments.list_after", "GET",
+             lambda ctx, cursor: f"/api/appointments?limit=100&after={cursor}" if cursor else "/api/appointments",
+             prepare=_appointment_cursor),
+    # archive, change feed and batches
+    Scenario("archive.list", "GET", "/api/archive/appointments?limit=100"),
+    Scenario("archive.list_patient", "GET",
+             lambda ctx, _: f"/api/archive/appointments?patient_id={ctx.pick('patients')}"),
+    Scenario("archive.get", "GET", lambda ctx, _: f"/api/archive/appointments/{ctx.pick('appointments')}",
+             expect=(200, 404)),
+    Scenario("changes.read", "GET", "/api/changes?since=0&limit=100"),
+    Scenario("changes.read_entity", "GET", "/api/changes?since=0&limit=100&entity=appointments"),
+    Scenario("batch.front_desk", "POST", "/api/batch", _front_desk, expect=(200, 404)),
+    # analytics and jobs
+    Scenario("analytics.average_age", "GET", "/api/analytics/average-age"),
+    Scenario("analytics.patients", "GET", "/api/analytics/patients?group_by=gender,age&bucket=10"),
+    Scenario("analytics.appointments", "GET", "/api/analytics/appointments?group_by=specialty,month"),
+    Scenario("analytics.snapshot", "GET", "/api/analytics/snapshot"),
+    Scenario("jobs.submit", "POST", "/api/jobs", {"report": "age-by-gender"}, expect=(202,), weight=0.1),
+    Scenario("jobs.get", "GET", lambda ctx, job_id: f"/api/jobs/{job_id}", prepare=_new_job, weight=0.1),
+    Scenario("jobs.cancel", "POST", lambda ctx, job_id: f"/api/jobs/{job_id}/cancel", prepare=_new_job,
+             weight=0.1),
+    Scenario("jobs.resume", "POST", lambda ctx, job_id: f"/api/jobs/{job_id}/resume", prepare=_cancelled_job,
+             expect=(202, 400), weight=0.1),
+    # operational endpoints
+    Scenario("outbox.stats", "GET", "/api/outbox/stats"),
+    Scenario("cache.stats", "GET", "/api/cache/stats"),
+    Scenario("admission.stats", "GET", "/api/admission/stats"),
+    Scenario("logging.stats", "GET", "/api/logging/stats"),
+    Scenario("reminders.stats", "GET", "/api/reminders/stats"),
+    Scenario("metrics.slow_log", "GET", "/api/metrics/slow-log"),
+    Scenario("metrics.slow_log_set", "PUT", "/api/metrics/slow-log", {"enabled": False}),
+    Scenario("metrics.prometheus", "GET", "/metrics"),
+    # health information (served by the runner's local page server)
+    Scenario("info.hospitals", "GET", "/api/info/hospitals"),
+    Scenario("info.disease", "GET", "/api/info/disease/malaria"),
+    Scenario("info.stats", "GET", "/api/info/stats"),
+]
+
+def _bulk_patients(ctx):
+    records = ((n, {"name": f"Direct {n}", "dob": "1970-01-01", "email": ctx.email("direct")})
+               for n in range(1, 5001))
+    bulk.import_records("patients", records)
+
+DIRECT = [
+    DirectScenario("batch_calc.average_age_uncached",
+                   lambda ctx: batch_calc.run_report("average-age", use_cache=False), weight=0.2),
+    DirectScenario("batch_calc.age_by_gender_uncached",
+                   lambda ctx: batch_calc.run_report("age-by-gender", use_cache=False), weight=0.2),
+    DirectScenario("bulk.import_patients_5000", _bulk_patients, weight=0.1),
+    DirectScenario("crud.get_patient", lambda ctx: crud.get_patient(ctx.pick("patients"))),
+    DirectScenario("crud.list_appointments_100", lambda ctx: crud.list_appointments(100)),
+]
@@ -0,0 +1,126 @@
+"""
+Seed data generator.
+
+Builds a deterministic dataset of patients, doctors and appointments with
+``app.bulk.insert_many`` (one compiled executemany per chunk), e.g.::
+
+    python -m benchmarks.seed --db bench.db --patients 1000000 --doctors 200 --appointments 5000000
+
+Appointments are laid out per doctor in consecutive 30-minute slots
+(16 per day from 08:00), so they never overlap; about 70% fall in the past
+and are mostly completed, the rest are scheduled. When the appointments
+at least double the table, its indexes are rebuilt after the load.
+"""
+import argparse
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from app.db import db
+from app.bulk import insert_many
+from app.models import Patient, Doctor, Appointment
+
+SLOTS_PER_DAY = 16
+SPECIALTIES = ("Cardiology", "Dermatology", "General Practice", "Neurology", "Oncology",
+               "Orthopedics", "Pediatrics", "Psychiatry", "Radiology", "Surgery")
+GENDERS = ("female", "male", "other")
+
+def _max_id(model):
+    return db.session.execute(db.select(db.func.max(model.id))).scalar() or 0
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _insert(model, columns, rows, chunk_size):
+    now = datetime.utcnow()
+    for chunk in _chunks(rows, chunk_size):
+        insert_many(model.__table__, columns, chunk, {"created_at": now, "updated_at": now})
+        db.session.commit()
+
+@contextmanager
+def _indexes_deferred(model, enabled):
+    # Building secondary indexes once after a large load is several times
+    # faster than maintaining them row by row.
+    indexes = list(model.__table__.indexes) if enabled else []
+    for index in indexes:
+        index.drop(db.engine, checkfirst=True)
+    try:
+        yield
+    finally:
+        for index in indexes:
+            index.create(db.engine, checkfirst=True)
+
+def seed(patients=10000, doctors=50, appointments=50000, seed=42, chunk_size=50000) -> dict:
+    """Appends a generated dataset to the current app's database.
+
+    Returns:
+        dict: Row counts, the ID ranges created and the elapsed seconds.
+    """
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+    first_patient, first_doctor = _max_id(Patient) + 1, _max_id(Doctor) + 1
+    first_appt = _max_id(Appointment) + 1
+    tag = f"s{seed}-{first_patient}"
+    dob_start, dob_days = date(1930, 1, 1).toordinal(), 90 * 365
+
+    _insert(Patient, ("name", "email", "dob", "gender", "phone", "address"), (
+        (f"Patient {i}", f"patient{i}.{tag}@example.test",
+         date.fromordinal(dob_start + rnd.randrange(dob_days)), rnd.choice(GENDERS),
+         f"555-{rnd.randrange(10 ** 7):07d}", f"{rnd.randrange(1, 9999)} Main St")
+        for i in range(patients)), chunk_size)
+    _insert(Doctor, ("name", "specialty", "email"), (
+        (f"Dr. {i}", SPECIALTIES[i % len(SPECIALTIES)], f"doctor{i}.{tag}@example.test")
+        for i in range(doctors)), chunk_size)
+
+    if doctors and patients and appointments:
+        per_doctor = -(-appointments // doctors)
+        days = -(-per_doctor // SLOTS_PER_DAY)
+        start = datetime.combine(date.today() - timedelta(days=int(days * 0.7)), datetime.min.time())
+        start += timedelta(hours=8)
+        now = datetime.utcnow()
+
+        def appointment_rows():
+            for k in range(appointments):
+                slot = k // doctors
+                visit = start + timedelta(days=slot // SLOTS_PER_DAY, minutes=30 * (slot % SLOTS_PER_DAY))
+                if visit < now:
+                    status = "cancelled" if rnd.random() < 0.1 else "completed"
+                else:
+                    status = "scheduled"
+                yield (first_patient + rnd.randrange(patients), first_doctor + k % doctors, visit, status, 30)
+
+        with _indexes_deferred(Appointment, appointments > first_appt - 1):
+            _insert(Appointment, ("patient_id", "doctor_id", "visit_time", "status", "duration_minutes"),
+                    appointment_rows(), chunk_size)
+
+    return {
+        "patients": [first_patient, first_patient + patients - 1],
+        "doctors": [first_doctor, first_doctor + doctors - 1],
+        "appointments": [first_appt, first_appt + appointments - 1],
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+
+def main(argv=None):
+    from app import create_app
+    ap = argparse.ArgumentParser(description="Generate a benchmark dataset")
+    ap.add_argument("--db", required=True, help="SQLite file to create or extend")
+    ap.add_argument("--patients", type=int, default=10000)
+    ap.add_argument("--doctors", type=int, default=50)
+    ap.add_argument("--appointments", type=int, default=50000)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+    app = create_app(config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.abspath(args.db)}", "EMAIL_WORKERS": 0,
+                             "REMINDERS_ENABLED": False, "DB_PROFILE": "concurrent"})
+    with app.app_context():
+        print(seed(args.patients, args.doctors, args.appointments, args.seed))
+
+if __name__ == "__main__":
+    main()
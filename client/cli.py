@@ -1,16 +1,187 @@
-import argparse, requests, json, sys
-BASE = "http://127.0.0.1:5000/api"
+"""
+Command-line client for the HMS API (requires ``requests``).
 
-def post(path, data):
-    r = requests.post(f"{BASE}{path}", json=data, timeout=10)
+``new-*`` commands make a single call and print the response. ``load``
+sends every record of a CSV (header row) or NDJSON file as its own POST,
+``--concurrency`` at a time over one pooled keep-alive session; failed
+connections and 429/503 responses are retried with exponential backoff,
+progress and throughput go to stderr and rejected records are written as
+NDJSON to ``--errors`` (stderr by default). ``import-*`` uploads a whole
+file to a server-side bulk endpoint instead. ``list-*`` pages through a
+listing with its keyset cursor and writes one JSON object per line::
+
+    python -m client.cli load appointments day.csv --concurrency 16
+    python -m client.cli list-patients --fields id,name > patients.ndjson
+"""
+import argparse, csv, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE = os.getenv("HMS_API", "http://127.0.0.1:5000/api")
+KINDS = ("patients", "doctors", "appointments")
+INT_FIELDS = ("patient_id", "doctor_id", "duration_minutes")  # CSV cells are strings
+# Rejected before any processing, so resending a POST cannot duplicate it
+RETRY_STATUSES = (429, 503)
+
+def session(pool_size=1, retries=3, backoff=0.5) -> requests.Session:
+    """Returns a Session keeping up to ``pool_size`` connections alive.
+
+    Connection failures and 429/503 responses are retried ``retries``
+    times, sleeping ``backoff * 2**n`` seconds (or the server's
+    Retry-After) in between. Read timeouts are not retried: the server may
+    already have created the record.
+    """
+    retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def post(s, url, data):
+    r = s.post(url, json=data, timeout=10)
     print(r.status_code, r.json())
 
-def get(path):
-    r = requests.get(f"{BASE}{path}", timeout=10)
+def upload(s, url, filename):
+    # requests streams file objects, so large files are never read into memory
+    ctype = "text/csv" if filename.lower().endswith(".csv") else "application/x-ndjson"
+    with open(filename, "rb") as fh:
+        r = s.post(url, data=fh, headers={"Content-Type": ctype}, timeout=600)
     print(r.status_code, json.dumps(r.json(), indent=2))
 
+# ------------------ Load ------------------
+
+def _cell(name, value):
+    return int(value) if name in INT_FIELDS and value.isdigit() else value
+
+def read_records(filename):
+    """Yields ``(line_number, record)`` from a CSV or NDJSON file, one line
+    at a time; ``record`` is an error message for an unparseable line."""
+    with open(filename, newline="", encoding="utf-8") as fh:
+        if filename.lower().endswith(".csv"):
+            for n, row in enumerate(csv.DictReader(fh), 2):
+                yield n, {k: _cell(k, v) for k, v in row.items() if k and isinstance(v, str) and v}
+            return
+        for n, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield n, f"invalid JSON: {exc.msg}"
+                continue
+            yield n, record if isinstance(record, dict) else "each line must be a JSON object"
+
+class Progress:
+    """Counts outcomes and prints a progress line every ``every`` seconds."""
+
+    def __init__(self, out=None, every=1.0):
+        self.out, self.every = out or sys.stderr, every
+        self.started = self._last = time.monotonic()
+        self.created = self.failed = 0
+
+    def add(self, ok: bool):
+        if ok:
+            self.created += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if self.every and now - self._last >= self.every:
+            self._last = now
+            print(self._line(now), file=self.out, flush=True)
+
+    def _line(self, now):
+        done = self.created + self.failed
+        rate = done / max(now - self.started, 1e-9)
+        return f"{done} sent, {self.created} created, {self.failed} failed, {rate:.0f} rec/s"
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        done = self.created + self.failed
+        return {"sent": done, "created": self.created, "failed": self.failed, "elapsed_s": round(elapsed, 2),
+                "per_second": round(done / elapsed, 1) if elapsed else None}
+
+def load(base, kind, filename, concurrency=8, retries=3, errors=None, progress_every=1.0) -> dict:
+    """POSTs every record in ``filename`` to ``/<kind>``, at most
+    ``concurrency`` requests in flight and ``2 * concurrency`` records
+    read ahead.
+
+    Returns:
+        dict: Records sent, created and failed, elapsed seconds and rate.
+    """
+    errors = errors or sys.stderr
+    s = session(concurrency, retries)
+    url = f"{base}/{kind}"
+    progress = Progress(every=progress_every)
+
+    def send(record):
+        try:
+            r = s.post(url, json=record, timeout=30)
+        except requests.RequestException as exc:
+            return None, str(exc)
+        if r.status_code < 300:
+            return r.status_code, None
+        try:
+            return r.status_code, r.json().get("error")
+        except ValueError:
+            return r.status_code, r.text[:200]
+
+    def failed(line, status, error):
+        errors.write(json.dumps({"line": line, "status": status, "error": error}) + "\n")
+        progress.add(False)
+
+    def collect(pending, block=True):
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            line = pending.pop(future)
+            status, error = future.result()
+            if error is None:
+                progress.add(True)
+            else:
+                failed(line, status, error)
+
+    pending = {}
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="hms-load") as pool:
+        for line, record in read_records(filename):
+            if isinstance(record, str):
+                failed(line, None, record)
+                continue
+            while len(pending) >= 2 * concurrency:
+                collect(pending)
+            pending[pool.submit(send, record)] = line
+        while pending:
+            collect(pending)
+    s.close()
+    return progress.summary()
+
+# ------------------ List ------------------
+
+def list_all(base, kind, limit=500, fields=None, out=None) -> int:
+    """Writes every ``kind`` record to ``out`` as NDJSON, one page of
+    ``limit`` at a time. Returns the number of records written."""
+    out = out or sys.stdout
+    params = {"limit": limit}
+    if fields:
+        params["fields"] = fields
+    n = 0
+    with session() as s:
+        while True:
+            r = s.get(f"{base}/{kind}", params=params, timeout=30)
+            r.raise_for_status()
+            for item in r.json():
+                out.write(json.dumps(item) + "\n")
+                n += 1
+            after = r.headers.get("X-Next-Cursor")
+            if not after:
+                return n
+            params["after"] = after
+
 def main(argv=None):
     ap = argparse.ArgumentParser(description="Minimal CLI for HMS API")
+    ap.add_argument("--base", default=BASE, help="API root (default: $HMS_API or %(default)s)")
     sub = ap.add_subparsers(dest="cmd")
 
     p_new = sub.add_parser("new-patient")
@@ -21,8 +192,6 @@ def main(argv=None):
     p_new.add_argument("--phone")
     p_new.add_argument("--address")
 
-    sub.add_parser("list-patients")
-
     d_new = sub.add_parser("new-doctor")
     d_new.add_argument("--name", required=True)
     d_new.add_argument("--specialty")
@@ -32,15 +201,38 @@ def main(argv=None):
     a_new.add_argument("--doctor_id", type=int, required=True)
     a_new.add_argument("--visit_time", required=True, help="YYYY-MM-DDTHH:MM")
 
+    for kind in KINDS:
+        ls = sub.add_parser(f"list-{kind}", help=f"Page through all {kind}, one JSON object per line")
+        ls.add_argument("--page-size", type=int, default=500)
+        ls.add_argument("--fields", help="Comma-separated fields to return")
+
+    ld = sub.add_parser("load", help="Create records from a CSV or NDJSON file, one POST each, concurrently")
+    ld.add_argument("kind", choices=KINDS)
+    ld.add_argument("file", help="*.csv with a header row, otherwise NDJSON")
+    ld.add_argument("--concurrency", type=int, default=8)
+    ld.add_argument("--retries", type=int, default=3)
+    ld.add_argument("--errors", type=argparse.FileType("w"), default=sys.stderr,
+                    help="Where to write rejected records (NDJSON, default stderr)")
+    ld.add_argument("--progress-every", type=float, default=1.0, help="Seconds between progress lines (0: off)")
+
+    for kind in ("patients", "doctors"):
+        imp = sub.add_parser(f"import-{kind}", help=f"Bulk import {kind} from a CSV or NDJSON file")
+        imp.add_argument("file", help="*.csv with a header row, otherwise NDJSON")
+
     args = ap.parse_args(argv)
-    if args.cmd == "new-patient":
-        post("/patients", vars(args))
-    elif args.cmd == "list-patients":
-        get("/patients")
-    elif args.cmd == "new-doctor":
-        post("/doctors", vars(args))
-    elif args.cmd == "new-appt":
-        post("/appointments", vars(args))
+    fields = {k: v for k, v in vars(args).items() if k not in ("base", "cmd") and v is not None}
+    if args.cmd in ("new-patient", "new-doctor", "new-appt"):
+        kind = {"new-patient": "patients", "new-doctor": "doctors", "new-appt": "appointments"}[args.cmd]
+        post(session(), f"{args.base}/{kind}", fields)
+    elif args.cmd and args.cmd.startswith("list-"):
+        list_all(args.base, args.cmd.split("-", 1)[1], args.page_size, args.fields)
+    elif args.cmd == "load":
+        summary = load(args.base, args.kind, args.file, args.concurrency, args.retries, args.errors,
+                       args.progress_every)
+        print(json.dumps(summary))
+        sys.exit(1 if summary["failed"] else 0)
+    elif args.cmd in ("import-patients", "import-doctors"):
+        upload(session(), f"{args.base}/{args.cmd.split('-', 1)[1]}/bulk", args.file)
     else:
         ap.print_help()
 
@@ -0,0 +1,72 @@
+import threading
+import time
+import pytest
+from app import create_app, admission
+
+
+def test_routes_are_classed_and_route_limits_matched():
+    controller = admission.AdmissionController(
+        rules=[("GET /api/patients/search", "low")], route_limits=[("GET /api/analytics/average-age", 2)])
+    assert controller.classify("POST", "/api/appointments") == ("high", None)
+    assert controller.classify("PATCH", "/api/appointments/7")[0] == "high"
+    assert controller.classify("GET", "/api/appointments/7")[0] == "normal"
+    assert controller.classify("GET", "/api/patients")[0] == "low"
+    assert controller.classify("GET", "/api/patients/search")[0] == "low"
+    assert controller.classify("GET", "/api/changes")[0] == "exempt"
+    assert controller.classify("GET", "/api/analytics/average-age") == ("low", "GET /api/analytics/average-age")
+    with pytest.raises(ValueError):
+        admission.AdmissionController(rules=[("GET /api/x", "urgent")])
+
+
+def test_low_priority_is_shed_while_bookings_get_the_reserved_slots():
+    controller = admission.AdmissionController(max_concurrent=4, queue_timeout=0.2)
+    held = [controller.acquire("low")]  # low may use one slot of four
+    with pytest.raises(admission.Rejected) as err:
+        controller.acquire("low")
+    assert err.value.status == 503 and err.value.reason == "timeout" and err.value.retry_after >= 1
+    held += [controller.acquire("high") for _ in range(3)]
+
+    # A freed slot goes to the waiting booking, not to the earlier normal request
+    order = []
+    def wait(cls):
+        controller.release(controller.acquire(cls))
+        order.append(cls)
+    waiters = [threading.Thread(target=wait, args=("normal",))]
+    waiters[0].start()
+    time.sleep(0.02)
+    waiters.append(threading.Thread(target=wait, args=("high",)))
+    waiters[1].start()
+    time.sleep(0.02)
+    controller.release(held.pop())
+    waiters[1].join()
+    controller.release(held.pop())  # normal may use three slots
+    waiters[0].join()
+    assert order == ["high", "normal"]
+    stats = controller.stats()
+    assert stats["shed"] == {"timeout": {"low": 1}} and stats["admitted"]["high"] == 4
+
+    # A request whose queue would not drain in time is refused at once
+    held.append(controller.acquire("high"))
+    controller._service = 10.0
+    with pytest.raises(admission.Rejected) as err:
+        controller.acquire("normal")
+    assert err.value.reason == "overloaded" and controller.stats()["waiting"]["normal"] == 0
+
+
+def test_clients_are_rate_limited_with_retry_after():
+    app = create_app(testing=True, config={"ADMISSION_CLIENT_RATE": 1, "ADMISSION_CLIENT_BURST": 3,
+                                           "ADMISSION_CLIENT_HEADER": "X-Forwarded-For"})
+    client = app.test_client()
+    statuses = [client.get("/api/patients").status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    r = client.get("/api/patients")
+    assert r.headers["Retry-After"] == "1" and r.get_json()["reason"] == "rate_limited"
+    other = {"X-Forwarded-For": "10.0.0.9, 10.0.0.1"}
+    assert client.get("/api/patients", headers=other).status_code == 200
+    assert client.get("/api/admission/stats").status_code == 200  # exempt
+
+    stats = client.get("/api/admission/stats").get_json()
+    assert stats["shed"] == {"rate_limited": {"low": 2}} and stats["running"]["low"] == 0
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'hms_admission_shed_total{reason="rate_limited",class="low"} 2' in text
+    assert 'hms_requests_total{endpoint="/api/patients",method="GET",status="429"} 2' in text
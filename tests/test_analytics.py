@@ -0,0 +1,67 @@
+from datetime import date
+from app import analytics, crud
+
+
+def _cohorts(client, what, **params):
+    r = client.get(f"/api/analytics/{what}", query_string=params)
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()
+
+
+def test_patient_cohorts_follow_writes(client):
+    year = date.today().year
+    for name, born, gender in [("A", 1990, "F"), ("B", 1992, "F"), ("C", 1975, "M"), ("D", 2010, None)]:
+        client.post("/api/patients", json={"name": name, "dob": f"{born}-01-01", "gender": gender})
+    body = _cohorts(client, "patients", group_by="gender")
+    assert body["total"] == 4
+    assert body["groups"] == [{"gender": None, "count": 1}, {"gender": "F", "count": 2}, {"gender": "M", "count": 1}]
+
+    ages = _cohorts(client, "patients", group_by="age", bucket=100, gender="F")["groups"]
+    assert ages == [{"age": 0, "count": 2}]
+    assert _cohorts(client, "patients", min_age=year - 1991, max_age=year - 1976)["total"] == 1
+
+    # The next query catches up on writes made since the last one
+    pid = client.post("/api/patients", json={"name": "E", "dob": "1991-06-01", "gender": "M"}).get_json()["id"]
+    client.patch("/api/patients/1", json={"gender": "M"})
+    client.delete("/api/patients/3")
+    body = _cohorts(client, "patients", group_by="gender")
+    assert [(g["gender"], g["count"]) for g in body["groups"]] == [(None, 1), ("F", 1), ("M", 2)]
+    assert client.get("/api/analytics/snapshot").get_json()["rows"]["patients"] == 4 and pid == 5
+    assert client.get("/api/analytics/patients?group_by=name").status_code == 400
+    assert client.get("/api/analytics/patients?bucket=0").status_code == 400
+
+
+def test_appointment_cohorts_by_specialty_month_and_status(app, client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    heart = client.post("/api/doctors", json={"name": "Dr. H", "specialty": "cardiology"}).get_json()["id"]
+    skin = client.post("/api/doctors", json={"name": "Dr. S", "specialty": "dermatology"}).get_json()["id"]
+    visits = [(heart, "2031-01-05T09:00"), (heart, "2031-01-06T09:00"), (heart, "2031-02-01T09:00"),
+              (skin, "2031-01-07T09:00")]
+    ids = [client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did, "visit_time": when})
+           .get_json()["id"] for did, when in visits]
+    client.patch(f"/api/appointments/{ids[0]}", json={"status": "no_show"})
+
+    body = _cohorts(client, "appointments", group_by="specialty,month")
+    assert [(g["specialty"], g["month"], g["count"]) for g in body["groups"]] == [
+        ("cardiology", "2031-01", 2), ("cardiology", "2031-02", 1), ("dermatology", "2031-01", 1)]
+    rates = _cohorts(client, "appointments", group_by="doctor,status", to="2031-02-01T00:00")["groups"]
+    assert {(g["doctor"], g["status"]): g["share"] for g in rates} == {
+        (heart, "no_show"): 0.5, (heart, "scheduled"): 0.5, (skin, "scheduled"): 1.0}
+    assert _cohorts(client, "appointments", specialty="dermatology")["total"] == 1
+    assert _cohorts(client, "appointments", status="cancelled")["total"] == 0
+
+    with app.app_context():
+        crud.update_doctor(skin, specialty="cardiology")
+    assert _cohorts(client, "appointments", specialty="cardiology")["total"] == 4
+    assert client.get("/api/analytics/appointments?from=soon").status_code == 400
+
+
+def test_columns_keep_id_order_through_inserts_and_removals():
+    cols = analytics.Columns(value="i")
+    cols.put([(i, i * 10) for i in range(2, 200, 2)])
+    cols.put([(5, 50), (4, 41)])
+    assert list(cols.data["id"][:4]) == [2, 4, 5, 6] and cols.data["value"][1] == 41
+    cols.remove([5, 7])
+    cols.remove(range(100, 200))  # many at once: one compaction pass
+    assert list(cols.data["id"]) == list(range(2, 100, 2))
+    assert list(cols.data["value"]) == [10 * i if i != 4 else 41 for i in range(2, 100, 2)]
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import archive
+from app.db import db
+from app.models import Appointment
+
+
+def _book(client, pid, did, when):
+    # Past visits get an outcome; only those are archived
+    aid = client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                                 "visit_time": when.isoformat()}).get_json()["id"]
+    if when < datetime.utcnow():
+        client.patch(f"/api/appointments/{aid}", json={"status": "completed"})
+    return aid
+
+
+def _setup(client, visits):
+    pid = client.post("/api/patients", json={"name": "Ann", "dob": "1990-01-01"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr. Bo"}).get_json()["id"]
+    return pid, did, [_book(client, pid, did, when) for when in visits]
+
+
+def test_archive_job_moves_old_visits_in_chunks(app, client):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    pid, did, ids = _setup(client, [now - timedelta(days=400 + i) for i in range(5)]
+                           + [now - timedelta(days=10), now + timedelta(days=1)])
+    since = client.get("/api/changes").get_json()["next"]
+    job = client.post("/api/jobs", json={"report": "archive-appointments",
+                                         "params": {"older_than_days": 365, "batch_size": 2}}).get_json()
+    app.extensions["hms_jobs"].wait(job["id"], 10)
+    job = client.get(f"/api/jobs/{job['id']}").get_json()
+    assert job["status"] == "completed" and job["total"] == 5 and job["result"]["archived"] == 5
+
+    assert [a["id"] for a in client.get("/api/appointments").get_json()] == ids[5:]
+    archived = client.get(f"/api/archive/appointments?patient_id={pid}&limit=3")
+    assert [a["id"] for a in archived.get_json()] == ids[4:1:-1]  # oldest visit first
+    rest = client.get(archived.headers["Link"].split(">")[0][1:]).get_json()
+    assert [a["id"] for a in rest] == ids[1::-1]
+    one = client.get(f"/api/archive/appointments/{ids[0]}").get_json()
+    assert one["doctor_id"] == did and one["archived_at"]
+    assert client.get(f"/api/appointments/{ids[0]}").status_code == 404
+    feed = client.get(f"/api/changes?since={since}").get_json()["changes"]
+    assert sorted((c["op"], c["id"]) for c in feed) == [("archive", i) for i in sorted(ids[:5])]
+
+    bad = client.post("/api/jobs", json={"report": "archive-appointments", "params": {"older_than_days": "x"}})
+    assert bad.status_code == 400
+
+
+def test_patient_delete_cascades_in_one_statement_per_table(app, client):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    pid, _, ids = _setup(client, [now - timedelta(days=400), now + timedelta(days=1), now + timedelta(days=2)])
+    with app.app_context():
+        from app.archive import archive_chunk
+        assert archive_chunk(now - timedelta(days=365), 100) == 1
+
+    deletes = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cur, sql, *a: deletes.append(sql) if sql.startswith("DELETE") else None)
+    assert client.delete(f"/api/patients/{pid}").status_code == 200
+    assert len(deletes) == 3  # appointments, archive, patient
+    assert client.get("/api/archive/appointments").get_json() == []
+    assert client.get("/api/appointments").get_json() == []
+    tombstones = [(c["entity"], c["id"], c["op"]) for c in client.get("/api/changes").get_json()["changes"]]
+    assert {("appointments", i, "delete") for i in ids} | {("patients", pid, "delete")} <= set(tombstones)
+
+
+def test_archived_ids_are_never_reused(app, client):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    pid, did, (old,) = _setup(client, [now - timedelta(days=800)])
+    with app.app_context():
+        from app.archive import archive_chunk
+        assert archive_chunk(now - timedelta(days=365), 100) == 1
+        new = _book(client, pid, did, now - timedelta(days=700))
+        assert new > old
+        assert archive_chunk(now - timedelta(days=365), 100) == 1
+    assert sorted(a["id"] for a in client.get("/api/archive/appointments").get_json()) == [old, new]
+    assert client.get(f"/api/archive/appointments/{old}").get_json()["visit_time"].startswith(
+        (now - timedelta(days=800)).date().isoformat())
+
+
+def test_only_visits_with_an_outcome_are_archived(app, client):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    pid, did, (done,) = _setup(client, [now - timedelta(days=500)])
+    pending = client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                                     "visit_time": (now - timedelta(days=600)).isoformat()})
+    pending = pending.get_json()["id"]
+    cutoff = now - timedelta(days=365)
+    with app.app_context():
+        stmt = (db.select(Appointment.id).where(*archive._archivable(cutoff))
+                .order_by(Appointment.visit_time).limit(5).compile(db.engine))
+        plan = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(stmt), (str(cutoff), 5, 0)).all()
+        assert "ix_appointments_archivable" in " ".join(row[3] for row in plan)
+        assert archive.archive_chunk(cutoff, 100) == 1
+    assert [a["id"] for a in client.get("/api/archive/appointments").get_json()] == [done]
+    assert client.get(f"/api/appointments/{pending}").get_json()["status"] == "scheduled"
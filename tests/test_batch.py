@@ -0,0 +1,86 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import create_app, shards
+
+
+def _batch(client, *operations):
+    return client.post("/api/batch", json={"operations": list(operations)})
+
+
+def test_front_desk_flow_is_one_commit(client):
+    did = client.post("/api/doctors", json={"name": "Dr. A"}).get_json()["id"]
+    commits = []
+    listener = lambda session: commits.append(1)
+    event.listen(Session, "after_commit", listener)
+    try:
+        r = _batch(client,
+                   {"op": "create", "entity": "patients", "ref": "p",
+                    "data": {"name": "A", "dob": "1990-01-01", "email": "a@x.io"}},
+                   {"op": "create", "entity": "appointments", "ref": "a",
+                    "data": {"patient_id": "$p", "doctor_id": did, "visit_time": "2031-01-01T09:00"}},
+                   {"op": "update", "entity": "appointments", "id": "$a", "data": {"notes": "Bring X-rays"}},
+                   {"op": "create", "entity": "doctors", "data": {"name": "Dr. B"}})
+    finally:
+        event.remove(Session, "after_commit", listener)
+    assert r.status_code == 200 and len(commits) == 1
+    results = r.get_json()["results"]
+    assert [(x["op"], x["status"]) for x in results] == [("create", 201), ("create", 201), ("update", 200), ("create", 201)]
+    pid, aid = results[0]["id"], results[1]["id"]
+    assert results[1]["data"]["notes"] is None and results[2]["data"]["notes"] == "Bring X-rays"
+    assert client.get(f"/api/appointments/{aid}").get_json()["patient_id"] == pid
+    assert len(client.get(f"/api/doctors/{did}/free-slots?from=2031-01-01T09:00&to=2031-01-01T10:00").get_json()) == 1
+    assert [c["entity"] for c in client.get("/api/changes?since=1").get_json()["changes"]] == [
+        "patients", "appointments", "doctors"]
+
+    r = _batch(client, {"op": "delete", "entity": "appointments", "id": aid},
+               {"op": "delete", "entity": "patients", "id": pid})
+    assert r.get_json()["results"][1] == {"op": "delete", "entity": "patients", "id": pid, "status": 200}
+    assert client.get(f"/api/patients/{pid}").status_code == 404
+
+
+def test_a_failing_operation_rolls_back_the_whole_batch(client):
+    did = client.post("/api/doctors", json={"name": "Dr. A"}).get_json()["id"]
+    pid = client.post("/api/patients", json={"name": "Old", "dob": "1950-01-01"}).get_json()["id"]
+    client.get(f"/api/patients/{pid}")  # cached
+    r = _batch(client,
+               {"op": "create", "entity": "patients", "data": {"name": "New", "dob": "1990-01-01"}},
+               {"op": "update", "entity": "doctors", "id": did, "data": {"specialty": "gp"}},
+               {"op": "delete", "entity": "patients", "id": pid},
+               {"op": "create", "entity": "appointments",
+                "data": {"patient_id": pid, "doctor_id": did, "visit_time": "2031-01-01T09:00"}})
+    assert r.status_code == 404 and r.get_json()["error"].startswith("Operation 3 (create appointments)")
+    assert [p["name"] for p in client.get("/api/patients").get_json()] == ["Old"]
+    assert client.get("/api/doctors").get_json()[0]["specialty"] is None
+
+    r = _batch(client,
+               {"op": "create", "entity": "patients", "data": {"name": "B", "dob": "1990-01-01", "email": "b@x.io"}},
+               {"op": "create", "entity": "patients", "data": {"name": "C", "dob": "1990-01-01", "email": "b@x.io"}})
+    assert r.status_code == 409 and r.get_json()["error"].startswith("Operation 1 (create patients)")
+    assert len(client.get("/api/patients").get_json()) == 1
+
+    for bad in ([], [{"op": "merge", "entity": "patients"}], [{"op": "update", "entity": "patients", "data": {}}],
+                [{"op": "create", "entity": "doctors", "data": {"name": "X", "shoe_size": 9}}],
+                [{"op": "create", "entity": "appointments", "data": {"patient_id": "$later", "doctor_id": did,
+                                                                     "visit_time": "2031-01-01T09:00"}}]):
+        assert _batch(client, *bad).status_code == 400
+    assert client.post("/api/batch", json=[]).status_code == 400
+
+
+def test_batches_span_shards(tmp_path):
+    urls = [f"sqlite:///{tmp_path / name}.db" for name in ("primary", "shard1", "shard2")]
+    app = create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": urls[0], "SHARD_DATABASE_URLS": ",".join(urls[1:])})
+    client = app.test_client()
+    operations = [{"op": "create", "entity": "doctors", "ref": "d", "data": {"name": "Dr. A"}}]
+    for i in range(6):
+        operations += [
+            {"op": "create", "entity": "patients", "ref": f"p{i}", "data": {"name": f"P{i}", "dob": "1990-01-01",
+                                                                          "email": f"p{i}@x.io"}},
+            {"op": "create", "entity": "appointments", "ref": f"a{i}",
+             "data": {"patient_id": f"$p{i}", "doctor_id": "$d", "visit_time": f"2031-01-01T{9 + i:02d}:00"}},
+            {"op": "update", "entity": "patients", "id": f"$p{i}", "data": {"phone": str(i)}}]
+    results = _batch(client, *operations).get_json()["results"]
+    pids = [x["id"] for x in results if x["entity"] == "patients" and x["op"] == "create"]
+    assert {pid >> shards.SHARD_BITS for pid in pids} == {0, 1, 2}
+    assert [x["data"]["phone"] for x in results if x["op"] == "update"] == [str(i) for i in range(6)]
+    assert len(client.get("/api/appointments?include=doctor").get_json()["appointments"]) == 6
+    assert sorted(p["phone"] for p in client.get("/api/patients").get_json()) == [str(i) for i in range(6)]
@@ -1,3 +1,7 @@
+import pytest
+from app import batch_calc
+
+
 def test_average_age(client):
     # seed patients
     client.post("/api/patients", json={"name":"A","dob":"1990-01-01"})
@@ -6,3 +10,14 @@ def test_average_age(client):
     assert r.status_code == 200
     # number sanity
     assert r.get_json()["average_age"] > 0
+
+
+def test_report_without_step_cannot_be_registered():
+    class Partial(batch_calc.Report):
+        name = "partial"
+
+        def finish(self, state):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,31 @@
+from app import create_app
+from benchmarks.compare import compare
+from benchmarks.run import run_client
+from benchmarks.scenarios import HTTP
+from benchmarks.seed import seed
+
+
+def test_every_scenario_runs_cleanly(tmp_path):
+    path = tmp_path / "bench.db"
+    app = create_app(config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", "EMAIL_WORKERS": 0})
+    with app.app_context():
+        info = seed(patients=300, doctors=5, appointments=600)
+    assert info["appointments"] == [1, 600]
+
+    results = run_client(str(path), iterations=2)
+    assert {s.name for s in HTTP} <= results.keys()
+    assert {name: r["sample_errors"] for name, r in results.items() if r["errors"]} == {}
+
+
+def test_compare_flags_regressions():
+    base = {"scenarios": {"a": {"errors": 0, "p50_ms": 10.0, "p99_ms": 20.0, "rps": 100.0}}}
+    same = {"scenarios": {"a": {"errors": 0, "p50_ms": 11.0, "p99_ms": 21.0, "rps": 95.0}}}
+    slower = {"scenarios": {"a": {"errors": 1, "p50_ms": 20.0, "p99_ms": 21.0, "rps": 50.0}}}
+    assert compare(same, base) == []
+    assert [line.split(":")[1].split()[0] for line in compare(slower, base)] == ["errors", "p50_ms", "rps"]
+
+    # A scenario that vanished from a run regresses, unless the run skipped it
+    base["scenarios"]["crud.x"] = {"errors": 0, "p50_ms": 1.0, "p99_ms": 1.0, "rps": 10.0, "direct": True}
+    assert compare({"scenarios": {}}, base) == ["a: missing from the results", "crud.x: missing from the results"]
+    assert compare({"meta": {"target": "server"}, "scenarios": same["scenarios"]}, base) == []
+    assert compare({"meta": {"only": ["crud."]}, "scenarios": {}}, base) == ["crud.x: missing from the results"]
@@ -0,0 +1,47 @@
+import json
+from app.bulk import import_records
+
+
+def test_csv_import_reports_bad_rows(client):
+    client.post("/api/patients", json={"name": "Old", "dob": "1990-01-01", "email": "taken@x.com"})
+    body = (
+        "name,dob,email,gender\n"
+        "Ann,1990-02-03,ann@x.com,F\n"
+        "Bob,not-a-date,,M\n"
+        "Cy,1980-01-01,taken@x.com,\n"
+        ",1980-01-01,,\n"
+        "Di,1970-05-05,ann@x.com,F\n"
+        "Ed,1985-12-31,,\n"
+    )
+    r = client.post("/api/patients/bulk", data=body, content_type="text/csv")
+    assert r.status_code == 200
+    report = r.get_json()
+    assert report["inserted"] == 2 and report["failed"] == 4
+    assert [e["row"] for e in report["errors"]] == [2, 3, 4, 5]
+    names = {p["name"] for p in client.get("/api/patients").get_json()}
+    assert names == {"Old", "Ann", "Ed"}
+
+
+def test_ndjson_doctors_in_chunks(app, client):
+    lines = [json.dumps({"name": f"Dr {i}", "specialty": "GP"}) for i in range(25)]
+    lines.insert(3, "{oops")
+    r = client.post("/api/doctors/bulk", data="\n".join(lines), content_type="application/x-ndjson")
+    assert r.get_json()["inserted"] == 25 and r.get_json()["errors"][0]["row"] == 4
+    with app.app_context():
+        report = import_records("doctors", enumerate([{"name": "X", "email": "d@x.com"}] * 3, 1), chunk_size=2)
+    assert report["inserted"] == 1 and [e["row"] for e in report["errors"]] == [2, 3]
+    assert client.post("/api/doctors/bulk", data="x", content_type="text/plain").status_code == 400
+
+
+def test_bom_blank_lines_and_non_string_values(client):
+    body = "\ufeffname,dob\r\nAnn,1990-02-03\r\n\r\nBob,1991-03-04\r\n".encode()
+    r = client.post("/api/patients/bulk", data=body, content_type="text/csv")
+    assert r.get_json()["inserted"] == 2 and r.get_json()["failed"] == 0
+
+    lines = [{"name": ["x"], "dob": "1990-01-01"}, {"name": "Cy", "dob": "1990-01-01", "phone": {"n": 1}},
+             {"name": "Di", "dob": "1990-01-01"}]
+    r = client.post("/api/patients/bulk", data="\n".join(map(json.dumps, lines)),
+                    content_type="application/x-ndjson")
+    report = r.get_json()
+    assert r.status_code == 200 and report["inserted"] == 1
+    assert [e["error"] for e in report["errors"]] == ["fields must be strings: name", "fields must be strings: phone"]
@@ -0,0 +1,67 @@
+from sqlalchemy import event
+from app import crud
+from app.cache import LRUCache, get_cache
+from app.db import db
+
+
+def test_lru_eviction_ttl_and_stale_fill():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)  # evicts b, the least recently used
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    version = cache.version("a")
+    cache.delete("a")
+    cache.set("a", "stale", version)  # a fill that raced an invalidation is dropped
+    assert cache.get("a") is None
+    # Deletion stamps are bounded too; an evicted one still marks older fills stale
+    version = cache.version("d")
+    for key in "defgh":
+        cache.delete(key)
+    assert len(cache._versions) == 2
+    cache.set("d", "stale", version)
+    assert cache.get("d") is None
+    cache.set("d", 4, cache.version("d"))
+    assert cache.get("d") == 4
+    expired = LRUCache(maxsize=2, ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+
+
+def test_read_through_and_invalidation(app, client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    assert client.get(f"/api/patients/{pid}").status_code == 200  # miss, fills the cache
+
+    statements = []
+    with app.app_context():
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            p = crud.get_patient(pid)
+            assert (p.name, p.age is not None) == ("A", True)
+            assert not statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+    client.patch(f"/api/patients/{pid}", json={"name": "B"})
+    assert client.get(f"/api/patients/{pid}").get_json()["name"] == "B"
+    client.delete(f"/api/patients/{pid}")
+    assert client.get(f"/api/patients/{pid}").status_code == 404
+
+    stats = client.get("/api/cache/stats").get_json()
+    assert stats["hits"] >= 1 and stats["misses"] >= 2 and stats["invalidations"] == 2
+
+
+def test_cached_entities_still_book_appointments(app, client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    client.get(f"/api/patients/{pid}")
+    with app.app_context():
+        assert crud.get_doctor(did).name == "Dr"
+        hits = get_cache().info()["hits"]
+    r = client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                               "visit_time": "2030-01-01T09:00"})
+    assert r.status_code == 201
+    with app.app_context():
+        assert get_cache().info()["hits"] == hits + 2
@@ -0,0 +1,51 @@
+import threading
+import time
+from app import create_app
+
+
+def _feed(client, since=0, **params):
+    r = client.get("/api/changes", query_string=dict(params, since=since))
+    assert r.status_code == 200, r.get_json()
+    body = r.get_json()
+    return [(c["entity"], c["id"], c["op"]) for c in body["changes"]], body
+
+
+def test_feed_logs_writes_cascades_and_tombstones(client):
+    pid = client.post("/api/patients", json={"name": "Ann", "dob": "1990-01-01"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr. Bo"}).get_json()["id"]
+    aid = client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                                 "visit_time": "2031-01-01T09:00"}).get_json()["id"]
+    client.patch(f"/api/patients/{pid}", json={"phone": "555"})
+    changes, body = _feed(client)
+    # The patient's create and update collapse to one entry, at its last position
+    assert changes == [("doctors", did, "upsert"), ("appointments", aid, "upsert"), ("patients", pid, "upsert")]
+    assert body["changes"][-1]["data"]["phone"] == "555" and body["more"] is False
+
+    client.delete(f"/api/patients/{pid}")  # cascades to the appointment
+    client.post("/api/doctors/bulk", data="name\nDr. Cy\nDr. Di\n", content_type="text/csv")
+    changes, body = _feed(client, body["next"])
+    assert changes[:2] == [("appointments", aid, "delete"), ("patients", pid, "delete")]
+    assert [c[0] for c in changes[2:]] == ["doctors", "doctors"]
+    assert "data" not in body["changes"][0]
+
+    page, first = _feed(client, 0, limit=2, entity="doctors")
+    assert page == [("doctors", did, "upsert"), ("doctors", did + 1, "upsert")] and first["more"] is True
+    assert _feed(client, body["next"])[1]["next"] == body["next"]
+    assert _feed(client, body["next"] + 100)[1]["next"] == body["next"]  # never past the end
+    assert client.get("/api/changes?entity=nurses").status_code == 400
+
+
+def test_long_poll_wakes_on_commit(tmp_path):
+    app = create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'feed.db'}"})
+    client = app.test_client()
+    since = _feed(client)[1]["next"]
+    started = time.monotonic()
+    assert _feed(client, since, wait=0.3)[0] == []
+    assert time.monotonic() - started >= 0.3
+
+    writer = threading.Timer(0.2, lambda: app.test_client().post("/api/doctors", json={"name": "Dr. Ed"}))
+    writer.start()
+    started = time.monotonic()
+    changes, _ = _feed(client, since, wait=10)
+    writer.join()
+    assert changes == [("doctors", 1, "upsert")] and time.monotonic() - started < 5
@@ -0,0 +1,46 @@
+import io
+import json
+import threading
+import pytest
+from werkzeug.serving import make_server
+from app import create_app
+from client import cli
+
+
+@pytest.fixture()
+def base(tmp_path):
+    # A real threaded server: the client's connection pool and concurrency
+    # are what is under test.
+    app = create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'cli.db'}",
+                                           "DB_PROFILE": "concurrent"})
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.port}/api"
+    server.shutdown()
+    thread.join()
+
+
+def test_load_and_list(base, tmp_path, capsys):
+    patients = tmp_path / "patients.ndjson"
+    patients.write_text("".join(json.dumps({"name": f"P{i}", "dob": "1990-01-01"}) + "\n" for i in range(25))
+                        + "not json\n")
+    errors = io.StringIO()
+    summary = cli.load(base, "patients", str(patients), concurrency=4, errors=errors, progress_every=0)
+    assert summary["created"] == 25 and summary["failed"] == 1
+    assert json.loads(errors.getvalue())["line"] == 26
+
+    cli.main(["--base", base, "new-doctor", "--name", "Dr. Who"])
+    visits = tmp_path / "visits.csv"
+    visits.write_text("patient_id,doctor_id,visit_time,duration_minutes\n"
+                      "1,1,2030-01-01T09:00,30\n1,1,2030-01-01T09:15,\n2,1,2030-01-01T10:00,\n")
+    errors = io.StringIO()
+    summary = cli.load(base, "appointments", str(visits), concurrency=2, errors=errors, progress_every=0)
+    assert summary["created"] == 2 and json.loads(errors.getvalue())["status"] == 409
+
+    capsys.readouterr()
+    cli.main(["--base", base, "list-patients", "--page-size", "10", "--fields", "id,name"])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # Concurrent POSTs commit in any order, so only the set of names is fixed
+    assert [r["id"] for r in rows] == list(range(25, 0, -1))
+    assert {r["name"] for r in rows} == {f"P{i}" for i in range(25)}
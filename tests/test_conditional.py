@@ -0,0 +1,55 @@
+from sqlalchemy import event
+from app.db import db
+
+
+def _new_patient(client, name):
+    return client.post("/api/patients", json={"name": name, "dob": "1990-01-01"}).get_json()["id"]
+
+
+def test_entity_etag_and_304(client):
+    created = client.post("/api/patients", json={"name": "Ann", "dob": "1990-01-01"})
+    etag = created.headers["ETag"]
+    assert not etag.startswith("W/") and created.headers["Cache-Control"] == "no-cache"
+    pid = created.get_json()["id"]
+    again = client.get(f"/api/patients/{pid}", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b"" and again.headers["ETag"] == etag
+    # Another projection is another representation
+    assert client.get(f"/api/patients/{pid}?fields=id,name", headers={"If-None-Match": etag}).status_code == 200
+    client.patch(f"/api/patients/{pid}", json={"phone": "555"})
+    changed = client.get(f"/api/patients/{pid}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+def test_collection_304_skips_the_list_query(app, client):
+    for name in ("Dr. A", "Dr. B"):
+        client.post("/api/doctors", json={"name": name})
+    page = client.get("/api/doctors")
+    etag = page.headers["ETag"]
+    assert etag.startswith("W/")
+    seen = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda conn, cur, sql, *a: seen.append(sql))
+    assert client.get("/api/doctors", headers={"If-None-Match": etag}).status_code == 304
+    assert len(seen) == 1 and "table_changes" in seen[0]
+    since = client.get("/api/doctors", headers={"If-Modified-Since": page.headers["Last-Modified"]})
+    assert since.status_code == 304
+    assert client.get("/api/doctors?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_collection_etag_follows_inserts_updates_and_deletes(client):
+    ids = [_new_patient(client, n) for n in ("Ann", "Bob", "Cy")]
+    tags = {client.get("/api/patients?fields=id,name").headers["ETag"]}
+
+    def changed():
+        tag = client.get("/api/patients?fields=id,name").headers["ETag"]
+        assert tag not in tags
+        tags.add(tag)
+
+    # Deleting an older row leaves max(updated_at) and max(id) alone; the
+    # trigger-maintained deletion counter still moves the tag
+    client.delete(f"/api/patients/{ids[0]}")
+    changed()
+    client.patch(f"/api/patients/{ids[1]}", json={"phone": "555"})
+    changed()
+    _new_patient(client, "Di")
+    changed()
@@ -0,0 +1,126 @@
+import socket
+import socketserver
+import threading
+from datetime import datetime
+import pytest
+from app import create_app
+from app.db import db
+from app.emailer import enqueue_email, get_outbox
+from app.models import OutboxEmail
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: records messages, rejects bad@ recipients."""
+
+    def handle(self):
+        server = self.server
+        server.sessions += 1
+        self.wfile.write(b"220 test ESMTP\r\n")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            cmd = line[:4].upper()
+            if not line or cmd == "QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            if cmd == "EHLO":
+                self.wfile.write(b"250-test\r\n250 8BITMIME\r\n")
+            elif cmd == "RCPT" and "bad@" in line:
+                self.wfile.write(b"550 no such user\r\n")
+            elif cmd == "DATA":
+                self.wfile.write(b"354 go ahead\r\n")
+                data = []
+                while (chunk := self.rfile.readline()) != b".\r\n":
+                    data.append(chunk)
+                server.messages.append(b"".join(data).decode())
+                self.wfile.write(b"250 queued\r\n")
+            else:
+                self.wfile.write(b"250 ok\r\n")
+
+
+@pytest.fixture()
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.messages, server.sessions = [], 0
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def app(smtp_server):
+    return create_app(testing=True, config={
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": smtp_server.server_address[1], "EMAIL_BATCH_SIZE": 10})
+
+
+def _book(client, email, hour):
+    pid = client.post("/api/patients", json={"name": "P", "dob": "1990-01-01", "email": email}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    return client.post("/api/appointments", json={
+        "patient_id": pid, "doctor_id": did, "visit_time": f"2030-01-01T{hour:02d}:00"})
+
+
+def test_outbox_written_with_booking_and_batched(app, client, smtp_server):
+    for i in range(25):
+        assert _book(client, f"p{i}@x.com", i % 24).status_code == 201
+    assert client.get("/api/outbox/stats").get_json()["queue_depth"] == 25
+    with app.app_context():
+        assert get_outbox().drain() == 25
+    assert len(smtp_server.messages) == 25
+    assert smtp_server.sessions == 1  # three batches over one pooled connection
+    stats = client.get("/api/outbox/stats").get_json()
+    assert stats["queue_depth"] == 0 and stats["sent_total"] == 25 and stats["sent_last_minute"] == 25
+
+
+def test_conflicting_booking_leaves_no_email(app, client):
+    pid = client.post("/api/patients", json={"name": "P", "dob": "1990-01-01", "email": "p@x.com"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    body = {"patient_id": pid, "doctor_id": did, "visit_time": "2030-01-01T09:00"}
+    client.post("/api/appointments", json=body)
+    assert client.post("/api/appointments", json=body).status_code == 409
+    assert client.get("/api/outbox/stats").get_json()["queue_depth"] == 1
+
+
+def test_permanent_and_transient_failures(app, client, smtp_server):
+    _book(client, "bad@x.com", 9)
+    _book(client, "ok@x.com", 10)
+    smtp_server.shutdown()
+    smtp_server.server_close()  # SMTP down: transient failure for both
+    with app.app_context():
+        outbox = get_outbox()
+        now = datetime.utcnow()
+        assert outbox.drain(now) == 0
+        msgs = OutboxEmail.query.order_by(OutboxEmail.id).all()
+        assert [(m.status, m.attempts) for m in msgs] == [("pending", 1), ("pending", 1)]
+        assert msgs[0].next_attempt_at > now
+    stats = client.get("/api/outbox/stats").get_json()
+    assert stats["retried_total"] == 2 and stats["queue_depth"] == 2
+
+
+def test_recipient_rejected_permanently(app, client, smtp_server):
+    _book(client, "bad@x.com", 9)
+    _book(client, "ok@x.com", 10)
+    with app.app_context():
+        assert get_outbox().drain() == 1
+        statuses = [m.status for m in OutboxEmail.query.order_by(OutboxEmail.id)]
+    assert statuses == ["failed", "sent"]
+    assert client.get("/api/outbox/stats").get_json()["failed"] == 1
+
+
+def test_invalid_message_fails_alone_and_dead_connections_are_replaced(app, smtp_server):
+    with app.app_context():
+        for to in ("a@x.com", "b@x.com\r\nBcc: c@x.com", "d@x.com"):
+            enqueue_email(to, "Hi", "Body")
+        db.session.commit()
+        outbox = get_outbox()
+        assert outbox.drain() == 2
+        msgs = OutboxEmail.query.order_by(OutboxEmail.id).all()
+        assert [(m.status, m.attempts) for m in msgs] == [("sent", 1), ("failed", 1), ("sent", 1)]
+        assert msgs[1].last_error.startswith("Invalid message")
+
+        outbox.pool._idle.queue[0].sock.shutdown(socket.SHUT_RDWR)  # dropped while idle
+        enqueue_email("e@x.com", "Hi", "Body")
+        db.session.commit()
+        assert outbox.drain() == 1
+    assert len(smtp_server.messages) == 3 and smtp_server.sessions == 2
@@ -0,0 +1,53 @@
+import threading
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import create_app, crud
+from app.db import db, read_engine
+
+
+@pytest.fixture()
+def app(tmp_path):
+    url = f"sqlite:///{tmp_path / 'hms.db'}"
+    app = create_app(testing=True, config={
+        "SQLALCHEMY_DATABASE_URI": url, "READ_DATABASE_URL": url, "DB_PROFILE": "concurrent"})
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_profile_pragmas_and_read_only_bind(app):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 10000
+        assert db.engine.pool.size() == 10
+        with read_engine().connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA query_only").scalar() == 1
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql("DELETE FROM patients")
+
+
+def test_lists_go_to_read_bind_and_writers_do_not_lock(app, client):
+    def book(n):
+        with app.app_context():
+            for i in range(10):
+                crud.create_patient(f"P{n}-{i}", "1990-01-01")
+
+    threads = [threading.Thread(target=book, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    reads = []
+    with app.app_context():
+        listener = lambda *args: reads.append(args[2])  # noqa: E731
+        event.listen(read_engine(), "before_cursor_execute", listener)
+        try:
+            assert len(client.get("/api/patients").get_json()) == 40
+            assert client.get("/api/analytics/average-age").status_code == 200
+        finally:
+            event.remove(read_engine(), "before_cursor_execute", listener)
+    assert any("FROM patients" in sql for sql in reads)
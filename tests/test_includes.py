@@ -0,0 +1,57 @@
+from sqlalchemy import event
+from app.db import db
+
+
+def _setup(client, n):
+    patients = [client.post("/api/patients", json={"name": f"P{i}", "dob": "1990-01-01"}).get_json()["id"]
+                for i in range(3)]
+    doctors = [client.post("/api/doctors", json={"name": f"Dr. {i}"}).get_json()["id"] for i in range(2)]
+    for i in range(n):
+        r = client.post("/api/appointments", json={"patient_id": patients[i % 3], "doctor_id": doctors[i % 2],
+                                                   "visit_time": f"2031-01-{i // 8 + 1:02d}T{9 + i % 8:02d}:00"})
+        assert r.status_code == 201, r.get_json()
+    return patients, doctors
+
+
+def _selects(app, client, path):
+    seen = []
+    with app.app_context():
+        listener = lambda conn, cur, sql, *a: seen.append(sql) if sql.lstrip().startswith("SELECT") else None
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            r = client.get(path)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+    assert r.status_code == 200, r.get_json()
+    return r.get_json(), len(seen)
+
+
+def test_include_embeds_each_entity_once_in_constant_queries(app, client):
+    patients, doctors = _setup(client, 24)
+    small, few = _selects(app, client, "/api/appointments?limit=4&include=patient,doctor")
+    body, many = _selects(app, client, "/api/appointments?limit=24&include=patient,doctor&fields=id")
+    assert few == many
+    assert [a["id"] for a in body["appointments"]] == list(range(1, 25))
+    assert [p["id"] for p in body["patients"]] == patients and [d["id"] for d in body["doctors"]] == doctors
+    assert {a["patient_id"] for a in small["appointments"]} == {p["id"] for p in small["patients"]}
+    assert isinstance(client.get("/api/appointments?limit=2").get_json(), list)  # unchanged without include
+    assert client.get("/api/appointments?include=nurse").status_code == 400
+
+    one = client.get("/api/appointments/1?include=doctor").get_json()
+    assert one["doctor"] == {"id": doctors[0], "name": "Dr. 0", "specialty": None, "email": None}
+
+
+def test_schedules_filter_by_owner_and_range(client):
+    patients, doctors = _setup(client, 16)
+    day = client.get(f"/api/doctors/{doctors[1]}/appointments",
+                     query_string={"from": "2031-01-02T00:00", "to": "2031-01-03T00:00", "include": "patient"})
+    body = day.get_json()
+    assert [a["visit_time"][:10] for a in body["appointments"]] == ["2031-01-02"] * 4
+    assert all(a["doctor_id"] == doctors[1] for a in body["appointments"])
+    assert {p["id"] for p in body["patients"]} == {a["patient_id"] for a in body["appointments"]}
+
+    mine = client.get(f"/api/patients/{patients[0]}/appointments?limit=3")
+    assert all(a["patient_id"] == patients[0] for a in mine.get_json()) and "Link" in mine.headers
+    assert client.get("/api/patients/999/appointments").status_code == 404
+    bad = client.get(f"/api/doctors/{doctors[0]}/appointments?from=2031-01-03T00:00&to=2031-01-02T00:00")
+    assert bad.status_code == 400
@@ -0,0 +1,86 @@
+from datetime import date, timedelta
+import pytest
+from app import batch_calc, create_app
+from app.db import db
+from app.models import BatchJob
+
+
+@pytest.fixture()
+def app(tmp_path):
+    # Job threads need their own connections, which :memory: cannot give them.
+    return create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'jobs.db'}"})
+
+
+def _wait(client, job_id, timeout=5):
+    client.application.extensions["hms_jobs"].wait(job_id, timeout)
+    return client.get(f"/api/jobs/{job_id}").get_json()
+
+
+def _seed(client, dobs):
+    for i, dob in enumerate(dobs):
+        client.post("/api/patients", json={"name": f"P{i}", "dob": dob, "gender": "F" if i % 2 else "M"})
+
+
+def test_job_runs_in_background(app, client):
+    _seed(client, ["1990-01-01", "2000-01-01", "1980-06-15"])
+    r = client.post("/api/jobs", json={"report": "average-age", "params": {"batch_size": 2}})
+    assert r.status_code == 202
+    job = _wait(client, r.get_json()["id"])
+    assert job["status"] == "completed" and job["processed"] == 3 and job["progress"] == 1
+    with app.app_context():
+        assert job["result"] == batch_calc.calculate_average_age(batch_size=1)
+    assert client.post("/api/jobs", json={"report": "nope"}).status_code == 400
+
+
+def test_resume_from_checkpoint(app, client):
+    _seed(client, ["1990-01-01", "2000-01-01", "1980-06-15", "1970-03-03"])
+    with app.app_context():
+        expected = batch_calc.run_report("age-by-gender", use_cache=False)
+        report = batch_calc.get_report("age-by-gender")
+        state, n, _ = report.step(report.start({}), 2)
+        job = BatchJob(report="age-by-gender", params={"batch_size": 1},
+                       checkpoint=state, processed=n, total=4, status="interrupted")
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+    assert client.post(f"/api/jobs/{job_id}/resume").status_code == 202
+    job = _wait(client, job_id)
+    assert job["processed"] == 4 and job["result"] == expected
+    assert client.post(f"/api/jobs/{job_id}/resume").status_code == 400
+
+
+def test_average_age_cache_invalidated_by_writes(app, client, monkeypatch):
+    _seed(client, ["2000-01-01"])
+    first = client.get("/api/analytics/average-age").get_json()["average_age"]
+    with app.app_context():
+        assert batch_calc.cached_result("average-age") == first
+    _seed(client, ["1950-01-01"])
+    with app.app_context():
+        assert batch_calc.cached_result("average-age") is None
+    assert client.get("/api/analytics/average-age").get_json()["average_age"] > first
+
+    # Ages change overnight even when no row does
+    later = client.get("/api/analytics/average-age").get_json()["average_age"]
+    class Tomorrow(date):
+        @classmethod
+        def today(cls):
+            return date.today() + timedelta(days=1)
+    with app.app_context():
+        assert batch_calc.cached_result("average-age") == later
+        monkeypatch.setattr(batch_calc, "date", Tomorrow)
+        assert batch_calc.cached_result("average-age") is None
+
+
+def test_shutdown_leaves_jobs_resumable(app, client):
+    _seed(client, ["1990-01-01", "2000-01-01"])
+    app.extensions["hms_jobs"].shutdown(5)
+    job_id = client.post("/api/jobs", json={"report": "average-age"}).get_json()["id"]
+    assert client.get(f"/api/jobs/{job_id}").get_json()["status"] == "interrupted"
+
+    # Another worker sharing the database must not interrupt running jobs
+    with app.app_context():
+        db.session.get(BatchJob, job_id).status = "running"
+        db.session.commit()
+    create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+                                     "JOBS_RECOVER_ON_START": False})
+    assert client.get(f"/api/jobs/{job_id}").get_json()["status"] == "running"
@@ -0,0 +1,58 @@
+import io
+import json
+import logging
+from app import logger
+
+
+def _capture(pipeline):
+    pipeline.flush()
+    stream, pipeline.stream = pipeline.stream, io.StringIO()
+    return stream
+
+
+def test_records_are_json_lines_with_the_request_id(app, client):
+    pipeline = logger.get_pipeline()
+    stream = _capture(pipeline)
+    try:
+        r = client.get("/api/patients/999", headers={"X-Request-ID": "abc-123"})
+        assert r.headers["X-Request-ID"] == "abc-123"
+        with app.test_request_context(headers={"X-Request-ID": "bad id!"}):
+            app.preprocess_request()
+            logging.getLogger("app.test").warning("seen %d times", 3)
+        pipeline.flush()
+        lines = [json.loads(line) for line in pipeline.stream.getvalue().splitlines()]
+    finally:
+        pipeline.stream = stream
+    entry = [e for e in lines if e["logger"] == "app.test"][-1]
+    assert entry["msg"] == "seen 3 times" and entry["level"] == "WARNING" and entry["ts"].endswith("Z")
+    assert len(entry["request_id"]) == 16  # an invalid incoming ID is replaced
+    assert len(client.get("/api/patients").headers["X-Request-ID"]) == 16
+
+
+def test_rate_limits_sampling_and_overflow_are_counted(app, client):
+    pipeline = logger.get_pipeline()
+    stream = _capture(pipeline)
+    before = pipeline.stats()
+    try:
+        pipeline.configure({"app.noisy": 5}, {"app.chatty": 0})
+        noisy, chatty = logging.getLogger("app.noisy.child"), logging.getLogger("app.chatty")
+        for i in range(20):
+            noisy.warning("noisy %d", i)
+            chatty.info("chatty %d", i)
+        chatty.error("kept")
+        pipeline.flush()
+        written = pipeline.stream.getvalue()
+    finally:
+        pipeline.configure()
+        pipeline.stream = stream
+    after = client.get("/api/logging/stats").get_json()
+    assert after["rate_limited"] - before["rate_limited"] == 15
+    assert after["sampled_out"] - before["sampled_out"] == 20
+    assert written.count('"msg":"noisy') == 5 and '"msg":"chatty' not in written and '"msg":"kept"' in written
+    assert 'hms_log_records_total{outcome="rate_limited"}' in client.get("/metrics").get_data(as_text=True)
+
+    # Without a running writer the queue fills up and further records are dropped
+    stalled = logger.LogPipeline(capacity=2)
+    for i in range(5):
+        stalled.submit(logging.makeLogRecord({"name": "x", "msg": "m %d", "args": (i,)}))
+    assert stalled.stats()["dropped"] == 3 and stalled.queue.get_nowait().msg == "m 0"
@@ -0,0 +1,45 @@
+import logging
+from flask import Response
+from app import metrics
+from app.db import db
+from app.models import Appointment
+
+
+def test_prometheus_output_and_runtime_slow_log(client, caplog):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    client.get(f"/api/patients/{pid}")
+    client.get("/api/patients/999999")
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'hms_requests_total{endpoint="/api/patients/<int:pid>",method="GET",status="200"} 1' in body
+    assert 'hms_requests_total{endpoint="/api/patients/<int:pid>",method="GET",status="404"} 1' in body
+    assert 'hms_request_duration_seconds_count{endpoint="/api/patients"} 1' in body
+    assert 'hms_request_sql_statements_bucket{endpoint="/api/patients",le="+Inf"} 1' in body
+
+    assert client.put("/api/metrics/slow-log", json={"threshold_ms": -1}).status_code == 400
+    r = client.put("/api/metrics/slow-log", json={"enabled": True, "threshold_ms": 0})
+    assert r.get_json() == {"enabled": True, "threshold_ms": 0}
+    with caplog.at_level(logging.WARNING, logger="app.metrics.slow"):
+        client.get("/api/patients")
+    assert any("FROM patients" in rec.getMessage() for rec in caplog.records)
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'hms_db_rows_loaded_total{endpoint="/api/patients"} 1' in body  # a column select
+
+
+def test_n_plus_one_detected(app, client, caplog):
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    for i in range(6):
+        pid = client.post("/api/patients", json={"name": f"P{i}", "dob": "1990-01-01"}).get_json()["id"]
+        client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                               "visit_time": f"2030-01-01T{9 + i:02d}:00"})
+
+    with app.test_request_context("/api/appointments"), caplog.at_level(logging.WARNING, logger="app.metrics"):
+        loaded = metrics.get_metrics().rows["/api/appointments"]
+        metrics.start_request()
+        names = [a.patient.name for a in db.session.execute(db.select(Appointment)).scalars()]
+        metrics.finish_request(Response())
+        assert metrics.get_metrics().rows["/api/appointments"] - loaded == 12
+    assert len(names) == 6
+    assert any("Possible N+1" in rec.getMessage() for rec in caplog.records)
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'hms_n_plus_one_total{endpoint="/api/appointments"} 1' in body
@@ -0,0 +1,43 @@
+import sqlite3
+from app import create_app
+from app.db import db
+from app.migrations import MIGRATIONS, migrate
+
+LEGACY_SCHEMA = """
+CREATE TABLE patients (id INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL, email VARCHAR(200) UNIQUE,
+    dob DATE NOT NULL, gender VARCHAR(16), phone VARCHAR(32), address VARCHAR(300),
+    created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL);
+CREATE TABLE doctors (id INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL, specialty VARCHAR(120),
+    email VARCHAR(200) UNIQUE, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL);
+CREATE TABLE appointments (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL REFERENCES patients (id),
+    doctor_id INTEGER NOT NULL REFERENCES doctors (id), visit_time DATETIME NOT NULL, notes VARCHAR(500),
+    status VARCHAR(32) NOT NULL, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL);
+INSERT INTO patients VALUES (1, 'Old Patient', NULL, '1970-01-01', NULL, NULL, NULL, '2020-01-01', '2020-01-01');
+INSERT INTO doctors VALUES (1, 'Dr Old', NULL, NULL, '2020-01-01', '2020-01-01');
+INSERT INTO appointments VALUES (1, 1, 1, '2030-01-01 09:00:00.000000', NULL, 'scheduled', '2020-01-01', '2020-01-01');
+"""
+
+
+def test_upgrades_a_database_created_before_migrations(tmp_path):
+    path = tmp_path / "legacy.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+
+    app = create_app(config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", "EMAIL_WORKERS": 0})
+    client = app.test_client()
+    with app.app_context():
+        with db.engine.connect() as conn:
+            versions = conn.exec_driver_sql("SELECT version FROM schema_migrations ORDER BY version").scalars()
+            assert list(versions) == [v for v, _ in MIGRATIONS]
+            indexes = conn.exec_driver_sql("PRAGMA index_list(appointments)").all()
+            assert {"ix_appointments_doctor_time", "ix_appointments_patient_time"} <= {r[1] for r in indexes}
+            ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'appointments'").scalar()
+            assert "AUTOINCREMENT" in ddl
+            triggers = conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'appointments'").scalars()
+            assert {"schedule_versions_ai", "appointments_deleted"} <= set(triggers)
+        assert migrate() == []
+        db.engine.dispose()
+
+    assert client.get("/api/appointments/1").get_json()["duration_minutes"] == 30
+    assert [p["name"] for p in client.get("/api/patients/search?q=old").get_json()] == ["Old Patient"]
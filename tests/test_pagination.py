@@ -0,0 +1,33 @@
+import json
+
+
+def test_keyset_pages(client):
+    for i in range(5):
+        client.post("/api/patients", json={"name": f"P{i}", "dob": "1990-01-01"})
+    seen, after = [], None
+    while True:
+        url = "/api/patients?limit=2" + (f"&after={after}" if after else "")
+        r = client.get(url)
+        assert r.status_code == 200
+        seen += [p["id"] for p in r.get_json()]
+        after = r.headers.get("X-Next-Cursor")
+        if not after:
+            break
+    assert seen == sorted(seen, reverse=True) and len(seen) == 5
+
+
+def test_appointment_cursor_and_stream(client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    d1 = client.post("/api/doctors", json={"name": "Dr 1"}).get_json()["id"]
+    d2 = client.post("/api/doctors", json={"name": "Dr 2"}).get_json()["id"]
+    for did, t in ((d1, "2030-01-01T10:00"), (d1, "2030-01-01T09:00"), (d2, "2030-01-01T09:00")):
+        client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did, "visit_time": t})
+    r = client.get("/api/appointments?limit=2")
+    first = r.get_json()
+    r = client.get("/api/appointments", query_string={"limit": 2, "after": r.headers["X-Next-Cursor"]})
+    assert [a["visit_time"] for a in first + r.get_json()] == [
+        "2030-01-01T09:00:00", "2030-01-01T09:00:00", "2030-01-01T10:00:00"]
+    r = client.get("/api/appointments?stream=1")
+    assert r.mimetype == "application/x-ndjson"
+    assert len([json.loads(line) for line in r.get_data(as_text=True).splitlines()]) == 3
+    assert client.get("/api/appointments?after=bogus").status_code == 400
@@ -0,0 +1,64 @@
+import re
+from sqlalchemy import event
+from app.db import db
+
+# A full scan is only acceptable for an unfiltered, LIMITed first page,
+# which walks the primary key or an index in order and stops early.
+FIRST_PAGE = re.compile(r"^SELECT (?:(?!\bWHERE\b).)* ORDER BY .* LIMIT", re.S)
+SINGLE_ROW_TABLES = {"patients_fts_sync"}
+
+
+def _exercise_crud(client):
+    pid = client.post("/api/patients", json={"name": "Ann Lee", "dob": "1990-01-01", "email": "ann@x.io"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr Who", "email": "who@x.io"}).get_json()["id"]
+    aid = client.post("/api/appointments", json={
+        "patient_id": pid, "doctor_id": did, "visit_time": "2030-01-01T09:00"}).get_json()["id"]
+    client.post("/api/patients/bulk", data="name,dob,email\nBo,1980-01-01,bo@x.io\n", content_type="text/csv")
+    for path in (f"/api/patients/{pid}", f"/api/appointments/{aid}",
+                 "/api/patients?limit=1", f"/api/patients?limit=1&after={pid + 1}",
+                 "/api/doctors?limit=1", f"/api/doctors?limit=1&after={did + 1}",
+                 "/api/appointments?limit=1", "/api/appointments?limit=1&after=2030-01-01T08:00:00,0",
+                 f"/api/doctors/{did}/free-slots?from=2030-01-01T08:00&to=2030-01-01T12:00",
+                 "/api/patients/search?q=lee",
+                 f"/api/archive/appointments?patient_id={pid}&limit=1",
+                 f"/api/archive/appointments?doctor_id={did}&limit=1",
+                 "/api/changes?since=1&limit=10", "/api/changes?entity=patients",
+                 "/api/appointments?limit=5&include=patient,doctor",
+                 f"/api/doctors/{did}/appointments?from=2030-01-01T00:00&to=2030-01-02T00:00&include=patient",
+                 f"/api/patients/{pid}/appointments?limit=5&after=2030-01-01T08:00:00,0"):
+        assert client.get(path).status_code == 200, path
+    client.patch(f"/api/patients/{pid}", json={"phone": "555"})
+    client.patch(f"/api/doctors/{did}", json={"specialty": "Time"})
+    client.patch(f"/api/appointments/{aid}", json={"visit_time": "2030-01-01T10:00"})
+    client.delete(f"/api/appointments/{aid}")
+    client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did, "visit_time": "2030-01-02T09:00"})
+    client.delete(f"/api/doctors/{did}")
+    client.delete(f"/api/patients/{pid}")
+
+
+def test_crud_queries_never_scan_tables(app, client):
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.setdefault(statement, parameters[0] if executemany else parameters)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            _exercise_crud(client)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        assert any("appointments.doctor_id = ?" in s for s in statements)
+
+        scans = []
+        with db.engine.connect() as conn:
+            for statement, params in statements.items():
+                plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params)]
+                bad = [step for step in plan
+                       if step.startswith("SCAN") and "VIRTUAL TABLE" not in step and step != "SCAN CONSTANT ROW"
+                       and step.split()[1] not in SINGLE_ROW_TABLES
+                       and not (FIRST_PAGE.match(statement) and not any("TEMP B-TREE" in s for s in plan))]
+                if bad:
+                    scans.append((" ".join(statement.split()), bad))
+    assert scans == [], "\n".join(map(str, scans))
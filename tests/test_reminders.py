@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from app import create_app
+from app.db import db
+from app.models import Appointment, OutboxEmail
+
+
+def _book(client, patient, doctor, when):
+    r = client.post("/api/appointments", json={"patient_id": patient, "doctor_id": doctor,
+                                               "visit_time": when.isoformat(timespec="minutes")})
+    assert r.status_code == 201, r.get_json()
+    return r.get_json()["id"]
+
+
+def _setup(client):
+    patient = client.post("/api/patients", json={"name": "Ann", "dob": "1990-01-01",
+                                                  "email": "ann@x.io"}).get_json()["id"]
+    doctor = client.post("/api/doctors", json={"name": "Dr. Bo"}).get_json()["id"]
+    return patient, doctor
+
+
+def _reminders():
+    return db.session.execute(db.select(OutboxEmail.body).where(OutboxEmail.subject == "Appointment Reminder")
+                              ).scalars().all()
+
+
+def test_reminders_follow_bookings_and_fire_once(app, client):
+    patient, doctor = _setup(client)
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    soon = _book(client, patient, doctor, now + timedelta(hours=2))     # inside the lead time
+    first = _book(client, patient, doctor, now + timedelta(hours=24, minutes=30))
+    moved = _book(client, patient, doctor, now + timedelta(hours=30))   # beyond the window
+    gone = _book(client, patient, doctor, now + timedelta(hours=26))
+    sched = app.extensions["hms_reminders"]
+    sched.horizon = timedelta(hours=4)
+    with app.app_context():
+        assert sched.refresh(now) == 2                                   # `soon` counts as reminded
+    later = _book(client, patient, doctor, now + timedelta(hours=27))   # pushed on commit
+    client.patch(f"/api/appointments/{moved}", json={"visit_time": (now + timedelta(hours=25)).isoformat()})
+    client.delete(f"/api/appointments/{gone}")
+    assert sched.stats()["queued"] == 3
+
+    with app.app_context():
+        assert sched.fire_due(now + timedelta(minutes=10)) == 0
+        assert sched.fire_due(now + timedelta(hours=1, minutes=5)) == 2
+        assert [int(b.split()[4]) for b in _reminders()] == [first, moved]
+        assert sched.fire_due(now + timedelta(hours=3, minutes=5)) == 1 and f"ID {later} " in _reminders()[-1]
+        assert sched.fire_due(now + timedelta(hours=4)) == 0
+        assert db.session.get(Appointment, soon).reminded_at is not None
+
+    # A reschedule after the reminder went out earns a new one
+    client.patch(f"/api/appointments/{first}", json={"visit_time": (now + timedelta(hours=24)).isoformat()})
+    with app.app_context():
+        assert sched.fire_due(now + timedelta(hours=1, minutes=6)) == 1
+        assert len(_reminders()) == 4
+
+
+def test_each_reminder_is_claimed_once_across_processes(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'reminders.db'}"
+    apps = [create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": uri}) for _ in range(2)]
+    client = apps[0].test_client()
+    patient, doctor = _setup(client)
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    for hours in range(25, 35):
+        _book(client, patient, doctor, now + timedelta(hours=hours))
+
+    fired = []
+    for app in apps:
+        with app.app_context():
+            app.extensions["hms_reminders"].refresh(now + timedelta(hours=5))
+            fired.append(app.extensions["hms_reminders"].fire_due(now + timedelta(hours=5)))
+    assert fired == [5, 0]
+    with apps[1].app_context():
+        assert len(_reminders()) == 5
+        plan = " ".join(r[-1] for r in db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT id FROM appointments WHERE status = 'scheduled' "
+            "AND reminded_at IS NULL AND visit_time > :a AND visit_time < :b"), {"a": now, "b": now}))
+        assert "ix_appointments_reminder_due" in plan and "SCAN" not in plan
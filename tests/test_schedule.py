@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from app.schedule import DoctorSchedule
+
+
+def _book(client, pid, did, t, minutes=30):
+    return client.post("/api/appointments", json={
+        "patient_id": pid, "doctor_id": did, "visit_time": t, "duration_minutes": minutes})
+
+
+def _setup(client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    return pid, did
+
+
+def test_overlaps_rejected(client):
+    pid, did = _setup(client)
+    other = client.post("/api/doctors", json={"name": "Dr 2"}).get_json()["id"]
+    assert _book(client, pid, did, "2030-01-01T09:00", 60).status_code == 201
+    assert _book(client, pid, did, "2030-01-01T09:30").status_code == 409
+    assert _book(client, pid, did, "2030-01-01T08:45").status_code == 409
+    assert _book(client, pid, did, "2030-01-01T10:00").status_code == 201  # back to back
+    assert _book(client, pid, other, "2030-01-01T09:30").status_code == 201
+    assert len(client.get("/api/appointments").get_json()) == 3
+
+
+def test_reschedule_cancel_and_free_slots(client):
+    pid, did = _setup(client)
+    a = _book(client, pid, did, "2030-01-01T09:00").get_json()["id"]
+    b = _book(client, pid, did, "2030-01-01T11:00").get_json()["id"]
+    assert client.patch(f"/api/appointments/{b}", json={"visit_time": "2030-01-01T09:15"}).status_code == 409
+    assert client.patch(f"/api/appointments/{a}", json={"visit_time": "2030-01-01T09:10"}).status_code == 200
+    r = client.get(f"/api/doctors/{did}/free-slots?from=2030-01-01T09:00&to=2030-01-01T12:00&length=60")
+    assert r.get_json() == [{"start": "2030-01-01T09:40:00", "end": "2030-01-01T11:00:00"}]
+    client.patch(f"/api/appointments/{b}", json={"status": "cancelled"})
+    assert _book(client, pid, did, "2030-01-01T11:00").status_code == 201
+    client.delete(f"/api/patients/{pid}")
+    r = client.get(f"/api/doctors/{did}/free-slots?from=2030-01-01T09:00&to=2030-01-01T12:00")
+    assert r.get_json() == [{"start": "2030-01-01T09:00:00", "end": "2030-01-01T12:00:00"}]
+    assert client.get(f"/api/doctors/{did}/free-slots?from=2030-01-01&to=2029-01-01").status_code == 400
+
+
+def test_doctor_schedule_unit():
+    t = datetime(2030, 1, 1, 9)
+    m = lambda n: timedelta(minutes=n)
+    s = DoctorSchedule([(t, t + m(30), 1), (t + m(60), t + m(90), 2)])
+    assert s.conflict(t + m(29), t + m(40)) == 1
+    assert s.conflict(t + m(30), t + m(60)) is None
+    assert s.conflict(t + m(10), t + m(70), ignore=1) == 2
+    s.remove(1, t)
+    assert len(s) == 1 and s.free_slots(t, t + m(120), m(30)) == [(t, t + m(60)), (t + m(90), t + m(120))]
+
+
+def test_schedules_stay_coherent_across_processes(tmp_path):
+    # Two apps on one database stand in for two serve workers.
+    from app import create_app
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'hms.db'}", "EMAIL_WORKERS": 0}
+    one, two = create_app(config=config).test_client(), create_app(config=config).test_client()
+    pid, did = _setup(one)
+    slots = f"/api/doctors/{did}/free-slots?from=2030-01-01T09:00&to=2030-01-01T11:00"
+    assert len(two.get(slots).get_json()) == 1  # worker two has the schedule loaded
+
+    a = _book(one, pid, did, "2030-01-01T09:00").get_json()["id"]
+    assert _book(two, pid, did, "2030-01-01T09:15").status_code == 409
+    b = _book(two, pid, did, "2030-01-01T10:00").get_json()["id"]
+    assert _book(one, pid, did, "2030-01-01T10:15").status_code == 409
+    one.patch(f"/api/appointments/{b}", json={"visit_time": "2030-01-01T10:30"})
+    one.delete(f"/api/appointments/{a}")
+    expected = [{"start": "2030-01-01T09:00:00", "end": "2030-01-01T10:30:00"}]
+    assert two.get(slots).get_json() == one.get(slots).get_json() == expected
+    assert _book(two, pid, did, "2030-01-01T09:00").status_code == 201
+    assert _book(one, pid, did, "2030-01-01T09:00").status_code == 409
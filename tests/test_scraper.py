@@ -0,0 +1,115 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app import create_app
+from app.scraper import get_fetcher, parse_articles
+
+NEWS = """<html><body>
+<div data-testid="card-text-wrapper"><h2> Measles  update </h2><p>Cases &amp; deaths</p></div>
+<div data-testid="card-text-wrapper"><div><h2>Nested</h2></div><p>Still found</p></div>
+<div data-testid="card-text-wrapper"><h2>No description</h2></div>
+</body></html>"""
+FACT = '<html><head><meta name="description" content="Malaria is preventable."></head></html>'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append((self.path, self.headers.get("If-None-Match")))
+        time.sleep(self.server.delay)
+        if self.server.down:
+            self.send_error(500)
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = (FACT if self.path.startswith("/facts/") else NEWS).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.hits, server.down, server.delay = [], False, 0
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def app(upstream):
+    base = f"http://127.0.0.1:{upstream.server_address[1]}"
+    return create_app(testing=True, config={
+        "INFO_SOURCES": [f"{base}/a", f"{base}/b"],
+        "DISEASE_FACTS_URL": base + "/facts/{name}",
+    })
+
+
+def test_parse_articles():
+    assert parse_articles(NEWS) == [
+        {"headline": "Measles update", "description": "Cases & deaths"},
+        {"headline": "Nested", "description": "Still found"},
+    ]
+
+
+def test_sources_fetched_once_then_cached(client, upstream):
+    r = client.get("/api/info/hospitals")
+    assert r.status_code == 200 and len(r.get_json()) == 4
+    assert sorted(p for p, _ in upstream.hits) == ["/a", "/b"]
+    client.get("/api/info/hospitals")
+    assert len(upstream.hits) == 2
+    assert client.get("/api/info/disease/Malaria").get_json()["fact"] == "Malaria is preventable."
+    assert upstream.hits[-1][0] == "/facts/malaria"
+
+
+def test_stale_while_revalidate_uses_conditional_get(app, client, upstream):
+    client.get("/api/info/disease/malaria")
+    with app.app_context():
+        fetcher = get_fetcher()
+    fetcher.ttl = 0
+    for entry in fetcher._cache.values():
+        entry.fresh_until = 0
+    assert client.get("/api/info/disease/malaria").get_json()["fact"] == "Malaria is preventable."
+    deadline = time.time() + 5
+    while fetcher.stats["not_modified"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert upstream.hits[-1] == ("/facts/malaria", '"v1"')
+    assert fetcher.stats["stale_hits"] == 1 and fetcher.stats["not_modified"] == 1
+
+
+def test_unreachable_upstream(client, upstream):
+    upstream.down = True
+    assert client.get("/api/info/hospitals").status_code == 503
+    hits = len(upstream.hits)
+    assert client.get("/api/info/disease/x").status_code == 503
+    assert client.get("/api/info/disease/x").status_code == 503  # backing off
+    assert len(upstream.hits) == hits + 1
+
+
+def test_failures_are_bounded_and_concurrent_misses_share_a_fetch(app, client, upstream):
+    upstream.down = True
+    with app.app_context():
+        fetcher = get_fetcher()
+    fetcher.maxsize = 8
+    for i in range(20):
+        assert client.get(f"/api/info/disease/x{i}").status_code == 503
+    assert len(fetcher._cache) == 8
+
+    upstream.down, upstream.delay = False, 0.2
+    hits = len(upstream.hits)
+    url = app.config["DISEASE_FACTS_URL"].format(name="flu")
+    threads = [threading.Thread(target=fetcher.get, args=(url, str)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(upstream.hits) == hits + 1 and fetcher.stats["coalesced"] == 3
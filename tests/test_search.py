@@ -0,0 +1,70 @@
+from app.db import db
+from app.search import FTS_TABLE
+
+
+def _names(client, q, **args):
+    r = client.get("/api/patients/search", query_string={"q": q, "fields": "name", **args})
+    assert r.status_code == 200, r.get_json()
+    return [p["name"] for p in r.get_json()], r
+
+
+def _seed(client):
+    for name, email, phone in [("Alice Smith", "alice@x.io", "555-1234"),
+                               ("Bob Smithers", "bob@y.io", "555-9999"),
+                               ("Carol", "smith@z.io", None),
+                               ("Goldsmith", "g@z.io", None)]:
+        client.post("/api/patients", json={"name": name, "dob": "1990-01-01", "email": email, "phone": phone})
+
+
+def test_ranked_search_and_pagination(client):
+    _seed(client)
+    names, r = _names(client, "SMITH")
+    assert names == ["Alice Smith", "Bob Smithers", "Carol", "Goldsmith"]
+    assert r.headers["X-Search-Ranked"] == "1"
+    assert _names(client, "ali smi")[0] == ["Alice Smith"]
+    assert _names(client, "555 99")[0] == ["Bob Smithers"]  # "99" is too short for the index: LIKE
+    assert _names(client, "x")[0] == ["Alice Smith"]
+    assert _names(client, "nobody")[0] == []
+
+    names, r = _names(client, "smith", limit=3)
+    assert names == ["Alice Smith", "Bob Smithers", "Carol"] and r.headers["X-Next-Cursor"] == "3"
+    assert _names(client, "smith", limit=3, after=3)[0] == ["Goldsmith"]
+    full = client.get("/api/patients/search?q=carol").get_json()
+    assert len(full) == 1 and full[0]["email"] == "smith@z.io" and "age" in full[0]
+
+    for query in ("", "q=%20", "q=smith&after=-1", "q=smith&fields=password"):
+        assert client.get(f"/api/patients/search?{query}").status_code == 400
+
+
+def test_large_result_sets_and_like_fallback(app, client):
+    _seed(client)
+    app.config["SEARCH_RANK_LIMIT"] = 2
+    names, r = _names(client, "smith")
+    assert names == ["Goldsmith", "Carol", "Bob Smithers", "Alice Smith"]  # newest first
+    assert r.headers["X-Search-Ranked"] == "0"
+    assert _names(client, "smith", limit=2, after=2)[0] == ["Bob Smithers", "Alice Smith"]
+
+    app.config["SEARCH_RANK_LIMIT"] = 1000
+    app.extensions["hms_fts"] = False  # e.g. SQLite built without FTS5
+    assert _names(client, "smith")[0] == ["Alice Smith", "Bob Smithers", "Carol", "Goldsmith"]
+    assert _names(client, "50%")[0] == []
+
+
+def test_index_follows_every_write_path(app, client):
+    pid = client.post("/api/patients", json={"name": "Dana Scully", "dob": "1990-01-01"}).get_json()["id"]
+    client.patch(f"/api/patients/{pid}", json={"name": "Dana Mulder"})
+    assert _names(client, "scully")[0] == []
+    assert _names(client, "mulder")[0] == ["Dana Mulder"]
+
+    csv = "name,dob,email\nFox Mulder,1961-10-13,fox@fbi.gov\nWalter Skinner,1952-02-08,ws@fbi.gov\n"
+    report = client.post("/api/patients/bulk", data=csv, content_type="text/csv").get_json()
+    assert report["inserted"] == 2
+    assert _names(client, "mulder")[0] == ["Fox Mulder", "Dana Mulder"]
+    assert _names(client, "skinner")[0] == ["Walter Skinner"]
+
+    client.delete(f"/api/patients/{pid}")
+    assert _names(client, "mulder")[0] == ["Fox Mulder"]
+    with app.app_context():
+        conn = db.session.connection()
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('integrity-check', 1)")
+        assert conn.exec_driver_sql(f"SELECT deferred FROM {FTS_TABLE}_sync").scalar() == 0
@@ -0,0 +1,55 @@
+import json
+from datetime import date, datetime
+from sqlalchemy import event
+from app.db import db
+from app.serializers import PATIENT, APPOINTMENT
+
+
+def test_encoder_matches_json_dumps():
+    row = (7, 'Zoë "Q" \\ O\'Neil', None, date(1990, 1, 2), "f", None, "1\n2", 35)
+    encoded = PATIENT.encoder(PATIENT.default)(row)
+    assert json.loads(encoded) == dict(zip(PATIENT.default, (
+        7, 'Zoë "Q" \\ O\'Neil', None, "1990-01-02", "f", None, "1\n2", 35)))
+    assert encoded.isascii()
+    fields = ("visit_time", "notes")
+    assert json.loads(APPOINTMENT.encoder(fields)((datetime(2030, 1, 1, 9), None))) == {
+        "visit_time": "2030-01-01T09:00:00", "notes": None}
+
+
+def test_shapes_and_sparse_fieldsets(app, client):
+    created = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01", "email": "a@x.io"}).get_json()
+    client.post("/api/patients", json={"name": "B", "dob": "1991-01-01"})
+    fetched = client.get(f"/api/patients/{created['id']}").get_json()
+    assert created == fetched == client.get("/api/patients").get_json()[1]
+    assert set(created) == set(PATIENT.default)
+
+    statements = []
+    with app.app_context():
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            r = client.get("/api/patients?fields=name,age&limit=1")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+    assert r.get_json() == [{"name": "B", "age": fetched["age"] - 1}]
+    select = statements[-1]
+    assert "strftime" in select.lower() and "address" not in select and "created_at" not in select
+    nxt = client.get(f"/api/patients?fields=name&after={r.headers['X-Next-Cursor']}").get_json()
+    assert nxt == [{"name": "A"}]
+
+    r = client.get("/api/patients?fields=name,password")
+    assert r.status_code == 400 and "password" in r.get_json()["error"]
+    assert client.get(f"/api/patients/{created['id']}?fields=email").get_json() == {"email": "a@x.io"}
+
+
+def test_appointment_fields_with_stream_and_cursor(client):
+    pid = client.post("/api/patients", json={"name": "A", "dob": "1990-01-01"}).get_json()["id"]
+    did = client.post("/api/doctors", json={"name": "Dr"}).get_json()["id"]
+    for t in ("2030-01-01T09:00", "2030-01-01T10:00"):
+        created = client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did, "visit_time": t})
+    assert created.get_json()["visit_time"] == "2030-01-01T10:00:00"
+    r = client.get("/api/appointments?fields=status&limit=1")
+    assert r.get_json() == [{"status": "scheduled"}]
+    assert r.headers["X-Next-Cursor"].startswith("2030-01-01T09:00:00,")
+    lines = client.get("/api/appointments?stream=1&fields=id,doctor_id").get_data(as_text=True).splitlines()
+    assert [set(json.loads(line)) for line in lines] == [{"id", "doctor_id"}] * 2
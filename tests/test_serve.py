@@ -0,0 +1,67 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from app.serve import on_warmup, warm_up, _warmup_hooks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_warm_up_runs_paths_and_hooks(app):
+    seen = []
+    hook = on_warmup(seen.append)
+    try:
+        app.config["SERVE_WARMUP_PATHS"] = ["/health", "/api/patients?limit=1"]
+        warm_up(app)
+    finally:
+        _warmup_hooks.remove(hook)
+    assert seen == [app]
+    assert app.extensions["hms_metrics"].requests["/api/patients", "GET", 200] == 1
+
+
+def test_reload_and_scaling_without_dropped_requests(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'serve.db'}", EMAIL_WORKERS="0",
+               DB_PROFILE="concurrent", SERVE_GRACEFUL_TIMEOUT="10")
+    proc = subprocess.Popen([sys.executable, "-m", "app.serve", "--port", "0", "--workers", "2"],
+                            cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True)
+    lines = []
+    threading.Thread(target=lambda: lines.extend(proc.stderr), daemon=True).start()
+
+    def wait_for(pattern, count=1):
+        deadline = time.monotonic() + 30
+        while sum(bool(re.search(pattern, line)) for line in lines) < count:
+            assert proc.poll() is None and time.monotonic() < deadline, "".join(lines)
+            time.sleep(0.05)
+
+    try:
+        wait_for("Generation 1 ready")
+        port = next(m.group(1) for m in map(re.compile(r"Listening on \S+:(\d+)").search, lines) if m)
+        errors, stop = [], threading.Event()
+
+        def call():
+            while not stop.is_set():
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/api/patients?limit=1", timeout=10).read()
+                except OSError as exc:
+                    errors.append(exc)
+        callers = [threading.Thread(target=call) for _ in range(3)]
+        for t in callers:
+            t.start()
+        proc.send_signal(signal.SIGHUP)   # re-exec, new generation, old one drained
+        wait_for("Generation 1 ready", 2)
+        proc.send_signal(signal.SIGTTIN)
+        wait_for(r"Worker \d+ ready", 5)
+        stop.set()
+        for t in callers:
+            t.join()
+        assert errors == []
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(20) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
@@ -0,0 +1,113 @@
+import pytest
+from app import create_app, crud, shards
+from app.db import db
+from app.models import Patient, Doctor
+
+
+@pytest.fixture()
+def app(tmp_path):
+    urls = [f"sqlite:///{tmp_path / name}.db" for name in ("primary", "shard1", "shard2")]
+    return create_app(testing=True, config={"SQLALCHEMY_DATABASE_URI": urls[0],
+                                            "SHARD_DATABASE_URLS": ",".join(urls[1:])})
+
+
+def _patients(client, n):
+    return [client.post("/api/patients", json={"name": f"P{i}", "dob": f"{1950 + i}-01-01",
+                                               "email": f"p{i}@x.io"}).get_json()["id"] for i in range(n)]
+
+
+def _rows(app, shard, model):
+    with app.app_context():
+        return db.session.execute(db.select(model.id), bind_arguments={"bind": shards.engine(shard)}).scalars().all()
+
+
+def test_patients_and_their_appointments_live_on_one_shard(app, client):
+    pids = _patients(client, 12)
+    assert {pid >> shards.SHARD_BITS for pid in pids} == {0, 1, 2}
+    did = client.post("/api/doctors", json={"name": "Dr. A", "specialty": "gp"}).get_json()["id"]
+    aids = [client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                                   "visit_time": f"2031-01-01T{8 + i:02d}:00"}).get_json()["id"]
+            for i, pid in enumerate(pids)]
+    for shard in range(3):
+        here = set(_rows(app, shard, Patient))
+        assert here and here == {pid for pid in pids if pid >> shards.SHARD_BITS == shard}
+        assert _rows(app, shard, Doctor) == [did]  # replicated everywhere
+    assert [a >> shards.SHARD_BITS for a in aids] == [p >> shards.SHARD_BITS for p in pids]
+
+    far = pids[[p >> shards.SHARD_BITS for p in pids].index(2)]
+    assert client.get(f"/api/patients/{far}").get_json()["email"] is not None
+    assert client.patch(f"/api/patients/{far}", json={"phone": "555"}).get_json()["phone"] == "555"
+    # Emails are unique across shards, also once a patient's email changes
+    with app.app_context():
+        moved = next(e for e in (f"m{i}@x.io" for i in range(100)) if shards.place(e) != far >> shards.SHARD_BITS)
+    assert client.patch(f"/api/patients/{far}", json={"email": moved}).status_code == 200
+    assert client.post("/api/patients", json={"name": "Q", "dob": "1990-01-01", "email": moved}).status_code == 409
+    assert client.patch(f"/api/patients/{pids[0]}", json={"email": moved}).status_code == 409
+    assert client.patch(f"/api/patients/{far}", json={"email": moved}).status_code == 200
+    aid = aids[pids.index(far)]
+    assert client.get(f"/api/appointments/{aid}?include=patient").get_json()["patient"]["id"] == far
+    assert client.get("/api/patients/99999999999999").status_code == 404
+
+    # Conflicts are checked against the doctor's bookings on every shard
+    clash = client.post("/api/appointments", json={"patient_id": pids[0], "doctor_id": did,
+                                                   "visit_time": f"2031-01-01T{8 + pids.index(far):02d}:10"})
+    assert clash.status_code == 409
+    other = next(p for p in pids if p >> shards.SHARD_BITS != far >> shards.SHARD_BITS)
+    assert client.patch(f"/api/appointments/{aid}", json={"patient_id": other}).status_code == 400
+
+    client.delete(f"/api/patients/{far}")
+    assert client.get(f"/api/appointments/{aid}").status_code == 404
+    with app.app_context():
+        crud.delete_doctor(did)
+    assert client.get("/api/appointments").get_json() == []
+    assert all(_rows(app, shard, Doctor) == [] for shard in range(3))
+
+
+def test_lists_merge_shards_in_order_across_pages(app, client):
+    pids = _patients(client, 10)
+    did = client.post("/api/doctors", json={"name": "Dr. B"}).get_json()["id"]
+    for i, pid in enumerate(pids):
+        client.post("/api/appointments", json={"patient_id": pid, "doctor_id": did,
+                                               "visit_time": f"2031-02-{10 - i:02d}T09:00"})
+
+    page = client.get("/api/patients?limit=4")
+    seen = [p["id"] for p in page.get_json()]
+    while "Link" in page.headers:
+        page = client.get(page.headers["Link"].split(">")[0][1:])
+        seen += [p["id"] for p in page.get_json()]
+    assert seen == sorted(pids, reverse=True)
+    streamed = client.get("/api/patients?stream=1").get_data(as_text=True).splitlines()
+    assert len(streamed) == 10
+
+    visits = client.get("/api/appointments?limit=3&include=patient").get_json()
+    assert [a["visit_time"][:10] for a in visits["appointments"]] == ["2031-02-01", "2031-02-02", "2031-02-03"]
+    assert {p["id"] for p in visits["patients"]} == {a["patient_id"] for a in visits["appointments"]}
+    assert len(client.get(f"/api/doctors/{did}/appointments").get_json()) == 10
+    assert [p["id"] for p in client.get("/api/patients/search?q=p7@x").get_json()] == [pids[7]]
+
+    etag = client.get("/api/patients").headers["ETag"]
+    client.delete(f"/api/patients/{pids[-1]}")
+    assert client.get("/api/patients", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_analytics_feed_reports_and_bulk_span_shards(app, client):
+    _patients(client, 6)
+    csv = "name,dob,email\n" + "".join(f"B{i},1980-01-01,b{i}@x.io\n" for i in range(9)) + "Dup,1980-01-01,p1@x.io\n"
+    report = client.post("/api/patients/bulk", data=csv, content_type="text/csv").get_json()
+    assert report["inserted"] == 9 and report["errors"][0]["error"] == "email already exists"
+    with app.app_context():
+        assert {shards.shard_of(p.id) for p in crud.list_patients()} == {0, 1, 2}
+    assert len(client.get("/api/patients/search?q=@x.io&limit=50").get_json()) == 15  # indexed on every shard
+    doctors = client.post("/api/doctors/bulk", data='{"name": "Dr. C"}\n{"name": "Dr. D"}\n',
+                          content_type="application/x-ndjson").get_json()
+    assert doctors["inserted"] == 2 and len(_rows(app, 2, Doctor)) == 2
+
+    body = client.get("/api/analytics/patients", query_string={"group_by": "gender"}).get_json()
+    assert body["total"] == 15
+    changes = client.get("/api/changes?entity=patients&limit=100").get_json()["changes"]
+    assert len(changes) == 15 and all(c["data"] for c in changes)
+
+    ages = client.get("/api/analytics/average-age?batch_size=2").get_json()["average_age"]
+    with app.app_context():
+        expected = sum(p.age for p in crud.list_patients()) / 15
+    assert ages == pytest.approx(expected)